@@ -0,0 +1,79 @@
+import logging
+
+import azure.functions as func
+
+# numpy and the graph code load on the first render, cached data is served
+# without them
+from shared_code import metrics
+from shared_code.cache import etag_matches, page_cache_from_env
+from shared_code.encoding import CONTENT_TYPES, accepted_encoding, compress
+from shared_code.mag import UpstreamError
+from shared_code.params import parse_params
+
+# encoded graphs by (query, n, full, format), settings as for the pages
+graphs = page_cache_from_env('DATA_CACHE')
+
+
+def render_data(query, n, full, format):
+    # '' if nothing was found, UpstreamError if the api failed
+    from shared_code.data import FORMATS, load_graph
+
+    graph, expr = load_graph(query, n, full=full)
+    if graph is None:
+        return ''
+    # as draw_plot counts them for the page
+    metrics.count('nodes', graph.number_of_nodes())
+    metrics.count('edges', graph.number_of_edges())
+    return FORMATS[format](graph, expr)
+
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    # graph nodes, edges, positions and attributes without the page,
+    # ?query=...&n=20|A|C&format=json|npz&full=1, ?timing=1 adds a
+    # Server-Timing header
+    try:
+        with metrics.request(
+                'graph_data', query=req.params.get('query'),
+                n=req.params.get('n'),
+                format=req.params.get('format')) as timings:
+            return metrics.annotate(req, serve(req), timings)
+    except Exception:
+        logging.exception('graph data failed')
+        return func.HttpResponse('something went south', status_code=500)
+
+
+def serve(req):
+    query, n = parse_params(req.params)
+    format = req.params.get('format') or 'json'
+    full = req.params.get('full') == '1'
+
+    if format not in CONTENT_TYPES:
+        return func.HttpResponse(
+            'format is one of ' + ', '.join(sorted(CONTENT_TYPES)),
+            status_code=400)
+
+    try:
+        body, etag = graphs.get_or_render(
+            (query, n, full, format),
+            lambda: render_data(query, n, full, format))
+    except UpstreamError:
+        logging.warning('the academic api failed for %r', query)
+        return func.HttpResponse(
+            'the academic api is not available', status_code=503,
+            headers={'Retry-After': '30'})
+    if not body:
+        return func.HttpResponse('nothing found', status_code=404)
+    encoding = None
+    if CONTENT_TYPES[format][1]:
+        encoding = accepted_encoding(req.headers.get('Accept-Encoding'))
+    body, etag = compress(body, etag, encoding)
+    headers = {
+        'content-type': CONTENT_TYPES[format][0],
+        'ETag': etag,
+        'Vary': 'Accept-Encoding',
+        'Cache-Control': 'public, max-age=0, must-revalidate'}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    if etag_matches(req.headers.get('If-None-Match'), etag):
+        return func.HttpResponse(status_code=304, headers=headers)
+    return func.HttpResponse(body, headers=headers)
@@ -1,31 +1,19 @@
-import logging
+import hashlib, json, logging, os
+import urllib.parse
 
 import azure.functions as func
 
-from jinja2 import Template
+# only the cache is imported up front: a cached page is served without
+# loading jinja2, numpy or bokeh, the graph code loads on the first render
+# and bokeh only when a plot is drawn (see benchmarks/bench_startup.py)
+from shared_code import metrics, params
+from shared_code.cache import (
+    MISSING, Inflight, Jobs, etag_matches, page_cache_from_env)
+from shared_code.mag import UpstreamError
+from shared_code.params import MODES, mode
 
-import http.client, urllib.request, urllib.parse, urllib.error, base64, json
 
-from bokeh.io import output_file, show
-from bokeh.models import (BoxZoomTool, Circle, HoverTool,
-                          MultiLine, Plot, Range1d,
-                          ResetTool, WheelZoomTool,
-                          TapTool, OpenURL, ColumnDataSource, HelpTool, Label)
-from bokeh.models.widgets.markups import Div
-from bokeh.layouts import Column
-from bokeh.palettes import Spectral4
-from bokeh.plotting import from_networkx, figure
-from bokeh.models.graphs import NodesAndLinkedEdges
-from bokeh.embed import components
-from bokeh.models.callbacks import CustomJS
-from bokeh.palettes import OrRd9, Blues9
-
-import networkx as nx
-
-import numpy as np
-
-
-t = Template("""
+page = """
 <html style="height:100vh;">
     <head>
         <script src="https://cdn.bokeh.org/bokeh/release/bokeh-2.0.2.min.js"
@@ -57,9 +45,54 @@ t = Template("""
                 {{ div|safe }}
             </div>
         </div>
+        <script>
+            // node columns arrive as codes into the categories carried by
+            // the renderer tags, decode them once the document is there
+            function decode(data, categories) {
+                var decoded = {};
+                for (var name in data) {
+                    var cats = categories[name];
+                    decoded[name] = cats ? Array.from(
+                        data[name], function(code) { return cats[code]; }) : data[name];
+                }
+                return decoded;
+            }
+            function withGraph(callback) {
+                var graph = Bokeh.documents.length ?
+                    Bokeh.documents[0].get_model_by_name('graph') : null;
+                if (!graph) {
+                    setTimeout(function() { withGraph(callback); }, 50);
+                    return;
+                }
+                callback(graph);
+            }
+            withGraph(function(graph) {
+                var source = graph.node_renderer.data_source;
+                source.data = decode(source.data, graph.tags[0].categories);
+            });
+            {% if poll %}
+            (function poll(url) {
+                fetch(url).then(function(response) {
+                    if (response.status == 202) {
+                        setTimeout(function() { poll(url); }, 1000);
+                    } else if (response.ok) {
+                        response.json().then(function(data) {
+                            withGraph(function(graph) {
+                                graph.layout_provider.graph_layout = data.layout;
+                                graph.node_renderer.data_source.data = decode(
+                                    data.nodes, data.categories);
+                                graph.edge_renderer.data_source.data = data.edges;
+                            });
+                        });
+                    }
+                });
+            })({{ poll|tojson }});
+            {% endif %}
+        </script>
     </body>
 </html>
-""")
+"""
+_template = None
 
 tooltips = """
     <div style="max-width : 300px">
@@ -102,284 +135,40 @@ code = """
         tooltip.innerHTML = tp;
     }"""
 
-# %%
-cm1 = Blues9
-cm2 = OrRd9
+# rendered pages by (query, n), see cache.page_cache_from_env for settings
+pages = page_cache_from_env()
 
-headers = {
-    # Request headers
-    'Content-Type': 'application/x-www-form-urlencoded',
-    'Ocp-Apim-Subscription-Key': '',
-}
+# progressive pages: a page missing from the cache is first sent with the
+# primary papers only, the page then polls ?part=references for the rest,
+# which is computed in the background (PROGRESSIVE=0 waits for everything)
+PROGRESSIVE = os.environ.get('PROGRESSIVE', '1') == '1'
+# seconds a poll waits for the references before answering 202
+POLL_WAIT = float(os.environ.get('PROGRESSIVE_WAIT', '10'))
+references = Jobs()
 
 
-# microsoft academic graph requests
-class ResponseError(Exception):
-    def __init__(self, errno, strerror):
-        self.errno = errno
-        self.strerror = strerror
-
-
-def interpret(query):
-    params = urllib.parse.urlencode({
-        'model': 'latest',
-        'count': '100',
-        'offset': '0',
-        'query': query,
-    })
-
-    try:
-        conn = http.client.HTTPSConnection('api.labs.cognitive.microsoft.com')
-        conn.request("POST", "/academic/v1.0/interpret", params, headers)
-        response = conn.getresponse()
-        data = response.read()
-        conn.close()
-        data_decoded = json.loads(data)
-        if 'Error' in data_decoded.keys():
-            raise ResponseError(
-                -100, 'got answer but error: ' + str(data_decoded))
-        return(data_decoded)
-    except Exception as e:
-        print("[Errno {0}] {1}".format(e.errno, e.strerror))
-        return(None)
-
-
-def evaluate(query, n=100):
-    params = urllib.parse.urlencode({
-        # Request parameters
-        'model': 'latest',
-        'count': n,
-        'offset': '0',
-        'orderby': '',
-        'attributes': 'Id,DN,Y,CC,J.JN,AA.AuId,AA.DAuN,AA.DAfN,RId,DOI',
-        'expr': query,
-    })
-
-    try:
-        conn = http.client.HTTPSConnection('api.labs.cognitive.microsoft.com')
-        conn.request("POST", "/academic/v1.0/evaluate", params, headers)
-        response = conn.getresponse()
-        data = response.read()
-        conn.close()
-        data_decoded = json.loads(data)
-        if 'Error' in data_decoded.keys():
-            raise ResponseError(
-                -100, 'got answer but error: ' + str(data_decoded))
-        return(data_decoded)
-    except Exception as e:
-        print("[Errno {0}] {1}".format(e.errno, e.strerror))
-        return(None)
-
-
-def prepare_data(query, n):
-    # %% convert the natural language request to a query
-    interpret_data = interpret(query)
-    # %% get the most likely query result
-    if 'interpretations' not in interpret_data.keys():
-        return 0, 0
-    exprs = [
-        e['rules'][0]['output']['value']
-        for e in interpret_data['interpretations']
-        if e['rules'][0]['output']['type'] == 'query']
-    eval_data = evaluate(exprs[0], n=n)
-    if 'entities' not in eval_data.keys():
-        return 0, 0
-    # %% process primary found papers
-    papers = [e for e in eval_data['entities']]
-    # strip incomplete
-    papers = [p for p in papers if 'DN' in p.keys()]
-    papers = [p for p in papers if 'AA' in p.keys()]
-    # papers = [p for p in papers if 'DAuN' in p['AA'].keys()]
-    papers = [p for p in papers if 'J' in p.keys()]
-    # papers = [p for p in papers if 'JN' in p['JN'].keys()]
-    papers = [p for p in papers if 'Y' in p.keys()]
-    papers = [p for p in papers if 'CC' in p.keys()]
-    for p in papers:
-        if 'DOI' not in p.keys():
-            p['DOI'] = 'unknown'
-    max_cit = max([p['CC'] for p in papers])
-    # create parallel array as this is the main identifier,
-    # should make sure to retain ordering stays aligned along the script
-    ids = [p['Id'] for p in papers]
-    # extract all references
-    rids = []
-    _ = [
-        rids.extend(ridsl)
-        for ridsl in [
-            p['RId']
-            for p in papers
-            if 'RId' in p.keys()]]
-    # get rid of reference ids that are already in the primary request
-    rids = [rid for rid in rids if rid not in ids]
-
-    # %% get the secondary found papers information
-    expr_ref = "Or(Id=" + ",Id=".join([str(rdi) for rdi in rids]) + ")"
-    eval_data_ref = evaluate(expr_ref, n=1000)
-    if 'entities' in eval_data.keys():
-        # %% process secondary found papers
-        papers_ref = [e for e in eval_data_ref['entities']]
-
-        # strip incomplete
-        papers_ref = [p for p in papers_ref if 'DN' in p.keys()]
-        papers_ref = [p for p in papers_ref if 'AA' in p.keys()]
-        # papers = [p for p in papers if 'DAuN' in p['AA'].keys()]
-        papers_ref = [p for p in papers_ref if 'J' in p.keys()]
-        # papers = [p for p in papers if 'JN' in p['JN'].keys()]
-        papers_ref = [p for p in papers_ref if 'Y' in p.keys()]
-        papers_ref = [p for p in papers_ref if 'CC' in p.keys()]
-        for p in papers_ref:
-            if 'DOI' not in p.keys():
-                p['DOI'] = 'unknown'
-        max_cit_ref = max([p['CC'] for p in papers_ref])
-        ids_ref = [p['Id'] for p in papers_ref]
-
-        # rids_ref = []
-        # _ = [
-        # rids_ref.extend(ridsl)
-        # for ridsl in [
-        #   e['RId']
-        #   for e in papers_ref
-        #   if 'RId' in e.keys()]]
-        # rids_ref = [rid for rid in rids_ref if rid not in ids]
-    else:
-        # print('no refdata')
-        papers_ref = []
-        ids_ref = []
-        max_cit_ref = 0
-
-    # max_cit = max([max_cit, max_cit_ref])
-    # %%
-    G = nx.Graph()
-    # add primary papers
-    for id, paper in zip(ids, papers):
-        color = cm2[int(8*(1-paper['CC']/max_cit))]
-        G.add_node(
-            id,
-            type='Primary Search Result',
-            color=color,
-            title=paper['DN'],
-            authors=', '.join([a['DAuN'] for a in paper['AA']]),
-            journal=paper['J']['JN'],
-            year=paper['Y'],
-            DOI=paper['DOI'],
-            size=20)
-    # add their references
-    for id, paper in zip(ids_ref, papers_ref):
-        color = cm1[int(8*(1-paper['CC']/max_cit_ref))]
-        G.add_node(
-            id,
-            type='Reference',
-            color=color,
-            title=paper['DN'],
-            authors=', '.join([a['DAuN'] for a in paper['AA']]),
-            journal=paper['J']['JN'],
-            year=paper['Y'],
-            DOI=paper['DOI'],
-            size=10)
-
-    # add connections from primaries to references
-    for p in papers:
-        if 'RId' in p.keys():
-            # between primaries
-            G.add_edges_from(
-                [(p['Id'], rid) for rid in p['RId'] if rid in ids])
-            # between primaries and references
-            G.add_edges_from(
-                [(p['Id'], rid) for rid in p['RId'] if rid in ids_ref])
-    # add connections between references
-    for p in papers_ref:
-        if 'RId' in p.keys():
-            G.add_edges_from(
-                [(p['Id'], rid) for rid in p['RId'] if rid in ids_ref])
-    return G, exprs[0]
-
-
-def prepare_data_authors(query):
-    # %% convert the natural language request to a query
-    interpret_data = interpret(query)
-    exprs = [
-        e['rules'][0]['output']['value']
-        for e in interpret_data['interpretations']
-        if e['rules'][0]['output']['type'] == 'query']
-
-    # for expr in exprs:
-    #    if 'AA.AuN=' in expr:
-    #        res_expr = expr
-    # else:
-    #    res_expr = exprs[0]
-
-    # %%
-    eval_data = evaluate(exprs[0], n=1000)
-    if 'entities' not in eval_data.keys():
-        return 0, 0
-    # %% process primary found papers
-    papers = [e for e in eval_data['entities']]
-    # strip incomplete
-    papers = [p for p in papers if 'DN' in p.keys()]
-    papers = [p for p in papers if 'AA' in p.keys()]
-    papers = [p for p in papers if 'J' in p.keys()]
-    papers = [p for p in papers if 'Y' in p.keys()]
-    papers = [p for p in papers if 'CC' in p.keys()]
-    for p in papers:
-        if 'DOI' not in p.keys():
-            p['DOI'] = 'unknown'
-    max_cit = max([p['CC'] for p in papers])
-    ids = [p['Id'] for p in papers]
-
-    authors = []
-    [
-        authors.extend(a)
-        for a in [
-            p['AA'] for p in papers]]
-    auids = [a['AuId'] for a in authors]
-    auids, auids_idx, auids_counts = np.unique(
-        auids, return_index=True, return_counts=True)
-    auids = [int(auid) for auid in auids]
-    authors = [authors[idx] for idx in auids_idx]
-
-    G = nx.Graph()
-    # add primary papers
-    for id, paper in zip(ids, papers):
-        color = cm2[int(8*(1-paper['CC']/max_cit))]
-
-        G.add_node(
-            id,
-            type='Publication',
-            color=color,
-            title=paper['DN'],
-            authors=', '.join([a['DAuN'] for a in paper['AA']]),
-            journal=paper['J']['JN'],
-            year=paper['Y'],
-            DOI=paper['DOI'],
-            size=15)
-    # add co-auhors
-    second_max = sorted(auids_counts)[-2]
-    for auid, author, occ in zip(auids, authors, auids_counts):
-        if max(auids_counts) == occ:
-            size = 20
-            color = cm1[0]
-        else:
-            size = 10
-            color = cm1[int(8*(1-occ/second_max))]
-        G.add_node(
-            auid,
-            type='Author',
-            color=color,
-            title=author['DAuN'],
-            authors=author['DAfN'],
-            journal='',
-            year='',
-            DOI='',
-            size=size)
-
-    # add connections from primaries to references
-    for p in papers:
-        if 'AA' in p.keys():
-            G.add_edges_from([(p['Id'], a['AuId']) for a in p['AA']])
-    return G, exprs[0]
+def template():
+    global _template
+    if _template is None:
+        from jinja2 import Template
+        _template = Template(page)
+    return _template
 
 
 def draw_plot(G, query, expr, type='publications'):
+    from bokeh.models import (BoxZoomTool, Circle, HoverTool, MultiLine,
+                              Range1d, ResetTool, WheelZoomTool, TapTool,
+                              HelpTool)
+    from bokeh.models.widgets.markups import Div
+    from bokeh.layouts import Column
+    from bokeh.plotting import figure
+    from bokeh.models.graphs import NodesAndLinkedEdges
+    from bokeh.embed import components
+    from bokeh.models.callbacks import CustomJS
+
+    from shared_code.graph import cm1, cm2
+    from shared_code.render import CATEGORICAL, csr_graph_renderer
+
     # plot
     plot = figure(
         x_range=Range1d(-1.1, 1.1), y_range=Range1d(-1.1, 1.1),
@@ -421,6 +210,15 @@ def draw_plot(G, query, expr, type='publications'):
             x=[-200000, ], y=[-200000, ],
             fill_color=cm1[3], size=10,
             legend_label='Co-Author, Color measures Collaboration')
+    if type == 'collaboration':
+        plot.circle(
+            x=[-200000, ], y=[-200000, ],
+            fill_color=cm1[3], size=10,
+            legend_label='Author, Color measures Publication Count')
+        plot.line(
+            x=[-200000, -200000], y=[-200000, -200000],
+            line_color='black', line_alpha=0.4, line_width=3,
+            legend_label='Line width measures Papers written together')
     plot.legend.background_fill_alpha = 0
     plot.legend.border_line_alpha = 0
     plot.legend.location = 'top_left'
@@ -448,13 +246,17 @@ def draw_plot(G, query, expr, type='publications'):
     plot.toolbar.active_scroll = zoom_tool
 
     # graph
-    graph_renderer = from_networkx(
-        G, nx.spring_layout, scale=1, center=(0, 0), seed=12345)
+    graph_renderer = csr_graph_renderer(
+        G, seed=12345, categorical=CATEGORICAL)
+    graph_renderer.name = 'graph'
     # normal
     graph_renderer.node_renderer.glyph = Circle(
         size="size", fill_color="color")
     graph_renderer.edge_renderer.glyph = MultiLine(
         line_alpha=0.2)
+    if G.weights is not None:
+        graph_renderer.edge_renderer.glyph = MultiLine(
+            line_alpha=0.4, line_width='width')
     # selection
     graph_renderer.node_renderer.selection_glyph = Circle(
         fill_color="color", fill_alpha=1, line_alpha=1)
@@ -474,61 +276,287 @@ def draw_plot(G, query, expr, type='publications'):
 
     # add everything
     plot.renderers.append(graph_renderer)
-    script, div = components(Column(children=[plot, div], sizing_mode="stretch_both"))
+    with metrics.stage('plot'):
+        script, div = components(Column(children=[plot, div], sizing_mode="stretch_both"))
+    metrics.count('nodes', G.number_of_nodes())
+    metrics.count('edges', G.number_of_edges())
+    metrics.count('plot_bytes', len(script.encode()))
     return script, div
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
-    try:
-        logging.info('Python HTTP trigger function processed a request.')
+select_options = [
+    {'value': '10', 'label': 'Pub. and Ref., n=10'},
+    {'value': '20', 'label': 'Pub. and Ref., n=20'},
+    {'value': '50', 'label': 'Pub. and Ref., n=50'},
+    {'value': 'A', 'label': 'Co-Authors'},
+    {'value': 'C', 'label': 'Collaborators'}]
+
+
+def render_graph(graph, expr, query, n, type='publications', poll=None):
+    plot_script, plot_div = draw_plot(graph, query, expr, type=type)
+    with metrics.stage('template'):
+        return template().render(
+            script=plot_script,
+            div=plot_div,
+            query=query,
+            select_options=select_options,
+            so=str(n),
+            poll=poll)
+
+
+def render_page(query, n):
+    # '' if nothing was found
+    from shared_code.data import load_graph
+
+    graph, expr = load_graph(query, n)
+    if graph is None:
+        return ''
+    return render_graph(graph, expr, query, n, type=mode(n))
+
+
+async def render_page_async(query, n):
+    # render_page with the api awaited and reduction, layout and bokeh on
+    # the cpu executor
+    from shared_code import aio
+    from shared_code.data import load_graph_async
+
+    graph, expr = await load_graph_async(query, n)
+    if graph is None:
+        return ''
+    return await aio.run_cpu(
+        render_graph, graph, expr, query, n, type=mode(n))
+
+
+def poll_url(query, n):
+    return '/api/http_request?' + urllib.parse.urlencode(
+        {'query': query, 'n': n, 'part': 'references'})
+
+
+def render_primaries(query, n):
+    from shared_code.graph import prepare_primaries
+
+    graph, expr = prepare_primaries(query, n=n)
+    if not expr:
+        return ''
+    return render_graph(graph, expr, query, n, poll=poll_url(query, n))
+
+
+async def render_primaries_async(query, n):
+    from shared_code import aio
+
+    graph, expr = await aio.prepare_primaries(query, n=n)
+    if not expr:
+        return ''
+    return await aio.run_cpu(
+        render_graph, graph, expr, query, n, poll=poll_url(query, n))
+
+
+def finish_references(query, n, graph, expr):
+    # graph data json of the full graph, the full page is cached on the way;
+    # '' if nothing was found
+    from shared_code.data import reduced
+    from shared_code.render import CATEGORICAL, graph_data
+
+    if not expr:
+        pages.put((query, n), '')
+        return ''
+    graph = reduced(graph, n)
+    pages.put((query, n), render_graph(graph, expr, query, n))
+    return json.dumps(graph_data(graph, categorical=CATEGORICAL))
+
+
+def compute_references(query, n):
+    # timed as a request of its own, it outlives the page that started it
+    from shared_code.graph import prepare_data
 
-        select_options = [
-            {'value': '10', 'label': 'Pub. and Ref., n=10'},
-            {'value': '20', 'label': 'Pub. and Ref., n=20'},
-            {'value': '50', 'label': 'Pub. and Ref., n=50'},
-            {'value': 'A', 'label': 'Co-Authors'}]
+    with metrics.request('references', query=query, n=n):
+        graph, expr = prepare_data(query, n=n)
+        return finish_references(query, n, graph, expr)
 
-        query = req.params.get('query')
-        n = req.params.get('n')
 
+async def compute_references_async(query, n):
+    from shared_code import aio
+
+    with metrics.request('references', query=query, n=n):
+        graph, expr = await aio.prepare_data(query, n=n)
+        body = await aio.run_cpu(finish_references, query, n, graph, expr)
+    references.put((query, n), body)
+    return body
+
+
+def references_body_response(req, body):
+    if body == '':
+        return func.HttpResponse(
+            '{"status": "nothing found"}', status_code=404, headers={
+                'content-type': 'application/json'})
+    if body is MISSING:
+        return func.HttpResponse(
+            '{"status": "pending"}', status_code=202, headers={
+                'content-type': 'application/json',
+                'Cache-Control': 'no-store',
+                'Retry-After': '1'})
+    etag = '"' + hashlib.sha1(body.encode()).hexdigest()[:20] + '"'
+    headers = {
+        'content-type': 'application/json',
+        'ETag': etag,
+        'Cache-Control': 'public, max-age=0, must-revalidate'}
+    if etag_matches(req.headers.get('If-None-Match'), etag):
+        return func.HttpResponse(status_code=304, headers=headers)
+    return func.HttpResponse(body, headers=headers)
+
+
+def references_response(req, query, n):
+    return references_body_response(req, references.result(
+        (query, n), lambda: compute_references(query, n), timeout=POLL_WAIT))
+
+
+def start_references(query, n):
+    # the running references task of (query, n), started unless done; in a
+    # fresh context, a task copies the context it is created in and would
+    # add its stages to the timings of the request that started it
+    import contextvars
+
+    return contextvars.Context().run(
+        inflight.start, ('references', query, n),
+        lambda: compute_references_async(query, n))
+
+
+async def references_response_async(req, query, n):
+    import asyncio
+
+    body = references.results.get((query, n))
+    if body is MISSING:
         try:
-            if not n:
-                n = '20'
-            n = int(n)
-            if n > 100:
-                n = 100
-            if n < 1:
-                n = 1
-        except Exception:
-            n = 'A'
-
-        if not(n == 'A'):
-            if not query:
-                query = 'metasurface'
-
-            graph, expr = prepare_data(query, n=n)
-            plot_script, plot_div = draw_plot(
-                graph, query, expr, type='publications')
-            return func.HttpResponse(t.render(
-                script=plot_script,
-                div=plot_div,
-                query=query,
-                select_options=select_options,
-                so=str(n)), headers={'content-type': 'text/html'})
-        else:
-            if not query:
-                query = 'federico capasso'
-
-            graph, expr = prepare_data_authors(query)
-            plot_script, plot_div = draw_plot(
-                graph, query, expr, type='authors')
-            return func.HttpResponse(t.render(
-                script=plot_script,
-                div=plot_div,
-                query=query,
-                select_options=select_options,
-                so=str(n)), headers={'content-type': 'text/html'})
-    except Exception:
-        print(Exception)
+            body = await asyncio.wait_for(
+                asyncio.shield(start_references(query, n)), POLL_WAIT)
+        except asyncio.TimeoutError:
+            pass
+    return references_body_response(req, body)
+
+
+def page_response(req, body, etag):
+    if not body:
         return func.HttpResponse(
-            'something went south', headers={'content-type': 'text/html'})
\ No newline at end of file
+            'nothing found', status_code=404,
+            headers={'content-type': 'text/html'})
+    headers = {
+        'content-type': 'text/html',
+        'ETag': etag,
+        'Cache-Control': 'public, max-age=0, must-revalidate'}
+    if etag_matches(req.headers.get('If-None-Match'), etag):
+        return func.HttpResponse(status_code=304, headers=headers)
+    return func.HttpResponse(body, headers=headers)
+
+
+def error_response():
+    return func.HttpResponse(
+        'something went south', headers={'content-type': 'text/html'})
+
+
+def unavailable_response(query):
+    # the api failed, nothing of it was cached so a retry asks again
+    logging.warning('the academic api failed for %r', query)
+    return func.HttpResponse(
+        'the academic api is not available, please try again later',
+        status_code=503,
+        headers={'content-type': 'text/html', 'Retry-After': '30'})
+
+
+def parse_params(req):
+    # (query, n) of a request, n is 1 to 100, 'A' for co-authors or 'C' for
+    # the collaborations between them
+    return params.parse_params(req.params)
+
+
+# pages and references being rendered, concurrent requests for the same
+# (query, n) wait for one render and share its upstream fetches
+inflight = Inflight()
+
+
+async def cached_page(key, render, render_async):
+    # pages.get_or_render for the event loop: a miss is rendered once on the
+    # loop however many requests wait for it, a stale entry is refreshed by
+    # the blocking render in the background as before
+    from shared_code.aio import on_disk
+
+    found = await on_disk(pages.disk, pages.get_or_refresh, key, render)
+    if found is MISSING:
+        async def render_and_store():
+            return await on_disk(
+                pages.disk, pages.put, key, await render_async())
+        return await inflight.run(('page',) + key, render_and_store)
+    return found
+
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    # every request logs its stage timings as one json line, ?timing=1 also
+    # returns them in a Server-Timing header
+    try:
+        query, n = parse_params(req)
+        with metrics.request(
+                'http_request', query=query, n=n,
+                part=req.params.get('part')) as timings:
+            try:
+                response = await serve(req, query, n)
+            except UpstreamError:
+                response = unavailable_response(query)
+            return metrics.annotate(req, response, timings)
+    except Exception:
+        logging.exception('rendering the page failed')
+        return error_response()
+
+
+async def serve(req, query, n):
+    from shared_code.aio import on_disk
+
+    if req.params.get('part') == 'references' and n not in MODES:
+        return await references_response_async(req, query, n)
+    if PROGRESSIVE and n not in MODES and await on_disk(
+            pages.disk, pages.get, (query, n)) is MISSING:
+        body, etag = await cached_page(
+            (query, n, 'primaries'),
+            lambda: render_primaries(query, n),
+            lambda: render_primaries_async(query, n))
+        # a search that found nothing has no references to wait for
+        if body and references.results.get((query, n)) is MISSING:
+            start_references(query, n)
+    else:
+        body, etag = await cached_page(
+            (query, n),
+            lambda: render_page(query, n),
+            lambda: render_page_async(query, n))
+    return page_response(req, body, etag)
+
+
+def main_sync(req: func.HttpRequest) -> func.HttpResponse:
+    # the blocking pipeline on the worker threads, selected with
+    # "entryPoint": "main_sync" in function.json
+    try:
+        query, n = parse_params(req)
+        with metrics.request(
+                'http_request', query=query, n=n,
+                part=req.params.get('part')) as timings:
+            try:
+                response = serve_sync(req, query, n)
+            except UpstreamError:
+                response = unavailable_response(query)
+            return metrics.annotate(req, response, timings)
+    except Exception:
+        logging.exception('rendering the page failed')
+        return error_response()
+
+
+def serve_sync(req, query, n):
+    if req.params.get('part') == 'references' and n not in MODES:
+        return references_response(req, query, n)
+    if PROGRESSIVE and n not in MODES \
+            and pages.get((query, n)) is MISSING:
+        body, etag = pages.get_or_render(
+            (query, n, 'primaries'), lambda: render_primaries(query, n))
+        if body:
+            references.submit(
+                (query, n), lambda: compute_references(query, n))
+    else:
+        body, etag = pages.get_or_render(
+            (query, n), lambda: render_page(query, n))
+    return page_response(req, body, etag)
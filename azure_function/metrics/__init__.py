@@ -0,0 +1,19 @@
+import os
+
+import azure.functions as func
+
+from shared_code import metrics
+
+# process totals of the stage timings and counters in the OpenMetrics text
+# format, for a scraper; off unless METRICS_ENDPOINT=1, each worker process
+# answers with its own totals
+ENABLED = os.environ.get('METRICS_ENDPOINT', '0') == '1'
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    if not ENABLED:
+        return func.HttpResponse('metrics are disabled', status_code=404)
+    return func.HttpResponse(
+        metrics.registry.openmetrics(), headers={
+            'content-type': CONTENT_TYPE, 'Cache-Control': 'no-store'})
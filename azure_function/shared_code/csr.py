@@ -0,0 +1,141 @@
+import hashlib
+
+import numpy as np
+
+# %%
+# node attributes every graph carries, in the order of the bokeh columns,
+# weight ranks nodes (citation count of papers, paper count of authors)
+COLUMNS = ('type', 'color', 'title', 'authors', 'journal', 'year', 'DOI',
+           'size', 'weight')
+
+
+class CSRGraph:
+    # undirected graph with nodes 0..n-1, node attributes as columns and
+    # the adjacency in compressed sparse row form (indptr, indices); the
+    # optional edge weights follow self.edges, repeated edges add up
+    def __init__(self, ids, columns, edges, weights=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.columns = columns
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        loops = edges[:, 0] == edges[:, 1]
+        edges = np.sort(edges[~loops], axis=1)
+        # unique (i, j) pairs with i < j
+        self.edges, inverse = edges, np.arange(len(edges))
+        if len(edges):
+            self.edges, inverse = np.unique(
+                edges, axis=0, return_inverse=True)
+        self.weights = None
+        if weights is not None:
+            weights = np.asarray(weights)[~loops]
+            self.weights = np.bincount(
+                inverse.ravel(), weights, len(self.edges)).astype(weights.dtype)
+        n = len(self.ids)
+        both = np.concatenate([self.edges, self.edges[:, ::-1]])
+        both = both[np.lexsort((both[:, 1], both[:, 0]))]
+        self.indices = both[:, 1]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(both[:, 0], minlength=n), out=self.indptr[1:])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def number_of_nodes(self):
+        return len(self.ids)
+
+    def number_of_edges(self):
+        return len(self.edges)
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def neighbors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def fingerprint(self, *extra):
+        # hash of the sorted node and edge ids
+        h = hashlib.sha1()
+        h.update(np.sort(self.ids).tobytes())
+        pairs = np.sort(self.ids[self.edges], axis=1)
+        if len(pairs):
+            pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        h.update(pairs.tobytes())
+        h.update(repr(extra).encode())
+        return h.hexdigest()
+
+    def subgraph(self, keep):
+        # graph of the nodes selected by the boolean mask or index array keep
+        keep = np.asarray(keep)
+        if keep.dtype != bool:
+            mask = np.zeros(len(self.ids), dtype=bool)
+            mask[keep] = True
+            keep = mask
+        new = np.full(len(self.ids), -1, dtype=np.int64)
+        new[keep] = np.arange(keep.sum())
+        edges = new[self.edges]
+        valid = (edges >= 0).all(axis=1)
+        columns = {
+            name: _take(values, keep) for name, values in self.columns.items()}
+        return CSRGraph(
+            self.ids[keep], columns, edges[valid], self.edge_weights(valid))
+
+    def edge_weights(self, keep):
+        return None if self.weights is None else self.weights[keep]
+
+    def edge_subgraph(self, keep):
+        # the same nodes with the edges selected by keep
+        return CSRGraph(
+            self.ids, self.columns, self.edges[keep], self.edge_weights(keep))
+
+    def to_networkx(self):
+        # optional export, e.g. for the spring layout
+        import networkx as nx
+        G = nx.Graph()
+        ids = self.ids.tolist()
+        names = list(self.columns)
+        values = [_tolist(self.columns[name]) for name in names]
+        for i, id in enumerate(ids):
+            G.add_node(id, **{name: v[i] for name, v in zip(names, values)})
+        if self.weights is None:
+            G.add_edges_from(self.ids[self.edges].tolist())
+        else:
+            G.add_weighted_edges_from(
+                (a, b, w) for (a, b), w in zip(
+                    self.ids[self.edges].tolist(), self.weights.tolist()))
+        return G
+
+
+def _take(values, keep):
+    if isinstance(values, np.ndarray):
+        return values[keep]
+    return [v for v, k in zip(values, keep) if k]
+
+
+def _tolist(values):
+    return values.tolist() if isinstance(values, np.ndarray) else values
+
+
+class GraphBuilder:
+    # collects nodes and id pairs, the first node added with an id wins
+    def __init__(self):
+        self.index = {}
+        self.columns = dict((name, []) for name in COLUMNS)
+        self.pairs = []
+
+    def add_node(self, id, **attributes):
+        if id in self.index:
+            return
+        self.index[id] = len(self.index)
+        for name in COLUMNS:
+            self.columns[name].append(attributes[name])
+
+    def add_edges_from(self, pairs):
+        self.pairs.extend(pairs)
+
+    def build(self):
+        index = self.index
+        edges = [(index[a], index[b]) for a, b in self.pairs
+                 if a in index and b in index]
+        columns = dict(self.columns)
+        columns['size'] = np.asarray(columns['size'], dtype=np.int64)
+        columns['weight'] = np.asarray(columns['weight'], dtype=np.int64)
+        return CSRGraph(list(index), columns, edges)
@@ -0,0 +1,120 @@
+import io, json
+
+import numpy as np
+
+from shared_code import graph as blocking
+from shared_code.csr import _tolist
+from shared_code.graph import PRIMARY
+from shared_code.layout import layout
+from shared_code.params import mode
+from shared_code.reduce import reduce_graph
+
+# %%
+# digits kept of the positions, the plot spans -1..1
+DIGITS = 4
+# string columns sent as categories and codes when they repeat this much
+CATEGORICAL = 0.5
+
+
+def prepare(source, query, n):
+    # the prepare call building the graph of n, source is shared_code.graph
+    # or shared_code.aio (whose calls are awaited)
+    if mode(n) == 'authors':
+        return source.prepare_data_authors(query)
+    if mode(n) == 'collaboration':
+        return source.prepare_collaboration(query)
+    return source.prepare_data(query, n=n)
+
+
+# what the collapsed nodes of a mode are
+NOUNS = {'publications': 'papers', 'authors': 'papers and authors',
+         'collaboration': 'authors'}
+
+
+def reduced(graph, n):
+    # the graph of n as drawn on the page
+    return reduce_graph(
+        graph, primary=PRIMARY if mode(n) == 'publications' else None,
+        noun=NOUNS[mode(n)])
+
+
+def load_graph(query, n, full=False):
+    # (graph, expr) as drawn on the page, (None, expr) if nothing was found,
+    # full=True skips the reduction
+    graph, expr = prepare(blocking, query, n)
+    if not expr:
+        return None, expr
+    return (graph if full else reduced(graph, n)), expr
+
+
+async def load_graph_async(query, n, full=False):
+    # load_graph with the api awaited and the reduction on the cpu executor
+    from shared_code import aio
+    graph, expr = await prepare(aio, query, n)
+    if not expr:
+        return None, expr
+    if not full:
+        graph = await aio.run_cpu(reduced, graph, n)
+    return graph, expr
+
+
+def categorize(values):
+    # (categories, codes) with the smallest unsigned code type
+    categories, codes = np.unique(
+        np.asarray(values, dtype=str), return_inverse=True)
+    return categories.tolist(), codes.astype(
+        np.min_scalar_type(max(len(categories) - 1, 0)))
+
+
+def categorical(values):
+    # {'categories', 'codes'} if the values repeat enough, else the values
+    categories, codes = categorize(values)
+    if len(categories) > CATEGORICAL * len(values):
+        return values
+    return {'categories': categories, 'codes': codes.tolist()}
+
+
+def columnar(graph, seed=12345):
+    # nodes as columns, edges as node positions in those columns
+    pos = np.round(
+        layout(graph, scale=1, center=(0, 0), seed=seed), DIGITS)
+    nodes = {'id': graph.ids.tolist(), 'x': pos[:, 0].tolist(),
+             'y': pos[:, 1].tolist()}
+    for name, values in graph.columns.items():
+        if isinstance(values, np.ndarray):
+            nodes[name] = values.tolist()
+        else:
+            nodes[name] = categorical(values)
+    edges = {
+        'source': graph.edges[:, 0].tolist(),
+        'target': graph.edges[:, 1].tolist()}
+    if graph.weights is not None:
+        edges['weight'] = graph.weights.tolist()
+    return {'nodes': nodes, 'edges': edges}
+
+
+def to_json(graph, expr, seed=12345):
+    data = {'expr': expr}
+    data.update(columnar(graph, seed=seed))
+    return json.dumps(data, separators=(',', ':'))
+
+
+def to_npz(graph, expr, seed=12345):
+    # the same columns as numpy arrays in a zip, np.load reads them without
+    # pickle; strings are fixed width, the zip compression takes care of it
+    pos = layout(graph, scale=1, center=(0, 0), seed=seed)
+    arrays = {
+        'expr': np.array(expr), 'id': graph.ids,
+        'x': pos[:, 0], 'y': pos[:, 1], 'edges': graph.edges}
+    if graph.weights is not None:
+        arrays['edge_weight'] = graph.weights
+    for name, values in graph.columns.items():
+        arrays[name] = np.asarray(_tolist(values), dtype=(
+            None if isinstance(values, np.ndarray) else str))
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+# render function by format, see encoding.CONTENT_TYPES
+FORMATS = {'json': to_json, 'npz': to_npz}
@@ -0,0 +1,314 @@
+import collections, itertools, os
+
+import numpy as np
+
+from shared_code import metrics
+from shared_code.csr import CSRGraph, GraphBuilder, _take
+from shared_code.mag import AcademicApi, CHUNK_SIZE
+from shared_code.papers import Papers, normalize
+from shared_code.store import get_graph_store
+
+# %%
+# bokeh's Blues9 and OrRd9, copied so building graphs does not load bokeh
+cm1 = ('#08306b', '#08519c', '#2171b5', '#4292c6', '#6baed6', '#9ecae1',
+       '#c6dbef', '#deebf7', '#f7fbff')
+cm2 = ('#7f0000', '#b30000', '#d7301f', '#ef6548', '#fc8d59', '#fdbb84',
+       '#fdd49e', '#fee8c8', '#fff7ec')
+
+PRIMARY = 'Primary Search Result'
+
+# 'api' asks the academic api, 'local' the store filled by shared_code.ingest
+BACKEND = os.environ.get('BACKEND', 'api')
+# citation hops followed from the primaries, per hop at most HOP_NODES
+# papers in at most HOP_CALLS reference requests are fetched, and only the
+# HOP_EXPAND most cited papers of a hop are followed further
+DEPTH = int(os.environ.get('GRAPH_DEPTH', '1'))
+HOP_NODES = int(os.environ.get('GRAPH_HOP_NODES', '5000'))
+HOP_CALLS = int(os.environ.get('GRAPH_HOP_CALLS', '50'))
+HOP_EXPAND = int(os.environ.get('GRAPH_HOP_EXPAND', '200'))
+# co-author graphs are built from up to GRAPH_AUTHOR_PAPERS papers, fetched
+# page by page until GRAPH_AUTHOR_NODES papers and authors are found
+AUTHOR_PAPERS = int(os.environ.get('GRAPH_AUTHOR_PAPERS', '1000'))
+AUTHOR_NODES = int(os.environ.get('GRAPH_AUTHOR_NODES', '5000'))
+# collaboration graphs (authors only, edges weighted by shared papers) keep
+# an edge of at least GRAPH_COLLAB_MIN_WEIGHT papers if it is among the
+# GRAPH_COLLAB_TOP_K heaviest edges of one of its authors
+COLLAB_MIN_WEIGHT = int(os.environ.get('GRAPH_COLLAB_MIN_WEIGHT', '1'))
+COLLAB_TOP_K = int(os.environ.get('GRAPH_COLLAB_TOP_K', '10'))
+
+
+def get_backend():
+    if BACKEND == 'local':
+        return get_graph_store()
+    return AcademicApi()
+
+
+def citation_edges(papers, papers_ref):
+    # primaries link to primaries and references, references only to
+    # references, membership is tested against hashed id sets
+    ids_ref = set(p.Id for p in papers_ref)
+    ids_all = ids_ref.union(p.Id for p in papers)
+    for source, targets in ((papers, ids_all), (papers_ref, ids_ref)):
+        for p in source:
+            for rid in p.rids:
+                if rid in targets:
+                    yield p.Id, rid
+
+
+def shade(cm, value, max_value):
+    return cm[int(8*(1-value/max(max_value, 1)))]
+
+
+@metrics.timed('build')
+def build_graph(papers, *levels):
+    # primaries plus one Papers of references per citation hop
+    papers_ref = Papers(
+        itertools.chain(*levels),
+        max([level.max_cit for level in levels] + [0]))
+    G = GraphBuilder()
+    # add primary papers
+    for paper in papers:
+        G.add_node(
+            paper.Id,
+            type=PRIMARY,
+            color=shade(cm2, paper.citations, papers.max_cit),
+            title=paper.title,
+            authors=paper.author_names,
+            journal=paper.journal,
+            year=paper.year,
+            DOI=paper.DOI,
+            size=20,
+            weight=paper.citations)
+    # add their references
+    for hop, level in enumerate(levels):
+        for paper in level:
+            G.add_node(
+                paper.Id,
+                type='Reference' if hop == 0 else
+                'Reference, {0} hops'.format(hop + 1),
+                color=shade(cm1, paper.citations, papers_ref.max_cit),
+                title=paper.title,
+                authors=paper.author_names,
+                journal=paper.journal,
+                year=paper.year,
+                DOI=paper.DOI,
+                size=10 if hop == 0 else 7,
+                weight=paper.citations)
+    G.add_edges_from(citation_edges(papers, papers_ref))
+    return G.build()
+
+
+def hops(papers, depth=DEPTH, max_nodes=HOP_NODES, max_calls=HOP_CALLS,
+         width=HOP_EXPAND):
+    # breadth-first walk over RId: yields the ids to fetch for each hop and
+    # is sent back their Papers, so blocking and async callers share it;
+    # ids are requested once over all hops, a pruned frontier keeps the ids
+    # cited most often by the previous hop and only its most cited papers
+    # are followed
+    seen = set(p.Id for p in papers)
+    budget = min(max_nodes, max_calls * CHUNK_SIZE)
+    frontier = papers
+    for hop in range(depth):
+        counts = collections.Counter(
+            rid for p in frontier for rid in p.rids if rid not in seen)
+        if not counts:
+            break
+        if len(counts) <= budget:
+            ids = list(counts)
+        else:
+            ids = [rid for rid, _ in counts.most_common(budget)]
+        seen.update(ids)
+        level = yield ids
+        frontier = sorted(level, key=lambda p: -p.citations)[:width]
+
+
+@metrics.timed('references')
+def expand(backend, papers, depth=DEPTH, **kwargs):
+    # one Papers per hop, see hops
+    levels = []
+    walk = hops(papers, depth=depth, **kwargs)
+    ids = next(walk, None)
+    while ids is not None:
+        levels.append(normalize(backend.fetch(ids)))
+        try:
+            ids = walk.send(levels[-1])
+        except StopIteration:
+            ids = None
+    return levels
+
+
+def search_papers(query, n, backend):
+    # %% get the most likely query result
+    return found_papers(*backend.search(query, n))
+
+
+def found_papers(expr, entities):
+    if not entities:
+        return None, 0
+    # %% process primary found papers, this also collects their references
+    # without the ones already in the primary request
+    papers = normalize(entities)
+    return papers or None, expr
+
+
+def prepare_primaries(query, n, backend=None):
+    # graph of the primary papers only, the first stage of a progressive page
+    papers, expr = search_papers(query, n, backend or get_backend())
+    if papers is None:
+        return 0, 0
+    return build_graph(papers), expr
+
+
+def prepare_data(query, n, backend=None, depth=DEPTH):
+    backend = backend or get_backend()
+    papers, expr = search_papers(query, n, backend)
+    if papers is None:
+        return 0, 0
+
+    # %% get the secondary found papers information, depth hops deep
+    # (the api backend only requests ids missing from the entity store)
+    levels = expand(backend, papers, depth=depth)
+    return build_graph(papers, *levels), expr
+
+
+def prepare_data_authors(query, backend=None):
+    papers, expr = author_papers(query, backend or get_backend())
+    if papers is None:
+        return 0, 0
+    return authors_graph(papers), expr
+
+
+def prepare_collaboration(query, backend=None, min_weight=COLLAB_MIN_WEIGHT,
+                          top_k=COLLAB_TOP_K):
+    # the co-authors of the same search, projected onto the authors
+    papers, expr = author_papers(query, backend or get_backend())
+    if papers is None:
+        return 0, 0
+    graph = collaboration_graph(papers, min_weight, top_k)
+    # papers without any listed author leave no node, nothing was found
+    if not len(graph):
+        return 0, 0
+    return graph, expr
+
+
+def author_papers(query, backend):
+    # %% pages are normalized as they arrive, no more are requested once
+    # the graph has enough nodes
+    expr, found = backend.search_pages(query, AUTHOR_PAPERS, mode='authors')
+    return found_papers(
+        expr, within_budget(found, NodeBudget(AUTHOR_NODES, author_nodes)))
+
+
+class NodeBudget:
+    # distinct graph nodes of the entities added so far, nodes(entity)
+    # lists the ids an entity contributes
+    def __init__(self, max_nodes, nodes):
+        self.max_nodes = max_nodes
+        self.nodes = nodes
+        self.seen = set()
+
+    def add(self, entities):
+        # True once the budget is used up
+        for e in entities:
+            self.seen.update(self.nodes(e))
+        return len(self.seen) >= self.max_nodes
+
+
+def author_nodes(entity):
+    return [('paper', entity.get('Id'))] + [
+        ('author', a.get('AuId')) for a in entity.get('AA') or ()]
+
+
+def within_budget(pages, budget):
+    # the entities of pages, taken page by page until budget is used up
+    for page in pages:
+        full = budget.add(page)
+        yield from page
+        if full:
+            return
+
+
+@metrics.timed('build')
+def authors_graph(papers):
+    # %% primary papers and their authors, from the paper x author matrix
+    from shared_code import coauthors
+
+    matrix, auids, authors = coauthors.incidence(papers)
+    counts = coauthors.paper_counts(matrix)
+    # the most listed authors are drawn big and dark, the others shaded up
+    # to the second highest count
+    top = counts == counts.max(initial=0)
+    shades = coauthors.buckets(counts, coauthors.second_max(counts))
+    shades[top] = 0
+
+    ids = np.concatenate([
+        np.fromiter((p.Id for p in papers), dtype=np.int64,
+                    count=len(papers)), auids])
+    columns = {
+        'type': ['Publication'] * len(papers) + ['Author'] * len(auids),
+        'color': [shade(cm2, p.citations, papers.max_cit) for p in papers]
+        + [cm1[i] for i in shades.tolist()],
+        'title': [p.title for p in papers] + [a[1] for a in authors],
+        'authors': [p.author_names for p in papers] + [a[2] for a in authors],
+        'journal': [p.journal for p in papers] + [''] * len(auids),
+        'year': [p.year for p in papers] + [''] * len(auids),
+        'DOI': [p.DOI for p in papers] + [''] * len(auids),
+        'size': np.concatenate([
+            np.full(len(papers), 15, dtype=np.int64),
+            np.where(top, 20, 10)]),
+        'weight': np.concatenate([
+            np.fromiter((p.citations for p in papers), dtype=np.int64,
+                        count=len(papers)), counts])}
+    # edges from the primaries to their authors, by position
+    rows, cols = matrix.nonzero()
+    edges = np.stack([rows, len(papers) + cols], axis=1)
+    return distinct_nodes(ids, columns, edges)
+
+
+@metrics.timed('build')
+def collaboration_graph(papers, min_weight=COLLAB_MIN_WEIGHT,
+                        top_k=COLLAB_TOP_K):
+    # authors only, linked by the number of papers they wrote together;
+    # authors left without a link are dropped, the most listed ones stay
+    from shared_code import coauthors
+
+    matrix, auids, authors = coauthors.incidence(papers)
+    counts = coauthors.paper_counts(matrix)
+    weights = coauthors.collaboration(matrix)
+    weights.data[weights.data < min_weight] = 0
+    weights.eliminate_zeros()
+    # an edge stays if one of its ends ranks it in its top_k
+    edges, edge_weights = coauthors.pairs(
+        coauthors.top_collaborators(weights, top_k))
+
+    most = counts == counts.max(initial=0)
+    linked = most.copy()
+    linked[edges.ravel()] = True
+    shades = coauthors.buckets(counts, coauthors.second_max(counts))
+    shades[most] = 0
+    position = np.cumsum(linked) - 1
+    names = [a for a, keep in zip(authors, linked.tolist()) if keep]
+    columns = {
+        'type': ['Author'] * len(names),
+        'color': [cm1[i] for i in shades[linked].tolist()],
+        'title': [a[1] for a in names],
+        'authors': [a[2] for a in names],
+        'journal': [''] * len(names),
+        'year': [''] * len(names),
+        'DOI': [''] * len(names),
+        'size': np.where(most, 20, 10)[linked],
+        'weight': counts[linked]}
+    return CSRGraph(auids[linked], columns, position[edges], edge_weights)
+
+
+def distinct_nodes(ids, columns, edges):
+    # CSRGraph of nodes given by position, where an id comes up again the
+    # first node wins and edges of the others move to it (as GraphBuilder)
+    _, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+    keep = np.zeros(len(ids), dtype=bool)
+    keep[first] = True
+    position = (np.cumsum(keep) - 1)[first[inverse]]
+    return CSRGraph(
+        ids[keep],
+        dict((name, _take(values, keep)) for name, values in columns.items()),
+        position[edges])
@@ -0,0 +1,244 @@
+import os, time
+
+import numpy as np
+
+from shared_code import metrics
+from shared_code.cache import MISSING, from_env
+
+# %%
+# 'force' is the numpy layout below, 'spring' the networkx one it replaced
+LAYOUT = os.environ.get('LAYOUT', 'force')
+ITERATIONS = int(os.environ.get('LAYOUT_ITERATIONS', '50'))
+# seconds, 0 for none: with a budget the iteration count is lowered after
+# the first iteration to what fits and the cooling is spread over the
+# rest, so the layout then depends on the speed of the machine
+TIME_BUDGET = float(os.environ.get('LAYOUT_TIME_BUDGET', '0'))
+# nodes per cell on the finest repulsion grid, at most MAX_GRID cells a side
+LEAF_SIZE = 8
+MAX_GRID = 512
+# graphs sharing at least this share of the nodes of the smaller of the two
+# graphs with a cached layout start from its positions and only run a few
+# refinement iterations, so a grown graph is warm started from its original
+WARM_OVERLAP = float(os.environ.get('LAYOUT_WARM_OVERLAP', '0.5'))
+WARM_ITERATIONS = int(os.environ.get('LAYOUT_WARM_ITERATIONS', '10'))
+
+# positions at scale 1 by graph fingerprint, LAYOUT_CACHE_DIR persists them
+cache = from_env('LAYOUT_CACHE', maxsize=64)
+
+
+def _expand(starts, counts):
+    # concatenated ranges starts[i] ... starts[i] + counts[i]
+    total = counts.sum()
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + np.arange(total) - offsets
+
+
+def _cells(pos, lo, size, g):
+    ij = np.minimum(((pos - lo) / size * g).astype(np.int64), g - 1)
+    return ij[:, 0], ij[:, 1]
+
+
+def _repulsion(pos, k2, levels):
+    # fruchterman-reingold repulsion k^2/d on a grid hierarchy: exact
+    # between nodes in neighbouring cells of the finest grid, from cell
+    # centres of mass further out, each level only handles the cells that
+    # the parent level counted as neighbours (n log n overall)
+    n = len(pos)
+    lo = pos.min(axis=0)
+    size = max((pos.max(axis=0) - lo).max(), 1e-9) * (1 + 1e-9)
+    disp = np.zeros_like(pos)
+    dx, dy = np.meshgrid(np.arange(-3, 4), np.arange(-3, 4), indexing='ij')
+    for g in levels[1:]:
+        ix, iy = _cells(pos, lo, size, g)
+        cell = ix * g + iy
+        mass = np.bincount(cell, minlength=g * g).astype(float)
+        com = np.stack([
+            np.bincount(cell, pos[:, 0], g * g),
+            np.bincount(cell, pos[:, 1], g * g)], axis=1)
+        com /= np.maximum(mass, 1)[:, None]
+        # children of the parent's 3x3 block that are not in the own one
+        x = ix[:, None, None] + dx
+        y = iy[:, None, None] + dy
+        far = ((np.abs(dx) > 1) | (np.abs(dy) > 1)) \
+            & (np.abs(x // 2 - (ix // 2)[:, None, None]) <= 1) \
+            & (np.abs(y // 2 - (iy // 2)[:, None, None]) <= 1) \
+            & (x >= 0) & (x < g) & (y >= 0) & (y < g)
+        rows, _, _ = np.nonzero(far)
+        other = (x * g + y)[far]
+        keep = mass[other] > 0
+        rows, other = rows[keep], other[keep]
+        delta = pos[rows] - com[other]
+        d2 = np.maximum((delta ** 2).sum(axis=1), 1e-9)
+        force = delta * (k2 * mass[other] / d2)[:, None]
+        disp[:, 0] += np.bincount(rows, force[:, 0], n)
+        disp[:, 1] += np.bincount(rows, force[:, 1], n)
+    # exact near field on the finest grid
+    g = levels[-1]
+    ix, iy = _cells(pos, lo, size, g)
+    cell = ix * g + iy
+    order = np.argsort(cell, kind='stable')
+    counts = np.bincount(cell, minlength=g * g)
+    starts = np.cumsum(counts) - counts
+    for ox in (-1, 0, 1):
+        for oy in (-1, 0, 1):
+            x, y = ix + ox, iy + oy
+            valid = (x >= 0) & (x < g) & (y >= 0) & (y < g)
+            src = np.nonzero(valid)[0]
+            target_cell = x[valid] * g + y[valid]
+            rows = np.repeat(src, counts[target_cell])
+            others = order[_expand(starts[target_cell], counts[target_cell])]
+            keep = rows != others
+            rows, others = rows[keep], others[keep]
+            delta = pos[rows] - pos[others]
+            d2 = np.maximum((delta ** 2).sum(axis=1), 1e-9)
+            force = delta * (k2 / d2)[:, None]
+            disp[:, 0] += np.bincount(rows, force[:, 0], n)
+            disp[:, 1] += np.bincount(rows, force[:, 1], n)
+    return disp
+
+
+def _levels(n, extent, k):
+    # grid sizes 1, 2, 4 ... down to about LEAF_SIZE nodes per cell, and
+    # finer while the cells are wider than 2k: the layout spreads out as
+    # it runs and its clusters would otherwise share a cell
+    g = 1
+    levels = [g]
+    while g < MAX_GRID and (
+            g * g * LEAF_SIZE < n or extent > 2 * k * g):
+        g *= 2
+        levels.append(g)
+    if len(levels) == 1:
+        levels.append(2)
+    return levels
+
+
+def force_positions(n, edges, pos=None, iterations=ITERATIONS, seed=12345,
+                    time_budget=TIME_BUDGET, temperature=0.1):
+    # n x 2 positions for nodes 0..n-1 connected by an (m, 2) edge array
+    rng = np.random.RandomState(seed)
+    if pos is None:
+        pos = rng.rand(n, 2)
+    pos = np.asarray(pos, dtype=float).copy()
+    if n < 2:
+        return pos
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    k = np.sqrt(1.0 / n)
+    t = temperature * max(np.ptp(pos, axis=0).max(), 1e-9)
+    dt = t / (iterations + 1)
+    start = time.perf_counter()
+    i = 0
+    while i < iterations:
+        levels = _levels(n, np.ptp(pos, axis=0).max(), k)
+        disp = _repulsion(pos, k * k, levels)
+        if len(edges):
+            delta = pos[edges[:, 0]] - pos[edges[:, 1]]
+            dist = np.sqrt((delta ** 2).sum(axis=1))
+            force = delta * (dist / k)[:, None]
+            for c in (0, 1):
+                disp[:, c] -= np.bincount(edges[:, 0], force[:, c], n)
+                disp[:, c] += np.bincount(edges[:, 1], force[:, c], n)
+        length = np.maximum(np.sqrt((disp ** 2).sum(axis=1)), 1e-9)
+        pos += disp * (np.minimum(length, t) / length)[:, None]
+        t -= dt
+        i += 1
+        if i == 1 and time_budget:
+            fit = int(time_budget / max(time.perf_counter() - start, 1e-9))
+            if fit < iterations:
+                iterations = max(fit, 1)
+                dt = t / (iterations - i + 1)
+    return pos
+
+
+def rescale(pos, scale=1, center=(0, 0)):
+    # same normalisation as networkx: centred, largest coordinate = scale
+    if not len(pos):
+        return np.zeros((0, 2))
+    pos = pos - pos.mean(axis=0)
+    lim = np.abs(pos).max()
+    if lim > 0:
+        pos *= scale / lim
+    return pos + np.asarray(center)
+
+
+def warm_start(graph, seed=12345):
+    # unit square positions from the cached layout sharing the most nodes,
+    # new nodes go next to their placed neighbours, returns the positions
+    # and the known share of nodes, (None, 0) without a good enough match
+    nodes = graph.ids.tolist()
+    wanted = set(nodes)
+    best, best_overlap = None, 0
+    for entry in cache.memory.values():
+        overlap = len(wanted.intersection(entry['nodes']))
+        if (overlap > best_overlap and overlap
+                >= WARM_OVERLAP * min(len(nodes), len(entry['nodes']))):
+            best, best_overlap = entry, overlap
+            if overlap == len(nodes):
+                break
+    if best is None:
+        return None, 0
+    best = dict(zip(best['nodes'], best['pos']))
+    rng = np.random.RandomState(seed)
+    jitter = 0.5 * np.sqrt(1.0 / len(nodes))
+    pos = np.empty((len(nodes), 2))
+    placed = np.zeros(len(nodes), dtype=bool)
+    for i, node in enumerate(nodes):
+        if node in best:
+            pos[i] = (np.asarray(best[node]) + 1) / 2
+            placed[i] = True
+    for i in np.nonzero(~placed)[0]:
+        neighbours = graph.neighbors(i)
+        neighbours = neighbours[placed[neighbours]]
+        if len(neighbours):
+            pos[i] = pos[neighbours].mean(axis=0) + rng.normal(0, jitter, 2)
+        else:
+            pos[i] = rng.rand(2)
+    return pos, best_overlap / len(nodes)
+
+
+def force_layout(graph, seed=12345, warm=False, **kwargs):
+    pos = None
+    if warm:
+        pos, overlap = warm_start(graph, seed)
+    if pos is not None:
+        # refinement scaled by the share of new nodes
+        iterations = kwargs.pop('iterations', ITERATIONS)
+        kwargs['iterations'] = max(
+            WARM_ITERATIONS, int(round(iterations * (1 - overlap))))
+        kwargs['temperature'] = max(0.02, 0.1 * (1 - overlap))
+    return rescale(force_positions(
+        len(graph), graph.edges, pos=pos, seed=seed, **kwargs))
+
+
+def spring_layout(graph, seed=12345, **kwargs):
+    import networkx as nx
+    pos = nx.spring_layout(graph.to_networkx(), seed=seed, **kwargs)
+    return np.array([pos[id] for id in graph.ids.tolist()]).reshape(-1, 2)
+
+
+layouts = {
+    'force': force_layout,
+    'spring': spring_layout,
+}
+
+
+@metrics.timed('layout')
+def layout(graph, scale=1, center=(0, 0), seed=12345, method=None, **kwargs):
+    # (n, 2) positions in the node order of graph, cached by graph
+    # fingerprint, overlapping graphs are warm started
+    if not len(graph):
+        return np.zeros((0, 2))
+    method = method or LAYOUT
+    key = graph.fingerprint(method, seed, sorted(kwargs.items()))
+    entry = cache.get(key)
+    metrics.count(
+        'layout_cache_misses' if entry is MISSING else 'layout_cache_hits')
+    if entry is MISSING:
+        if method == 'force':
+            kwargs['warm'] = True
+        pos = layouts[method](graph, seed=seed, **kwargs)
+        entry = {'nodes': graph.ids.tolist(), 'pos': pos.tolist()}
+        cache.set(key, entry, size=32 * len(graph))
+    else:
+        known = dict(zip(entry['nodes'], entry['pos']))
+        pos = np.array([known[id] for id in graph.ids.tolist()])
+    return np.asarray(pos).reshape(-1, 2) * scale + np.asarray(center)
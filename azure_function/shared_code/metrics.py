@@ -0,0 +1,150 @@
+import contextlib, contextvars, functools, json, logging, threading, time
+
+# %%
+# per request stage timings and counters, plus process wide totals for the
+# metrics function; the request being served is found through a context
+# variable, so it follows asyncio tasks and, with in_context, threads
+PREFIX = 'sciencegraph'
+
+_current = contextvars.ContextVar('timings', default=None)
+
+
+class Timings:
+    # seconds per stage and counters of one request; stages can nest (the
+    # reference fetch contains its evaluate calls) and concurrent calls of
+    # a stage add up, so the stages can sum to more than the request took
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    def count(self, name, value):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def record(self):
+        with self._lock:
+            return dict(
+                self.fields, function=self.name,
+                seconds=round(self.elapsed(), 4),
+                stages=dict(
+                    (stage, round(seconds, 4))
+                    for stage, seconds in self.stages.items()),
+                counts=dict(self.counts))
+
+    def server_timing(self):
+        # Server-Timing header value, durations in milliseconds
+        with self._lock:
+            stages = list(self.stages.items())
+        return ', '.join(
+            '{0};dur={1:.1f}'.format(stage, seconds * 1000)
+            for stage, seconds in stages + [('total', self.elapsed())])
+
+
+class Registry:
+    # totals since the process started: a summary per stage and counters
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            total, n = self.stages.get(stage, (0, 0))
+            self.stages[stage] = (total + seconds, n + 1)
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def openmetrics(self):
+        # the totals in the OpenMetrics text format
+        with self._lock:
+            stages = sorted(self.stages.items())
+            counters = sorted(self.counters.items())
+        lines = [
+            '# TYPE {0}_stage_seconds summary'.format(PREFIX),
+            '# UNIT {0}_stage_seconds seconds'.format(PREFIX)]
+        for stage, (total, n) in stages:
+            lines.append('{0}_stage_seconds_sum{{stage="{1}"}} {2!r}'.format(
+                PREFIX, stage, total))
+            lines.append('{0}_stage_seconds_count{{stage="{1}"}} {2}'.format(
+                PREFIX, stage, n))
+        for name, value in counters:
+            lines.append('# TYPE {0}_{1} counter'.format(PREFIX, name))
+            lines.append('{0}_{1}_total {2}'.format(PREFIX, name, value))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+@contextlib.contextmanager
+def request(name, **fields):
+    # measures one request, logged as one json line when it is done
+    timings = Timings(name, fields)
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+        registry.add('request', timings.elapsed())
+        logging.info('metrics %s', json.dumps(timings.record()))
+
+
+@contextlib.contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        registry.add(name, seconds)
+        timings = _current.get()
+        if timings is not None:
+            timings.add(name, seconds)
+
+
+def timed(name):
+    # decorator form of stage
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1):
+    # adds to a counter of the request and to the process totals, e.g.
+    # upstream bytes, nodes or cache hits
+    registry.count(name, value)
+    timings = _current.get()
+    if timings is not None:
+        timings.count(name, value)
+
+
+def in_context(func):
+    # func bound to the current context, for running it on another thread
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+def annotate(req, response, timings):
+    # response of an http function with its status in the request log and,
+    # for ?timing=1, the stage timings as a Server-Timing header
+    timings.fields['status'] = response.status_code
+    if req.params.get('timing') == '1':
+        response.headers['Server-Timing'] = timings.server_timing()
+    return response
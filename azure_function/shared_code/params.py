@@ -0,0 +1,28 @@
+# %%
+# the page parameters shared by the functions and precompute: n is a
+# result count of 1 to 100 or the letter of a mode that has none
+MODES = {'A': 'authors', 'C': 'collaboration'}
+DEFAULT_N = 20
+MAX_N = 100
+DEFAULT_QUERY = {'publications': 'metasurface', 'authors': 'federico capasso',
+                 'collaboration': 'federico capasso'}
+
+
+def mode(n):
+    # 'publications', 'authors' or 'collaboration', also the draw_plot type
+    return MODES.get(n, 'publications')
+
+
+def parse_n(n):
+    # a count clamped to 1..MAX_N, a mode letter, anything else is 'A'
+    try:
+        return min(max(int(n or DEFAULT_N), 1), MAX_N)
+    except ValueError:
+        return n if n in MODES else 'A'
+
+
+def parse_params(params):
+    # (query, n) of the query string of a request
+    n = parse_n(params.get('n'))
+    query = params.get('query') or DEFAULT_QUERY[mode(n)]
+    return ' '.join(query.split()), n
@@ -0,0 +1,117 @@
+# warms the caches the function reads for a list of popular queries
+#
+#   python -m shared_code.precompute queries.tsv --workers 4 --rate 2
+#
+# one query per line: query, n and mode (publications, authors or
+# collaboration) separated by tabs, n and mode are optional. Run from the
+# function app directory with the same MAG_CACHE_DIR, MAG_STORE,
+# LAYOUT_CACHE_DIR, PAGE_CACHE_DIR and DATA_CACHE_DIR as the server,
+# otherwise the results stay in this process. Finished lines are appended
+# to the --progress file and skipped when the run is started again, queries
+# that found nothing are tried again.
+import argparse, concurrent.futures, json, os, time
+
+from shared_code import params
+
+MODES = ('publications',) + tuple(params.MODES.values())
+# the n of the modes without a result count
+MODE_N = {mode: n for n, mode in params.MODES.items()}
+
+
+def read_queries(path):
+    # [(query, n, mode)] with the page parameters the function would use
+    queries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = [field.strip() for field in line.rstrip('\n').split('\t')]
+            query = ' '.join(fields[0].split())
+            n = int(fields[1]) if len(fields) > 1 and fields[1] else 20
+            mode = fields[2] if len(fields) > 2 and fields[2] else MODES[0]
+            if mode not in MODES:
+                raise ValueError('unknown mode {0!r}: {1}'.format(mode, line))
+            n = MODE_N.get(mode) or params.parse_n(n)
+            queries.append((query, n, mode))
+    # duplicates would be computed twice at the same time
+    return list(dict.fromkeys(queries))
+
+
+def read_progress(path):
+    done = set()
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['status'] == 'ok':
+                    done.add((entry['query'], entry['n'], entry['mode']))
+    return done
+
+
+def _init(rate):
+    # every worker gets its share of the request rate
+    from shared_code import mag
+    mag.set_client(mag.AcademicClient(rate=rate))
+
+
+def warm(query, n, mode):
+    # renders the page and the graph data and stores them in the server's
+    # caches, fresh entries included, which also fills the api cache, the
+    # entity store and the layout cache
+    import graph_data
+    import http_request
+    start = time.time()
+    data = graph_data.render_data(query, n, False, 'json')
+    if not data:
+        return {'status': 'empty', 'seconds': round(time.time() - start, 3)}
+    graph_data.graphs.put((query, n, False, 'json'), data)
+    page, _ = http_request.pages.put(
+        (query, n), http_request.render_page(query, n))
+    return {
+        'status': 'ok', 'page_bytes': len(page), 'data_bytes': len(data),
+        'seconds': round(time.time() - start, 3)}
+
+
+def precompute(queries, progress, workers=4, rate=0):
+    done = read_progress(progress)
+    todo = [q for q in queries if q not in done]
+    print('{0} queries, {1} done before, {2} to go'.format(
+        len(queries), len(queries) - len(todo), len(todo)))
+    for name in ('PAGE_CACHE_DIR', 'DATA_CACHE_DIR'):
+        if not os.environ.get(name):
+            print('{0} is not set, the results are not kept'.format(name))
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=_init, initargs=(rate / workers,)) as pool, \
+            open(progress, 'a', encoding='utf-8') as log:
+        futures = dict((pool.submit(warm, *q), q) for q in todo)
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            query, n, mode = futures[future]
+            entry = {'query': query, 'n': n, 'mode': mode}
+            try:
+                entry.update(future.result())
+            except Exception as e:
+                entry.update(status='error', error=repr(e))
+                failed += 1
+            log.write(json.dumps(entry) + '\n')
+            log.flush()
+            print('{0}/{1} {2} {3}: {4}'.format(
+                i + 1, len(todo), query, n, entry['status']))
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='warm the server caches for a list of queries')
+    parser.add_argument('queries')
+    parser.add_argument('--progress', help='default: <queries>.progress')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument(
+        '--rate', type=float, default=float(os.environ.get('MAG_RATE', '0')),
+        help='api requests per second over all workers, 0 for no limit')
+    args = parser.parse_args()
+    failed = precompute(
+        read_queries(args.queries),
+        args.progress or args.queries + '.progress',
+        workers=args.workers, rate=args.rate)
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+
+from shared_code import metrics
+from shared_code.csr import CSRGraph, _take
+
+# %%
+# bounds of the graph sent to the browser: at most MAX_NODES nodes
+# (clusters included), edges only kept when they are among the
+# MAX_EDGES_PER_NODE best ranked edges of one of their ends: at most
+# MAX_EDGES_PER_NODE times the nodes edges in all (a hub keeps the edges
+# its neighbours rank high) and no node loses all of its edges
+MAX_NODES = int(os.environ.get('REDUCE_MAX_NODES', '1500'))
+MAX_CLUSTERS = int(os.environ.get('REDUCE_MAX_CLUSTERS', '100'))
+MAX_EDGES_PER_NODE = int(os.environ.get('REDUCE_MAX_EDGES_PER_NODE', '25'))
+# 'degree' or 'weight' (citation count)
+RANK = os.environ.get('REDUCE_RANK', 'degree')
+
+CLUSTER_COLOR = '#bdbdbd'
+
+
+def label_propagation(graph, iterations=10):
+    # community label per node, every node takes the most frequent label
+    # among itself and its neighbours, ties go to the smaller label
+    n = len(graph)
+    labels = np.arange(n)
+    rows = np.concatenate([np.repeat(np.arange(n), graph.degree()),
+                           np.arange(n)])
+    cols = np.concatenate([graph.indices, np.arange(n)])
+    for _ in range(iterations):
+        keys, counts = np.unique(rows * n + labels[cols], return_counts=True)
+        node, label = keys // n, keys % n
+        order = np.lexsort((label, -counts, node))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = node[order][1:] != node[order][:-1]
+        new = label[order][first]
+        if (new == labels).all():
+            break
+        labels = new
+    return labels
+
+
+def cap_edges(graph, score, k):
+    # mask of the edges to keep: an edge is kept if it is among the k best
+    # scored edges of one of its ends, the best edge of every node stays
+    if not len(graph.edges):
+        return np.zeros(0, dtype=bool)
+    both = np.concatenate([graph.edges, graph.edges[:, ::-1]])
+    order = np.lexsort((-score[both[:, 1]], both[:, 0]))
+    source = both[order, 0]
+    rank = np.empty(len(both), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.searchsorted(source, source)
+    m = len(graph.edges)
+    return (rank[:m] < k) | (rank[m:] < k)
+
+
+@metrics.timed('reduce')
+def reduce_graph(graph, primary=None, max_nodes=MAX_NODES,
+                 max_clusters=MAX_CLUSTERS,
+                 max_edges_per_node=MAX_EDGES_PER_NODE, rank=RANK,
+                 noun='nodes'):
+    # graph of at most max_nodes nodes: nodes of type primary and the best
+    # ranked others are kept, the rest collapse into one super-node per
+    # community titled '<size> collapsed <noun>', then edges are capped per
+    # node
+    n = len(graph)
+    score = (graph.degree() if rank == 'degree'
+             else graph.columns['weight']).astype(float)
+    if n <= max_nodes:
+        return graph.edge_subgraph(
+            cap_edges(graph, score, max_edges_per_node))
+    forced = np.array([t == primary for t in graph.columns['type']])
+    n_clusters = min(max_clusters, max_nodes // 10)
+    n_keep = max(max_nodes - n_clusters, int(forced.sum()))
+    # forced nodes first, then by score, ties by position
+    order = np.lexsort((np.arange(n), -score, ~forced))
+    kept = np.zeros(n, dtype=bool)
+    kept[order[:n_keep]] = True
+
+    # %% clusters of the collapsed nodes, the largest ones survive
+    labels = label_propagation(graph)
+    collapsed = np.nonzero(~kept)[0]
+    communities, members = np.unique(labels[collapsed], return_counts=True)
+    communities = communities[np.argsort(-members, kind='stable')]
+    communities = communities[:max(max_nodes - n_keep, 0)]
+    lookup = np.full(n, -1)
+    lookup[communities] = np.arange(len(communities))
+    cluster = np.full(n, -1)
+    cluster[collapsed] = lookup[labels[collapsed]]
+
+    # %% node table: kept nodes, then one row per cluster
+    new = np.full(n, -1)
+    new[kept] = np.arange(n_keep)
+    new[~kept] = np.where(cluster[~kept] >= 0, n_keep + cluster[~kept], -1)
+    columns = dict(
+        (name, _take(values, kept)) for name, values in graph.columns.items())
+    sizes = np.bincount(cluster[cluster >= 0], minlength=len(communities))
+    weights = np.bincount(
+        cluster[cluster >= 0], graph.columns['weight'][cluster >= 0],
+        minlength=len(communities))
+    for c in range(len(communities)):
+        _append(columns, {
+            'type': 'Cluster',
+            'color': CLUSTER_COLOR,
+            'title': '{0} collapsed {1}'.format(sizes[c], noun),
+            'authors': '',
+            'journal': '',
+            'year': '',
+            'DOI': '',
+            'size': int(8 + 2 * np.log2(sizes[c])),
+            'weight': int(weights[c])})
+    # negative ids can not clash with paper or author ids
+    ids = np.concatenate([graph.ids[kept], -1 - np.arange(len(communities))])
+    # edges into a cluster merge, their weights add up
+    edges = new[graph.edges]
+    valid = (edges >= 0).all(axis=1)
+    reduced = CSRGraph(ids, columns, edges[valid], graph.edge_weights(valid))
+    score = (reduced.degree() if rank == 'degree'
+             else reduced.columns['weight']).astype(float)
+    return reduced.edge_subgraph(
+        cap_edges(reduced, score, max_edges_per_node))
+
+
+def _append(columns, row):
+    for name, value in row.items():
+        values = columns[name]
+        if isinstance(values, np.ndarray):
+            columns[name] = np.append(values, value)
+        else:
+            values.append(value)
@@ -0,0 +1,82 @@
+from bokeh.models import GraphRenderer, StaticLayoutProvider
+
+import numpy as np
+
+from shared_code.csr import _tolist
+from shared_code.data import DIGITS, categorize
+from shared_code.layout import layout
+
+# %%
+# string columns the page receives as codes into a list of categories
+CATEGORICAL = ('type', 'color', 'journal', 'year')
+
+
+def compact(values):
+    # integers in the smallest type bokeh sends as a base64 buffer (it can
+    # not for 64 bit integers, those go out as json lists)
+    values = np.asarray(values)
+    low, high = int(values.min(initial=0)), int(values.max(initial=0))
+    dtype = np.min_scalar_type(high) if low >= 0 else np.min_scalar_type(
+        -max(-low, high + 1))
+    return values.astype(dtype if dtype.itemsize <= 4 else np.float64)
+
+
+def node_data(graph, categorical=()):
+    # (node columns, categories) for a bokeh ColumnDataSource; nodes are
+    # indexed by position and integers are compact, the columns named in
+    # categorical hold codes into categories[name]
+    nodes = {'index': compact(np.arange(len(graph)))}
+    categories = {}
+    for name, values in graph.columns.items():
+        if isinstance(values, np.ndarray) and values.dtype.kind in 'iu':
+            nodes[name] = compact(values)
+        elif name in categorical:
+            categories[name], nodes[name] = categorize(values)
+        else:
+            nodes[name] = values
+    return nodes, categories
+
+
+def edge_data(graph):
+    # weighted edges also carry a line width growing with log2(weight)
+    edges = compact(graph.edges)
+    data = {'start': edges[:, 0], 'end': edges[:, 1]}
+    if graph.weights is not None:
+        data['weight'] = compact(graph.weights)
+        data['width'] = compact(np.round(
+            1 + np.log2(np.maximum(graph.weights, 1))).astype(np.int64))
+    return data
+
+
+def graph_layout(graph, seed=12345):
+    pos = np.round(layout(graph, scale=1, center=(0, 0), seed=seed), DIGITS)
+    return dict(enumerate(pos.tolist()))
+
+
+def csr_graph_renderer(graph, seed=12345, categorical=()):
+    # bokeh renderer straight from the CSRGraph columns, no networkx; with
+    # categorical columns the renderer tags carry the categories and the
+    # page decodes the codes
+    renderer = GraphRenderer()
+    nodes, categories = node_data(graph, categorical)
+    renderer.node_renderer.data_source.data = nodes
+    renderer.edge_renderer.data_source.data = edge_data(graph)
+    renderer.layout_provider = StaticLayoutProvider(
+        graph_layout=graph_layout(graph, seed=seed))
+    if categories:
+        renderer.tags = [{'categories': categories}]
+    return renderer
+
+
+def graph_data(graph, seed=12345, categorical=()):
+    # the data of csr_graph_renderer as plain json types, for updating a
+    # renderer that is already on the page
+    nodes, categories = node_data(graph, categorical)
+    return {
+        'nodes': dict(
+            (name, _tolist(values)) for name, values in nodes.items()),
+        'edges': dict(
+            (name, values.tolist())
+            for name, values in edge_data(graph).items()),
+        'layout': graph_layout(graph, seed=seed),
+        'categories': categories}
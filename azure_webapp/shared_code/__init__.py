@@ -0,0 +1,2 @@
+# code shared by the azure function and the azure webapp
+# (azure_webapp/shared_code is a symlink to this folder)
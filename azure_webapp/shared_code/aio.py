@@ -0,0 +1,379 @@
+import asyncio, concurrent.futures, functools, os, ssl, urllib.parse
+
+from shared_code import mag, metrics
+from shared_code.cache import Inflight, MISSING
+from shared_code.papers import normalize
+from shared_code.store import get_graph_store
+
+# %%
+# threads for layout, graph building and bokeh serialization, so the event
+# loop keeps serving while a page is rendered
+CPU_WORKERS = int(os.environ.get('ASYNC_CPU_WORKERS', '2'))
+executor = concurrent.futures.ThreadPoolExecutor(CPU_WORKERS)
+
+# errors that mean a kept-alive connection was closed by the other side
+STALE_ERRORS = (ConnectionError, asyncio.IncompleteReadError)
+
+
+async def run_cpu(func, *args, **kwargs):
+    # in the context of the caller, so its stages are timed for its request
+    return await asyncio.get_event_loop().run_in_executor(
+        executor, metrics.in_context(functools.partial(func, *args, **kwargs)))
+
+
+class AsyncAcademicClient:
+    # asyncio counterpart of mag.AcademicClient on the standard library
+    # streams: a pool of keep-alive connections, the same rate limit and
+    # Retry-After handling
+    def __init__(self, url=mag.API_URL, pool_size=mag.POOL_SIZE,
+                 timeout=mag.TIMEOUT, rate=mag.RATE, retries=mag.RETRIES):
+        parsed = urllib.parse.urlsplit(url)
+        self.https = parsed.scheme == 'https'
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.https else 80)
+        self.path = parsed.path.rstrip('/') + '/'
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.throttle = mag.Throttle(rate)
+        self.retries = retries
+        self._loop = None
+        self._idle = []
+        self._slots = None
+
+    def _bind(self):
+        # connections and the semaphore belong to the loop they were made in
+        loop = asyncio.get_event_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._idle = []
+            self._slots = asyncio.Semaphore(self.pool_size)
+
+    async def _connect(self):
+        # bounded like the exchange, a dead host would hang the request
+        return await asyncio.wait_for(asyncio.open_connection(
+            self.host, self.port,
+            ssl=ssl.create_default_context() if self.https else None),
+            self.timeout)
+
+    async def _exchange(self, connection, request):
+        # (status, headers, body) of one request on connection
+        reader, writer = connection
+        writer.write(request)
+        await writer.drain()
+        status = await reader.readline()
+        if not status:
+            raise ConnectionResetError('connection closed by the server')
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    # trailers up to the blank line
+                    while (await reader.readline()).strip():
+                        pass
+                    break
+                body += await reader.readexactly(size)
+                await reader.readexactly(2)
+            body = bytes(body)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            headers['connection'] = 'close'
+        return int(status.split()[1]), headers, body
+
+    async def _post(self, endpoint, body, timeout):
+        lines = ['POST {0}{1} HTTP/1.1'.format(self.path, endpoint),
+                 'Host: {0}'.format(self.host),
+                 'Content-Length: {0}'.format(len(body))]
+        lines.extend(
+            '{0}: {1}'.format(*header) for header in mag.headers.items())
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode() + body
+        async with self._slots:
+            reused = bool(self._idle)
+            connection = self._idle.pop() if reused else await self._connect()
+            try:
+                try:
+                    answer = await asyncio.wait_for(
+                        self._exchange(connection, request), timeout)
+                except STALE_ERRORS:
+                    # the server dropped an idle connection, reconnect once
+                    connection[1].close()
+                    if not reused:
+                        raise
+                    connection = await self._connect()
+                    answer = await asyncio.wait_for(
+                        self._exchange(connection, request), timeout)
+            except BaseException:
+                connection[1].close()
+                raise
+            if answer[1].get('connection', '').lower() == 'close' \
+                    or len(self._idle) >= self.pool_size:
+                connection[1].close()
+            else:
+                self._idle.append(connection)
+            return answer
+
+    async def post(self, endpoint, params, timeout=None):
+        self._bind()
+        body = urllib.parse.urlencode(params).encode()
+        for attempt in range(self.retries + 1):
+            delay = self.throttle.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            status, headers, data = await self._post(
+                endpoint, body, timeout or self.timeout)
+            if status not in mag.RETRY_STATUS or attempt == self.retries:
+                return data
+            self.throttle.pause(
+                mag._retry_after(headers.get('retry-after'), attempt))
+
+    def close(self):
+        # connections of a loop that is closed already go with it
+        if self._loop is not None and not self._loop.is_closed():
+            for _, writer in self._idle:
+                writer.close()
+        self._idle = []
+
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = AsyncAcademicClient()
+    return _client
+
+
+def set_client(client):
+    # swap the shared client, e.g. for one pointing at a stub server
+    global _client
+    if _client is not None:
+        _client.close()
+    _client = client
+
+
+# %%
+# requests by cache key, concurrent identical requests share one fetch
+requests = Inflight()
+
+
+async def on_disk(disk, func, *args, **kwargs):
+    # func of a cache on a thread if the cache has the sqlite tier disk, a
+    # memory only lookup is quicker than the hop to a thread
+    if disk is None:
+        return func(*args, **kwargs)
+    return await _in_thread(func, *args, **kwargs)
+
+
+async def _request(endpoint, params, key, timeout=None):
+    # shares mag.cache with the blocking client
+    data_decoded = await on_disk(mag.cache.disk, mag.cache.get, key)
+    if data_decoded is not MISSING:
+        metrics.count('api_cache_hits')
+        return data_decoded
+    metrics.count('api_cache_misses')
+    return await requests.run(
+        key, lambda: _fetch(endpoint, params, key, timeout))
+
+
+async def _fetch(endpoint, params, key, timeout):
+    with metrics.stage(endpoint):
+        data = await get_client().post(endpoint, params, timeout=timeout)
+        metrics.count('upstream_bytes', len(data))
+        # answers run to megabytes, decoding them would hold up the loop
+        data_decoded = await _in_thread(mag._decode, data)
+    await on_disk(
+        mag.cache.disk, mag.cache.set, key, data_decoded, size=len(data))
+    return data_decoded
+
+
+async def interpret(query):
+    try:
+        return await _request(*mag.interpret_args(query))
+    except Exception as e:
+        mag._report(e)
+        return None
+
+
+async def evaluate(query, n=100, attributes=mag.ATTRIBUTES, timeout=None,
+                   offset=0):
+    try:
+        return await _request(
+            *mag.evaluate_args(query, n, attributes, offset), timeout=timeout)
+    except Exception as e:
+        mag._report(e)
+        return None
+
+
+async def evaluate_pages(query, n, page_size=mag.PAGE_SIZE,
+                         attributes=mag.ATTRIBUTES):
+    # async generator version of mag.evaluate_pages
+    for offset, count in mag.pages(n, page_size):
+        eval_data = await evaluate(
+            query, n=count, attributes=attributes, offset=offset)
+        if eval_data is None and not offset:
+            raise mag.UpstreamError('evaluate failed for ' + query)
+        entities = mag.entities_of(eval_data)
+        if not entities:
+            return
+        yield entities
+        if len(entities) < count:
+            return
+
+
+async def _fetch_chunk(ids, timeout, slots):
+    async with slots:
+        eval_data = await evaluate(
+            mag.chunk_expr(ids), n=len(ids), timeout=timeout)
+    return mag.entities_of(eval_data)
+
+
+async def fetch_papers(
+        ids, chunk_size=mag.CHUNK_SIZE, concurrency=mag.CONCURRENCY,
+        timeout=mag.CHUNK_TIMEOUT):
+    # mag.fetch_papers with the chunks requested concurrently on the loop,
+    # the entity store is read and written on a thread
+    ids, store, found, chunks = await _in_thread(
+        mag.plan_fetch, ids, chunk_size)
+    slots = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(
+        *[_fetch_chunk(chunk, timeout, slots) for chunk in chunks])
+    return await _in_thread(
+        mag.collect_fetch, ids, store, found, chunks, results)
+
+
+class AsyncAcademicApi:
+    # awaitable mag.AcademicApi
+    async def search(self, query, n, mode='publications'):
+        expr, found = await self.search_pages(query, n, mode=mode)
+        return expr, [e async for page in found for e in page] or None
+
+    async def search_pages(self, query, n, mode='publications'):
+        expr = mag.first_expr(mag.interpreted(await interpret(query), query))
+        if expr is None:
+            return None, _no_pages()
+        return expr, evaluate_pages(expr, n)
+
+    async def fetch(self, ids):
+        return mag.entities_of(await fetch_papers(ids)) or []
+
+
+async def _no_pages():
+    return
+    yield
+
+
+class ThreadedBackend:
+    # awaitable wrapper of a blocking backend, e.g. the local GraphStore
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def search(self, query, n, mode='publications'):
+        return await _in_thread(self.backend.search, query, n, mode=mode)
+
+    async def search_pages(self, query, n, mode='publications'):
+        expr, found = await _in_thread(
+            self.backend.search_pages, query, n, mode=mode)
+        return expr, self._pages(found)
+
+    async def _pages(self, found):
+        while True:
+            page = await _in_thread(next, found, None)
+            if page is None:
+                return
+            yield page
+
+    async def fetch(self, ids):
+        return await _in_thread(self.backend.fetch, ids)
+
+
+async def _in_thread(func, *args, **kwargs):
+    return await asyncio.get_event_loop().run_in_executor(
+        None, metrics.in_context(functools.partial(func, *args, **kwargs)))
+
+
+def get_backend():
+    from shared_code.graph import BACKEND
+    if BACKEND == 'local':
+        return ThreadedBackend(get_graph_store())
+    return AsyncAcademicApi()
+
+
+# %%
+# graph.prepare_* with awaited upstream calls and the cpu work on executor
+# (shared_code.graph loads numpy, it is imported by the functions that need
+# it so setting up a client stays cheap)
+
+
+async def prepare_primaries(query, n, backend=None):
+    from shared_code.graph import build_graph, found_papers
+    backend = backend or get_backend()
+    papers, expr = await run_cpu(
+        found_papers, *await backend.search(query, n))
+    if papers is None:
+        return 0, 0
+    return await run_cpu(build_graph, papers), expr
+
+
+async def prepare_data(query, n, backend=None, depth=None):
+    from shared_code.graph import DEPTH, build_graph, found_papers, hops
+    backend = backend or get_backend()
+    papers, expr = await run_cpu(
+        found_papers, *await backend.search(query, n))
+    if papers is None:
+        return 0, 0
+    levels = []
+    walk = hops(papers, depth=DEPTH if depth is None else depth)
+    ids = next(walk, None)
+    with metrics.stage('references'):
+        while ids is not None:
+            # reference answers run to megabytes, normalized off the loop
+            levels.append(await run_cpu(normalize, await backend.fetch(ids)))
+            try:
+                ids = walk.send(levels[-1])
+            except StopIteration:
+                ids = None
+    return await run_cpu(build_graph, papers, *levels), expr
+
+
+async def prepare_data_authors(query, backend=None):
+    from shared_code.graph import authors_graph
+    papers, expr = await author_papers(query, backend or get_backend())
+    if papers is None:
+        return 0, 0
+    return await run_cpu(authors_graph, papers), expr
+
+
+async def prepare_collaboration(query, backend=None):
+    from shared_code.graph import collaboration_graph
+    papers, expr = await author_papers(query, backend or get_backend())
+    if papers is None:
+        return 0, 0
+    graph = await run_cpu(collaboration_graph, papers)
+    if not len(graph):
+        return 0, 0
+    return graph, expr
+
+
+async def author_papers(query, backend):
+    from shared_code.graph import (
+        AUTHOR_NODES, AUTHOR_PAPERS, NodeBudget, author_nodes, found_papers)
+    expr, found = await backend.search_pages(
+        query, AUTHOR_PAPERS, mode='authors')
+    budget = NodeBudget(AUTHOR_NODES, author_nodes)
+    entities = []
+    async for page in found:
+        entities.extend(page)
+        if budget.add(page):
+            break
+    await found.aclose()
+    return await run_cpu(found_papers, expr, entities)
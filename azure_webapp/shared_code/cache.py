@@ -0,0 +1,398 @@
+import base64, collections, concurrent.futures, hashlib, json, logging, os, sqlite3, threading, time, zlib
+
+from shared_code import metrics
+
+# %%
+# sentinel for cache misses, None is a valid cached value
+MISSING = object()
+
+
+class LRUCache:
+    # in-process cache, evicts least recently used entries once either the
+    # entry count or the summed entry sizes exceed their limits
+    def __init__(self, maxsize=256, max_bytes=64 * 2**20, ttl=3600):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, count=True):
+        # count=False looks without counting a hit or miss
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[2] < time.time():
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.misses += count
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += count
+            return entry[0]
+
+    def set(self, key, value, size=1, ttl=None):
+        if size > self.max_bytes:
+            return
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (value, size, expires)
+            self.nbytes += size
+            while len(self._data) > self.maxsize or self.nbytes > self.max_bytes:
+                self._pop(next(iter(self._data)))
+
+    def values(self):
+        # live entries, most recently used last
+        now = time.time()
+        with self._lock:
+            entries = list(self._data.values())
+        return [value for value, _, expires in entries if expires >= now]
+
+    def _pop(self, key):
+        _, size, _ = self._data.pop(key)
+        self.nbytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    # sqlite file of zlib compressed json, survives cold starts when the
+    # path is on persistent storage (e.g. $HOME on azure); expired entries
+    # are deleted on opening and every prune_every writes
+    def __init__(self, path, ttl=86400, prune_every=1000):
+        self.path = path
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, expires REAL, value BLOB)')
+        self.prune()
+
+    def get(self, key, count=True):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT expires, value FROM cache WHERE key = ?',
+                (key,)).fetchone()
+            if row is None or row[0] < time.time():
+                self.misses += count
+                return MISSING
+            self.hits += count
+        return json.loads(zlib.decompress(row[1]))
+
+    def set(self, key, value, ttl=None):
+        blob = zlib.compress(json.dumps(value).encode())
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                (key, expires, blob))
+            self._writes += 1
+            prune = self._writes % self.prune_every == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        with self._lock, self._db:
+            self._db.execute(
+                'DELETE FROM cache WHERE expires < ?', (time.time(),))
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM cache')
+
+
+class TieredCache:
+    # memory in front of an optional disk tier, disk hits are promoted
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not MISSING or self.disk is None:
+            return value
+        value = self.disk.get(key)
+        if value is not MISSING:
+            self.memory.set(key, value, size=_size(value))
+        return value
+
+    def set(self, key, value, size=None):
+        self.memory.set(key, value, size=_size(value) if size is None else size)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def stats(self):
+        stats = {
+            'memory_hits': self.memory.hits,
+            'memory_misses': self.memory.misses,
+            'memory_entries': len(self.memory),
+            'memory_bytes': self.memory.nbytes}
+        if self.disk is not None:
+            stats['disk_hits'] = self.disk.hits
+            stats['disk_misses'] = self.disk.misses
+        return stats
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+
+def _size(value):
+    return len(json.dumps(value))
+
+
+def from_env(prefix, maxsize=256, max_bytes=64 * 2**20, ttl=3600):
+    # builds a TieredCache configured by <prefix>_SIZE, <prefix>_BYTES,
+    # <prefix>_TTL and, to enable the disk tier, <prefix>_DIR
+    ttl = float(os.environ.get(prefix + '_TTL', ttl))
+    memory = LRUCache(
+        maxsize=int(os.environ.get(prefix + '_SIZE', maxsize)),
+        max_bytes=int(os.environ.get(prefix + '_BYTES', max_bytes)),
+        ttl=ttl)
+    disk = None
+    directory = os.environ.get(prefix + '_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        disk = DiskCache(
+            os.path.join(directory, prefix.lower() + '.sqlite'), ttl=ttl)
+    return TieredCache(memory, disk)
+
+
+class PageCache:
+    # rendered output with an etag, fresh for ttl seconds, then served
+    # stale for up to stale seconds while one background thread re-renders;
+    # the optional disk tier shares pages between processes (precompute).
+    # an empty body (nothing found) is only kept in memory for empty_ttl
+    def __init__(self, ttl=600, stale=3600, maxsize=128, max_bytes=64 * 2**20,
+                 disk=None, name='page', empty_ttl=60):
+        # name prefixes the hit and miss counters in shared_code.metrics
+        self.name = name
+        self.ttl = ttl
+        self.stale = stale
+        self.empty_ttl = empty_ttl
+        self.memory = LRUCache(
+            maxsize=maxsize, max_bytes=max_bytes, ttl=ttl + stale)
+        self.disk = disk
+        self.refreshes = 0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _entry(self, key, count):
+        entry = self.memory.get(key, count=count)
+        if entry is not MISSING or self.disk is None:
+            return entry
+        entry = self.disk.get(json.dumps(key), count=count)
+        if entry is MISSING:
+            return entry
+        if entry.pop('binary', False):
+            entry['body'] = base64.b64decode(entry['body'])
+        self.memory.set(
+            key, entry, size=len(entry['body']),
+            ttl=entry['created'] + self.ttl + self.stale - time.time())
+        return entry
+
+    def get_or_render(self, key, render):
+        # (body, etag), render() is only called on a miss or to refresh
+        found = self.get_or_refresh(key, render)
+        if found is MISSING:
+            return self._store(key, render())
+        return found
+
+    def get_or_refresh(self, key, render):
+        # (body, etag) or MISSING for the caller to render and put, counted
+        # as the one hit or miss of the request; a stale entry is refreshed
+        # with render() in the background
+        entry = self._entry(key, count=True)
+        metrics.count(self.name + (
+            '_cache_misses' if entry is MISSING else '_cache_hits'))
+        if entry is MISSING:
+            return MISSING
+        if time.time() - entry['created'] > self.ttl:
+            with self._lock:
+                start = key not in self._refreshing
+                self._refreshing.add(key)
+            if start:
+                threading.Thread(
+                    target=self._refresh, args=(key, render),
+                    daemon=True).start()
+        return entry['body'], entry['etag']
+
+    def get(self, key):
+        # (body, etag) of a fresh or stale entry or MISSING, never renders
+        # and counts neither a hit nor a miss
+        entry = self._entry(key, count=False)
+        if entry is MISSING:
+            return MISSING
+        return entry['body'], entry['etag']
+
+    def put(self, key, body):
+        return self._store(key, body)
+
+    def _store(self, key, body):
+        binary = not isinstance(body, str)
+        etag = '"' + hashlib.sha1(
+            body if binary else body.encode()).hexdigest()[:20] + '"'
+        entry = {'body': body, 'etag': etag, 'created': time.time()}
+        if not body:
+            self.memory.set(key, entry, size=1, ttl=min(
+                self.empty_ttl, self.ttl))
+            return body, etag
+        self.memory.set(key, entry, size=len(body))
+        if self.disk is not None:
+            self.disk.set(json.dumps(key), dict(
+                entry, binary=binary,
+                body=base64.b64encode(body).decode() if binary else body))
+        return body, etag
+
+    def _refresh(self, key, render):
+        try:
+            self._store(key, render())
+            self.refreshes += 1
+        except Exception:
+            logging.exception('refreshing %s failed', key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self):
+        return {
+            'page_hits': self.memory.hits,
+            'page_misses': self.memory.misses,
+            'page_entries': len(self.memory),
+            'page_bytes': self.memory.nbytes,
+            'page_refreshes': self.refreshes}
+
+
+class Jobs:
+    # background computations by key, each key runs at most once at a time
+    # and its result is kept for ttl seconds, an empty one (nothing found)
+    # for empty_ttl
+    def __init__(self, workers=2, maxsize=64, max_bytes=64 * 2**20, ttl=600,
+                 empty_ttl=60):
+        self.results = LRUCache(maxsize=maxsize, max_bytes=max_bytes, ttl=ttl)
+        self.empty_ttl = empty_ttl
+        self._running = {}
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self._lock = threading.Lock()
+
+    def submit(self, key, compute):
+        # starts compute() unless it runs or its result is still cached
+        with self._lock:
+            if key in self._running:
+                return self._running[key]
+            if self.results.get(key) is not MISSING:
+                return None
+            future = self._pool.submit(self._run, key, compute)
+            self._running[key] = future
+            return future
+
+    def put(self, key, value):
+        self.results.set(key, value, size=_size(value), ttl=(
+            None if value else min(self.empty_ttl, self.results.ttl)))
+
+    def _run(self, key, compute):
+        try:
+            value = compute()
+            self.put(key, value)
+            return value
+        except Exception:
+            logging.exception('job %s failed', key)
+            raise
+        finally:
+            with self._lock:
+                self._running.pop(key, None)
+
+    def result(self, key, compute=None, timeout=0):
+        # the result, waiting up to timeout seconds for a running job (which
+        # is started first if compute is given), MISSING if not done in time
+        value = self.results.get(key)
+        if value is not MISSING:
+            return value
+        with self._lock:
+            future = self._running.get(key)
+        if future is None and compute is not None:
+            future = self.submit(key, compute)
+        if future is None:
+            return self.results.get(key)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            return MISSING
+
+
+class Inflight:
+    # asyncio tasks by key, concurrent awaits of the same key share one task
+    # (asyncio is imported on use, the webapp never needs it)
+    def __init__(self):
+        self._tasks = {}
+
+    def start(self, key, factory):
+        # the running task of key, or a new one for factory()
+        import asyncio
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        return task
+
+    def _done(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled() and task.exception() is not None:
+            logging.error('task %s failed: %r', key, task.exception())
+
+    async def run(self, key, factory, timeout=None):
+        # the result of the shared task, a caller that times out or is
+        # cancelled leaves it running for the others
+        import asyncio
+        return await asyncio.wait_for(
+            asyncio.shield(self.start(key, factory)), timeout)
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in [
+        tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+def page_cache_from_env(prefix='PAGE_CACHE'):
+    # <prefix>_TTL fresh seconds, <prefix>_STALE seconds served stale while
+    # refreshing, <prefix>_EMPTY_TTL seconds for empty bodies, <prefix>_SIZE
+    # entries, <prefix>_BYTES memory limit and, to enable the disk tier,
+    # <prefix>_DIR
+    ttl = float(os.environ.get(prefix + '_TTL', 600))
+    stale = float(os.environ.get(prefix + '_STALE', 3600))
+    disk = None
+    directory = os.environ.get(prefix + '_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        disk = DiskCache(
+            os.path.join(directory, prefix.lower() + '.sqlite'),
+            ttl=ttl + stale)
+    return PageCache(
+        ttl=ttl, stale=stale,
+        maxsize=int(os.environ.get(prefix + '_SIZE', 128)),
+        max_bytes=int(os.environ.get(prefix + '_BYTES', 64 * 2**20)),
+        disk=disk, name=prefix.lower().replace('_cache', ''),
+        empty_ttl=float(os.environ.get(prefix + '_EMPTY_TTL', 60)))
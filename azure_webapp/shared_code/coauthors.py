@@ -0,0 +1,73 @@
+import numpy as np
+import scipy.sparse as sp
+
+# %%
+# co-authorship as a sparse papers x authors incidence matrix, built once
+# per search; counts, shading and collaborations are matrix operations
+
+
+def incidence(papers):
+    # (matrix, auids, authors): how often each author (column, by sorted
+    # AuId) is listed on each paper (row), and the (AuId, DAuN, DAfN) of
+    # each author's first listing
+    listed = [a for p in papers for a in p.authors]
+    auids, first, column = np.unique(
+        np.fromiter((a[0] for a in listed), dtype=np.int64, count=len(listed)),
+        return_index=True, return_inverse=True)
+    rows = np.repeat(
+        np.arange(len(papers)),
+        np.fromiter((len(p.authors) for p in papers), dtype=np.int64,
+                    count=len(papers)))
+    # duplicate (row, column) entries add up
+    matrix = sp.csr_matrix(
+        (np.ones(len(listed), dtype=np.int64), (rows, column)),
+        shape=(len(papers), len(auids)))
+    return matrix, auids, [listed[i] for i in first]
+
+
+def paper_counts(matrix):
+    # listings per author
+    return np.asarray(matrix.sum(axis=0)).ravel()
+
+
+def second_max(values):
+    # second largest value (the largest if it is shared), no full sort
+    if len(values) < 2:
+        return values.max(initial=0)
+    return np.partition(values, -2)[-2]
+
+
+def buckets(values, max_value):
+    # graph.shade indices of values, 0 darkest to 8 lightest
+    return np.clip(
+        (8 * (1 - values / max(max_value, 1))).astype(np.int64), 0, 8)
+
+
+def collaboration(matrix):
+    # authors x authors papers written together, no self loops
+    listed = (matrix > 0).astype(np.int64)
+    weights = (listed.T @ listed).tocsr()
+    weights.setdiag(0)
+    weights.eliminate_zeros()
+    return weights
+
+
+def top_collaborators(weights, k):
+    # weights with only the k heaviest entries of each row, ties broken by
+    # the lower column
+    weights = weights.tocsr()
+    rows = np.repeat(np.arange(weights.shape[0]), np.diff(weights.indptr))
+    order = np.lexsort((weights.indices, -weights.data, rows))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - weights.indptr[rows[order]]
+    keep = rank < k
+    return sp.csr_matrix(
+        (weights.data[keep], (rows[keep], weights.indices[keep])),
+        shape=weights.shape)
+
+
+def pairs(weights):
+    # (edges, weights) of the author pairs with an entry in either direction,
+    # each pair once
+    weights = sp.triu(weights.maximum(weights.T), k=1).tocoo()
+    return np.stack([weights.row, weights.col], axis=1), weights.data
@@ -0,0 +1,51 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from shared_code.cache import LRUCache, MISSING
+
+# %%
+# content type and whether a content coding helps, by graph data format
+CONTENT_TYPES = {
+    'json': ('application/json', True),
+    'npz': ('application/octet-stream', False)}
+# compressed bodies by (etag, encoding)
+compressed = LRUCache(maxsize=64, max_bytes=32 * 2**20, ttl=3600)
+
+
+def accepted_encoding(accept_encoding):
+    # best supported content coding of an Accept-Encoding header
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, q = part.strip().partition(';q=')
+        try:
+            accepted[coding.strip().lower()] = float(q or 1)
+        except ValueError:
+            continue
+    for coding in ('br', 'gzip'):
+        if coding == 'br' and brotli is None:
+            continue
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+
+def compress(body, etag, encoding):
+    # (body, etag) in the content coding, identity if encoding is None
+    if encoding is None:
+        return body, etag
+    key = (etag, encoding)
+    value = compressed.get(key)
+    if value is MISSING:
+        if isinstance(body, str):
+            body = body.encode()
+        if encoding == 'br':
+            value = brotli.compress(body, quality=5)
+        else:
+            value = gzip.compress(body, compresslevel=6)
+        compressed.set(key, value, size=len(value))
+    # every representation needs its own strong etag
+    return value, etag[:-1] + '-' + encoding + '"'
@@ -0,0 +1,117 @@
+# streams a citation dump into the local GraphStore used by BACKEND=local
+#
+#   python -m shared_code.ingest --store graph.sqlite --jsonl papers.jsonl
+#   python -m shared_code.ingest --store graph.sqlite \
+#       --papers Papers.txt --references PaperReferences.txt \
+#       --authors PaperAuthorAffiliations.txt
+#
+# jsonl lines are evaluate shaped entities (Id, DN, Y, CC, J.JN, AA, RId,
+# DOI), the txt files are the tab separated MAG tables, .gz files are read
+# compressed. Memory use is bounded by --batch rows.
+import argparse, gzip, itertools, json, time
+
+from shared_code.store import GraphStore, GRAPH_STORE
+
+# column positions in the MAG tables
+PAPERS = {'Id': 0, 'DOI': 2, 'DN': 5, 'Y': 7, 'CC': 19, 'JN': 21}
+PAPER_AUTHOR_AFFILIATIONS = {
+    'Id': 0, 'AuId': 1, 'seq': 3, 'DAuN': 4, 'DAfN': 5}
+
+
+def open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def tsv(path):
+    with open_text(path) as f:
+        for line in f:
+            yield line.rstrip('\n').split('\t')
+
+
+def _int(value, default=None):
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+def paper_rows(path):
+    c = PAPERS
+    for row in tsv(path):
+        yield (
+            int(row[c['Id']]), row[c['DN']], _int(row[c['Y']]),
+            _int(row[c['CC']], 0), row[c['JN']] or None, row[c['DOI']] or None)
+
+
+def reference_rows(path):
+    for row in tsv(path):
+        yield int(row[0]), int(row[1])
+
+
+def authorship_rows(path):
+    c = PAPER_AUTHOR_AFFILIATIONS
+    for row in tsv(path):
+        # rows without an AuId are dropped by GraphStore.add_authorships
+        yield (
+            int(row[c['Id']]), _int(row[c['AuId']]), _int(row[c['seq']], 0),
+            row[c['DAuN']], row[c['DAfN']])
+
+
+def entities(path):
+    with open_text(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def load(write, rows, size, label):
+    start = time.time()
+    total = 0
+    for batch in batches(rows, size):
+        write(batch)
+        total += len(batch)
+        print('{0}: {1} rows, {2:.0f}/s'.format(
+            label, total, total / max(time.time() - start, 1e-9)), end='\r')
+    print()
+    return total
+
+
+def ingest(store, jsonl=(), papers=(), references=(), authors=(),
+           batch=10000):
+    store.bulk_mode()
+    for path in jsonl:
+        load(store.add_entities, entities(path), batch, path)
+    for path in papers:
+        load(store.add_papers, paper_rows(path), batch, path)
+    for path in references:
+        load(store.add_references, reference_rows(path), batch, path)
+    for path in authors:
+        load(store.add_authorships, authorship_rows(path), batch, path)
+    print('creating indexes')
+    store.create_indexes()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='load a citation dump into the local graph store')
+    parser.add_argument('--store', default=GRAPH_STORE)
+    parser.add_argument('--jsonl', action='append', default=[])
+    parser.add_argument('--papers', action='append', default=[])
+    parser.add_argument('--references', action='append', default=[])
+    parser.add_argument('--authors', action='append', default=[])
+    parser.add_argument('--batch', type=int, default=10000)
+    args = parser.parse_args()
+    ingest(
+        GraphStore(args.store), args.jsonl, args.papers, args.references,
+        args.authors, args.batch)
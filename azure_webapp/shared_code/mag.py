@@ -0,0 +1,414 @@
+import concurrent.futures, http.client, urllib.parse, json, os, queue, threading, time
+
+from shared_code import metrics
+from shared_code.cache import MISSING, from_env
+from shared_code.store import get_store
+
+# %%
+# base url of the academic api, point it at a local stub server for testing,
+# e.g. MAG_API_URL=http://127.0.0.1:8080/academic/v1.0
+API_URL = os.environ.get(
+    'MAG_API_URL', 'https://api.labs.cognitive.microsoft.com/academic/v1.0')
+# persistent connections kept per worker process
+POOL_SIZE = int(os.environ.get('MAG_POOL_SIZE', '4'))
+TIMEOUT = float(os.environ.get('MAG_TIMEOUT', '30'))
+# reference lookups are split into chunks of this many ids, fetched by up to
+# MAG_CONCURRENCY threads, each chunk with its own socket timeout
+CHUNK_SIZE = int(os.environ.get('MAG_CHUNK_SIZE', '100'))
+CONCURRENCY = int(os.environ.get('MAG_CONCURRENCY', str(POOL_SIZE)))
+CHUNK_TIMEOUT = float(os.environ.get('MAG_CHUNK_TIMEOUT', '10'))
+# requests per second sent by one client (0 for no limit), answers with a
+# RETRY_STATUS are retried up to MAG_RETRIES times after their Retry-After
+RATE = float(os.environ.get('MAG_RATE', '0'))
+RETRIES = int(os.environ.get('MAG_RETRIES', '3'))
+RETRY_STATUS = (429, 503)
+# large result sets (the papers of an author) are requested MAG_PAGE_SIZE
+# entities at a time, walking offset
+PAGE_SIZE = int(os.environ.get('MAG_PAGE_SIZE', '250'))
+
+ATTRIBUTES = 'Id,DN,Y,CC,J.JN,AA.AuId,AA.DAuN,AA.DAfN,RId,DOI'
+
+headers = {
+    # Request headers
+    'Content-Type': 'application/x-www-form-urlencoded',
+    'Ocp-Apim-Subscription-Key': '',
+}
+
+# errors that mean a kept-alive socket was closed by the other side
+# while it was sitting in the pool
+STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError)
+
+
+# microsoft academic graph requests
+class ResponseError(Exception):
+    def __init__(self, errno, strerror):
+        self.errno = errno
+        self.strerror = strerror
+
+
+class UpstreamError(Exception):
+    # a search the api failed to answer, unlike an empty result it must not
+    # be cached as the answer
+    pass
+
+
+class Throttle:
+    # spaces calls at least 1/rate seconds apart over all threads, pause()
+    # holds every caller back, e.g. after the server asked to slow down
+    def __init__(self, rate=RATE):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # seconds until the caller's turn, the turn is taken
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        return start - now
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+def _retry_after(value, attempt):
+    # seconds of a Retry-After header, exponential backoff without one
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        return 2 ** attempt
+
+
+class AcademicClient:
+    # keeps a bounded pool of keep-alive connections to the academic api so
+    # consecutive interpret/evaluate calls skip the tcp and tls handshakes
+    def __init__(self, url=API_URL, pool_size=POOL_SIZE, timeout=TIMEOUT,
+                 rate=RATE, retries=RETRIES):
+        parsed = urllib.parse.urlsplit(url)
+        self.https = parsed.scheme == 'https'
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path.rstrip('/') + '/'
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self.throttle = Throttle(rate)
+        self.retries = retries
+
+    def _connect(self):
+        if self.https:
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(
+            self.host, self.port, timeout=self.timeout)
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def _release(self, conn, response):
+        if response is None or response.will_close:
+            conn.close()
+        else:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+        self._slots.release()
+
+    def post(self, endpoint, params, timeout=None):
+        body = urllib.parse.urlencode(params)
+        for attempt in range(self.retries + 1):
+            self.throttle.wait()
+            response, data = self._post(endpoint, body, timeout)
+            if response.status not in RETRY_STATUS or attempt == self.retries:
+                return data
+            self.throttle.pause(
+                _retry_after(response.getheader('Retry-After'), attempt))
+
+    def _post(self, endpoint, body, timeout=None):
+        conn, reused = self._acquire()
+        response = None
+        if timeout is not None:
+            _set_timeout(conn, timeout)
+        try:
+            try:
+                conn.request("POST", self.path + endpoint, body, headers)
+                response = conn.getresponse()
+                data = response.read()
+            except STALE_ERRORS:
+                # the server dropped an idle connection, reconnect once
+                conn.close()
+                if not reused:
+                    raise
+                conn = self._connect()
+                if timeout is not None:
+                    _set_timeout(conn, timeout)
+                conn.request("POST", self.path + endpoint, body, headers)
+                response = conn.getresponse()
+                data = response.read()
+        except Exception:
+            conn.close()
+            self._slots.release()
+            raise
+        if timeout is not None:
+            _set_timeout(conn, self.timeout)
+        self._release(conn, response)
+        return response, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def _set_timeout(conn, timeout):
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+
+
+# interpret and evaluate answers, see cache.from_env for the MAG_CACHE_*
+# settings, MAG_CACHE_DIR enables the on-disk tier
+cache = from_env('MAG_CACHE')
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AcademicClient()
+        return _client
+
+
+def set_client(client):
+    # swap the shared client, e.g. for one pointing at a stub server
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = client
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+def _decode(data):
+    data_decoded = json.loads(data)
+    if 'Error' in data_decoded.keys():
+        raise ResponseError(
+            -100, 'got answer but error: ' + str(data_decoded))
+    return data_decoded
+
+
+def _request(endpoint, params, key, timeout=None):
+    data_decoded = cache.get(key)
+    if data_decoded is not MISSING:
+        metrics.count('api_cache_hits')
+        return data_decoded
+    metrics.count('api_cache_misses')
+    with metrics.stage(endpoint):
+        data = get_client().post(endpoint, params, timeout=timeout)
+        metrics.count('upstream_bytes', len(data))
+        data_decoded = _decode(data)
+    cache.set(key, data_decoded, size=len(data))
+    return(data_decoded)
+
+
+def _report(e):
+    print("[Errno {0}] {1}".format(
+        getattr(e, 'errno', None), getattr(e, 'strerror', None) or e))
+
+
+def interpret_args(query):
+    # (endpoint, params, cache key) of an interpret request
+    query = normalize_query(query)
+    return 'interpret', {
+        'model': 'latest',
+        'count': '100',
+        'offset': '0',
+        'query': query,
+    }, json.dumps(['interpret', query])
+
+
+def evaluate_args(query, n=100, attributes=ATTRIBUTES, offset=0):
+    # (endpoint, params, cache key) of an evaluate request, the first page
+    # keeps the key it had before requests were paged
+    key = ['evaluate', query, int(n), attributes]
+    if offset:
+        key.append(int(offset))
+    return 'evaluate', {
+        # Request parameters
+        'model': 'latest',
+        'count': n,
+        'offset': str(offset),
+        'orderby': '',
+        'attributes': attributes,
+        'expr': query,
+    }, json.dumps(key)
+
+
+def interpret(query):
+    try:
+        return _request(*interpret_args(query))
+    except Exception as e:
+        _report(e)
+        return(None)
+
+
+def evaluate(query, n=100, attributes=ATTRIBUTES, timeout=None, offset=0):
+    try:
+        return _request(
+            *evaluate_args(query, n, attributes, offset), timeout=timeout)
+    except Exception as e:
+        _report(e)
+        return(None)
+
+
+def pages(n, page_size=PAGE_SIZE):
+    # (offset, count) of the requests for the first n entities
+    return [(offset, min(page_size, n - offset))
+            for offset in range(0, n, page_size)]
+
+
+def evaluate_pages(query, n, page_size=PAGE_SIZE, attributes=ATTRIBUTES):
+    # the entities of evaluate, one list per page of page_size; the next
+    # page is only requested when the consumer asks for it, and none after
+    # a failed or short page; a failed first page raises UpstreamError
+    for offset, count in pages(n, page_size):
+        eval_data = evaluate(
+            query, n=count, attributes=attributes, offset=offset)
+        if eval_data is None and not offset:
+            raise UpstreamError('evaluate failed for ' + query)
+        entities = entities_of(eval_data)
+        if not entities:
+            return
+        yield entities
+        if len(entities) < count:
+            return
+
+
+def chunk_expr(ids):
+    return "Or(Id=" + ",Id=".join([str(id) for id in ids]) + ")"
+
+
+def _fetch_chunk(ids, timeout):
+    eval_data = evaluate(chunk_expr(ids), n=len(ids), timeout=timeout)
+    if eval_data is None or 'entities' not in eval_data.keys():
+        return None
+    return eval_data['entities']
+
+
+def plan_fetch(ids, chunk_size=CHUNK_SIZE):
+    # (ids, store, found, chunks): the unique ids, the entities the store
+    # has for them and the missing ids in chunks of chunk_size
+    ids = list(dict.fromkeys(ids))
+    store = get_store()
+    found = store.get_many(ids)
+    missing = [id for id in ids if id not in found]
+    metrics.count('store_hits', len(found))
+    chunks = [
+        missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+    return ids, store, found, chunks
+
+
+def collect_fetch(ids, store, found, chunks, results):
+    # stores the entities fetched per chunk, {'entities': [...]} of ids
+    for chunk, entities in zip(chunks, results):
+        if entities is None:
+            # failed or timed out, leave these ids out of this graph
+            continue
+        returned = set(e['Id'] for e in entities)
+        # every id of the chunk was asked for, the rest do not exist
+        unknown = [id for id in chunk if id not in returned]
+        store.put_many(entities, unknown)
+        found.update((e['Id'], e) for e in entities)
+    return {'entities': [found[id] for id in ids if found.get(id)]}
+
+
+def fetch_papers(
+        ids, chunk_size=CHUNK_SIZE, concurrency=CONCURRENCY,
+        timeout=CHUNK_TIMEOUT):
+    # evaluate for a list of paper ids, answered from the entity store where
+    # possible so only missing or stale ids are requested, in chunks of
+    # chunk_size ids fetched concurrently
+    ids, store, found, chunks = plan_fetch(ids, chunk_size)
+    if len(chunks) == 1:
+        results = [_fetch_chunk(chunks[0], timeout)]
+    elif chunks:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(concurrency, len(chunks))) as executor:
+            futures = [
+                executor.submit(
+                    metrics.in_context(_fetch_chunk), chunk, timeout)
+                for chunk in chunks]
+            results = [future.result() for future in futures]
+    else:
+        results = []
+    return collect_fetch(ids, store, found, chunks, results)
+
+
+class AcademicApi:
+    # backend answering graph requests from the academic api, see
+    # store.GraphStore for the offline one
+    def search(self, query, n, mode='publications'):
+        # (expr, entities) of the most likely interpretation of query
+        expr, found = self.search_pages(query, n, mode=mode)
+        return expr, [e for page in found for e in page] or None
+
+    def search_pages(self, query, n, mode='publications'):
+        # (expr, iterator over lists of entities), see evaluate_pages
+        expr = first_expr(interpreted(interpret(query), query))
+        if expr is None:
+            return None, iter(())
+        return expr, evaluate_pages(expr, n)
+
+    def fetch(self, ids):
+        return entities_of(fetch_papers(ids)) or []
+
+
+def interpreted(interpret_data, query):
+    # interpret_data, UpstreamError if the request failed
+    if interpret_data is None:
+        raise UpstreamError('interpret failed for ' + query)
+    return interpret_data
+
+
+def first_expr(interpret_data):
+    if interpret_data is None \
+            or 'interpretations' not in interpret_data.keys():
+        return None
+    exprs = [
+        e['rules'][0]['output']['value']
+        for e in interpret_data['interpretations']
+        if e['rules'][0]['output']['type'] == 'query']
+    return exprs[0] if exprs else None
+
+
+def entities_of(eval_data):
+    if eval_data is None or 'entities' not in eval_data.keys():
+        return None
+    return eval_data['entities']
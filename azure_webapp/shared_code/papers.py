@@ -0,0 +1,66 @@
+# %%
+# evaluate entities are converted once into compact records, incomplete
+# entities (no title, authors, journal, year or citation count) are dropped
+
+
+class Paper:
+    __slots__ = (
+        'Id', 'title', 'authors', 'journal', 'year', 'citations', 'DOI',
+        'rids')
+
+    def __init__(self, Id, title, authors, journal, year, citations, DOI,
+                 rids):
+        self.Id = Id
+        self.title = title
+        # (AuId, DAuN, DAfN) tuples
+        self.authors = authors
+        self.journal = journal
+        self.year = year
+        self.citations = citations
+        self.DOI = DOI
+        self.rids = rids
+
+    @property
+    def author_names(self):
+        return ', '.join([a[1] for a in self.authors])
+
+
+class Papers(list):
+    # normalized papers plus what the graph stages need from the whole set
+    def __init__(self, papers=(), max_cit=0, rids=()):
+        super().__init__(papers)
+        self.max_cit = max_cit
+        # referenced ids, first-seen order, no duplicates, none of the papers
+        self.rids = list(rids)
+
+
+def normalize_entity(e):
+    try:
+        journal = e['J']['JN']
+        authors = tuple([
+            (a.get('AuId'), a['DAuN'], a.get('DAfN', '')) for a in e['AA']])
+        return Paper(
+            e['Id'], e['DN'], authors, journal, e['Y'], int(e['CC']),
+            e.get('DOI', 'unknown'), tuple(e.get('RId', ())))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def normalize(entities):
+    papers = []
+    max_cit = 0
+    seen = set()
+    rids = []
+    for e in entities:
+        paper = normalize_entity(e)
+        if paper is None:
+            continue
+        papers.append(paper)
+        if paper.citations > max_cit:
+            max_cit = paper.citations
+        for rid in paper.rids:
+            if rid not in seen:
+                seen.add(rid)
+                rids.append(rid)
+    ids = set(p.Id for p in papers)
+    return Papers(papers, max_cit, [rid for rid in rids if rid not in ids])
@@ -0,0 +1,274 @@
+import json, os, re, sqlite3, tempfile, threading, time
+
+# %%
+# papers fetched from the academic api, keyed by Id, so popular references
+# are only requested again once they went stale; the default is under $HOME,
+# which azure keeps over restarts and shares between instances (the temp
+# directory is dropped on every cold start). Stale papers are deleted when
+# the store is opened and every MAG_STORE_PRUNE_EVERY writes
+STORE_PATH = os.environ.get('MAG_STORE', os.path.join(
+    os.path.expanduser('~'), '.sciencegraph', 'sciencegraph.sqlite'))
+MAX_AGE = float(os.environ.get('MAG_STORE_MAX_AGE', 7 * 86400))
+PRUNE_EVERY = int(os.environ.get('MAG_STORE_PRUNE_EVERY', '1000'))
+
+# offline citation graph written by shared_code.ingest
+GRAPH_STORE = os.environ.get(
+    'GRAPH_STORE', os.path.join(tempfile.gettempdir(), 'graph.sqlite'))
+
+# stay below the sqlite host parameter limit of older builds
+CHUNK = 500
+
+
+class EntityStore:
+    def __init__(self, path=STORE_PATH, max_age=MAX_AGE,
+                 prune_every=PRUNE_EVERY):
+        self.path = path
+        self.max_age = max_age
+        self.prune_every = prune_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            # data is NULL for ids the api had no paper for
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS papers '
+                '(Id INTEGER PRIMARY KEY, fetched REAL, data TEXT)')
+        self.prune()
+
+    def get_many(self, ids):
+        # fresh entries only, unknown ids map to None
+        found = {}
+        oldest = time.time() - self.max_age
+        with self._lock:
+            for i in range(0, len(ids), CHUNK):
+                chunk = ids[i:i + CHUNK]
+                rows = self._db.execute(
+                    'SELECT Id, data FROM papers WHERE fetched >= ? AND Id IN ('
+                    + ','.join('?' * len(chunk)) + ')',
+                    [oldest] + list(chunk)).fetchall()
+                for id, data in rows:
+                    found[id] = None if data is None else json.loads(data)
+        return found
+
+    def put_many(self, entities, unknown=()):
+        now = time.time()
+        rows = [(e['Id'], now, json.dumps(e)) for e in entities]
+        rows.extend((id, now, None) for id in unknown)
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO papers VALUES (?, ?, ?)', rows)
+            self._writes += 1
+            prune = self._writes % self.prune_every == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        with self._lock, self._db:
+            self._db.execute(
+                'DELETE FROM papers WHERE fetched < ?',
+                (time.time() - self.max_age,))
+
+
+def words(text):
+    return set(re.findall(r'[a-z0-9]+', text.lower()))
+
+
+def name_key(name):
+    return ' '.join(re.findall(r'[a-z0-9]+', name.lower()))
+
+
+class GraphStore:
+    # papers, references and authorships of a citation dump, indexed by
+    # paper Id, author Id, author name and title keyword, answers the same
+    # entity dicts as evaluate
+    schema = [
+        'CREATE TABLE IF NOT EXISTS papers (Id INTEGER PRIMARY KEY, '
+        'DN TEXT, Y INTEGER, CC INTEGER, JN TEXT, DOI TEXT)',
+        # the unique constraints make ingesting a dump or an entity twice
+        # a no-op and double as the (Id) and (word) indexes
+        'CREATE TABLE IF NOT EXISTS refs (Id INTEGER, RId INTEGER, '
+        'UNIQUE (Id, RId))',
+        'CREATE TABLE IF NOT EXISTS authorship (Id INTEGER, '
+        'AuId INTEGER NOT NULL, seq INTEGER, DAuN TEXT, DAfN TEXT, '
+        'name TEXT, UNIQUE (Id, AuId))',
+        'CREATE TABLE IF NOT EXISTS keywords (word TEXT, Id INTEGER, '
+        'UNIQUE (word, Id))']
+    indexes = [
+        'CREATE INDEX IF NOT EXISTS authorship_auid ON authorship (AuId)',
+        'CREATE INDEX IF NOT EXISTS authorship_name ON authorship (name)',
+        'CREATE INDEX IF NOT EXISTS papers_cc ON papers (CC)']
+
+    def __init__(self, path=GRAPH_STORE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            for statement in self.schema:
+                self._db.execute(statement)
+
+    # %% writing, used by shared_code.ingest
+    def bulk_mode(self):
+        # faster, unsafe writes while ingesting, indexes come afterwards
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('PRAGMA synchronous = OFF')
+
+    def add_papers(self, rows):
+        # (Id, DN, Y, CC, JN, DOI) tuples
+        rows = list(rows)
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO papers VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._db.executemany(
+                'INSERT OR IGNORE INTO keywords VALUES (?, ?)',
+                [(word, row[0]) for row in rows for word in words(row[1])])
+
+    def add_references(self, rows):
+        # (Id, RId) tuples
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR IGNORE INTO refs VALUES (?, ?)', rows)
+
+    def add_authorships(self, rows):
+        # (Id, AuId, seq, DAuN, DAfN) tuples, rows without an AuId are
+        # dropped and an author is listed once per paper (the first of
+        # several affiliations)
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR IGNORE INTO authorship VALUES (?, ?, ?, ?, ?, ?)',
+                [row + (name_key(row[3] or ''),) for row in rows
+                 if row[1] is not None])
+
+    def add_entities(self, entities):
+        # evaluate shaped entity dicts
+        papers, refs, authorships = [], [], []
+        for e in entities:
+            papers.append((
+                e['Id'], e.get('DN', ''), e.get('Y'), e.get('CC', 0),
+                e.get('J', {}).get('JN'), e.get('DOI')))
+            refs.extend((e['Id'], rid) for rid in e.get('RId', ()))
+            authorships.extend(
+                (e['Id'], a.get('AuId'), seq, a.get('DAuN', ''),
+                 a.get('DAfN', ''))
+                for seq, a in enumerate(e.get('AA', ())))
+        self.add_papers(papers)
+        self.add_references(refs)
+        self.add_authorships(authorships)
+
+    def create_indexes(self):
+        with self._lock, self._db:
+            for statement in self.indexes:
+                self._db.execute(statement)
+            self._db.execute('ANALYZE')
+
+    # %% reading
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _in(self, sql, ids):
+        rows = []
+        for i in range(0, len(ids), CHUNK):
+            chunk = list(ids[i:i + CHUNK])
+            rows.extend(self._query(
+                sql.format(','.join('?' * len(chunk))), chunk))
+        return rows
+
+    def entities(self, ids):
+        # evaluate shaped entities for the known ids, in the given order;
+        # references and authorships of ids without a papers row (partial
+        # dumps) are left out
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        for Id, DN, Y, CC, JN, DOI in self._in(
+                'SELECT * FROM papers WHERE Id IN ({0})', ids):
+            e = {'Id': Id, 'DN': DN, 'Y': Y, 'CC': CC, 'AA': [], 'RId': []}
+            if JN is not None:
+                e['J'] = {'JN': JN}
+            if DOI:
+                e['DOI'] = DOI
+            found[Id] = e
+        known = list(found)
+        for Id, RId in self._in(
+                'SELECT Id, RId FROM refs WHERE Id IN ({0})', known):
+            found[Id]['RId'].append(RId)
+        for Id, AuId, DAuN, DAfN in self._in(
+                'SELECT Id, AuId, DAuN, DAfN FROM authorship '
+                'WHERE Id IN ({0}) ORDER BY Id, seq', known):
+            found[Id]['AA'].append({'AuId': AuId, 'DAuN': DAuN, 'DAfN': DAfN})
+        return [found[id] for id in ids if id in found]
+
+    def search(self, query, n, mode='publications'):
+        # (expr, entities) like interpret followed by evaluate, keyword
+        # search on titles or, for authors, papers of the best name match
+        expr, ids = self._search_ids(query, n, mode)
+        if expr is None:
+            return None, None
+        return expr, self.entities(ids)
+
+    def search_pages(self, query, n, mode='publications', page_size=CHUNK):
+        # (expr, iterator over lists of entities), the papers are loaded a
+        # page at a time like mag.evaluate_pages
+        expr, ids = self._search_ids(query, n, mode)
+        if expr is None:
+            return None, iter(())
+        return expr, (
+            self.entities(ids[i:i + page_size])
+            for i in range(0, len(ids), page_size))
+
+    def _search_ids(self, query, n, mode):
+        if mode == 'authors':
+            key = name_key(query)
+            rows = self._query(
+                'SELECT AuId, COUNT(*) c FROM authorship WHERE name = ? '
+                'GROUP BY AuId ORDER BY c DESC LIMIT 1', (key,))
+            if not rows:
+                return None, None
+            expr = "Composite(AA.AuN=='{0}')".format(key)
+            ids = [r[0] for r in self._query(
+                'SELECT a.Id FROM authorship a JOIN papers p ON p.Id = a.Id '
+                'WHERE a.AuId = ? ORDER BY p.CC DESC LIMIT ?', (rows[0][0], n))]
+            return expr, ids
+        else:
+            keys = sorted(words(query))
+            if not keys:
+                return None, None
+            expr = 'And(' + ','.join(["W=='{0}'".format(k) for k in keys]) + ')'
+            ids = [r[0] for r in self._query(
+                'SELECT Id FROM papers WHERE Id IN (' + ' INTERSECT '.join(
+                    ['SELECT Id FROM keywords WHERE word = ?'] * len(keys))
+                + ') ORDER BY CC DESC LIMIT ?', keys + [n])]
+        return expr, ids
+
+    def fetch(self, ids):
+        return self.entities(ids)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EntityStore()
+        return _store
+
+
+def set_store(store):
+    global _store
+    with _store_lock:
+        _store = store
+
+
+_graph_store = None
+
+
+def get_graph_store():
+    global _graph_store
+    with _store_lock:
+        if _graph_store is None:
+            _graph_store = GraphStore()
+        return _graph_store
@@ -0,0 +1,63 @@
+# graph construction without network access, scaling over the number of
+# primaries, the list-membership edge builder it replaced is timed alongside
+# up to --legacy-max primaries (it takes minutes at 1000)
+#
+#   python benchmarks/bench_graph.py [--fixture name]
+#
+# --fixture reads a recording of record.py, e.g. the stub5 one checked in
+import argparse, time
+
+from fixtures import synthetic_payloads, load_payloads
+
+from shared_code.graph import citation_edges, build_graph
+from shared_code.papers import normalize
+
+
+def legacy_edges(papers, papers_ref):
+    ids = [p.Id for p in papers]
+    ids_ref = [p.Id for p in papers_ref]
+    edges = []
+    for p in papers:
+        edges.extend([(p.Id, rid) for rid in p.rids if rid in ids])
+        edges.extend([(p.Id, rid) for rid in p.rids if rid in ids_ref])
+    for p in papers_ref:
+        edges.extend([(p.Id, rid) for rid in p.rids if rid in ids_ref])
+    return edges
+
+
+def timeit(f, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(name, eval_data, eval_data_ref, legacy_max):
+    t_normalize = timeit(normalize, eval_data_ref['entities'])
+    papers = normalize(eval_data['entities'])
+    papers_ref = normalize(eval_data_ref['entities'])
+    t_edges = timeit(lambda: list(citation_edges(papers, papers_ref)))
+    t_legacy = float('nan')
+    if len(papers) <= legacy_max:
+        t_legacy = timeit(legacy_edges, papers, papers_ref, repeat=1)
+    t_graph = timeit(build_graph, papers, papers_ref)
+    print('{0:>12} {1:>7} {2:>7} {3:>9.2f} {4:>9.2f} {5:>9.2f} {6:>9.2f}'.format(
+        name, len(papers), len(papers_ref), 1e3 * t_normalize, 1e3 * t_edges,
+        1e3 * t_legacy, 1e3 * t_graph))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixture', action='append', default=[])
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--legacy-max', type=int, default=100)
+    args = parser.parse_args()
+    print('{0:>12} {1:>7} {2:>7} {3:>9} {4:>9} {5:>9} {6:>9}'.format(
+        'payload', 'papers', 'refs', 'norm ms', 'edges ms', 'legacy ms',
+        'graph ms'))
+    for name in args.fixture:
+        run(name, *load_payloads(name), args.legacy_max)
+    for n in [int(n) for n in args.sizes.split(',')]:
+        run('synthetic' + str(n), *synthetic_payloads(n), args.legacy_max)
@@ -0,0 +1,50 @@
+# layout wall time and quality on synthetic citation graphs
+#
+#   python benchmarks/bench_layout.py [--sizes 10,50,200] [--spring-max 50]
+#
+# quality: edge ratio is the mean edge length over the mean distance of
+# random node pairs (lower means linked papers sit closer together),
+# crowding the share of random pairs closer than 1% of the plot width
+import argparse, time
+
+import numpy as np
+
+from fixtures import synthetic_payloads
+
+from shared_code.graph import build_graph
+from shared_code.layout import layouts
+from shared_code.papers import normalize
+
+
+def quality(graph, xy, seed=0):
+    edges = graph.edges
+    rng = np.random.RandomState(seed)
+    pairs = rng.randint(0, len(graph), size=(20000, 2))
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    random_dist = np.linalg.norm(xy[pairs[:, 0]] - xy[pairs[:, 1]], axis=1)
+    edge_dist = np.linalg.norm(xy[edges[:, 0]] - xy[edges[:, 1]], axis=1)
+    return edge_dist.mean() / random_dist.mean(), (random_dist < 0.02).mean()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10,50,200')
+    parser.add_argument('--spring-max', type=int, default=50)
+    args = parser.parse_args()
+    print('{0:>9} {1:>7} {2:>7} {3:>8} {4:>10} {5:>10} {6:>9}'.format(
+        'primaries', 'nodes', 'edges', 'layout', 'wall s', 'edge ratio',
+        'crowding'))
+    for n in [int(n) for n in args.sizes.split(',')]:
+        eval_data, eval_data_ref = synthetic_payloads(n)
+        graph = build_graph(
+            normalize(eval_data['entities']),
+            normalize(eval_data_ref['entities']))
+        for name, layout in sorted(layouts.items()):
+            if name == 'spring' and n > args.spring_max:
+                continue
+            start = time.perf_counter()
+            pos = layout(graph, seed=12345)
+            wall = time.perf_counter() - start
+            print('{0:>9} {1:>7} {2:>7} {3:>8} {4:>10.3f} {5:>10.3f} {6:>9.4f}'.format(
+                n, graph.number_of_nodes(), graph.number_of_edges(), name,
+                wall, *quality(graph, pos)))
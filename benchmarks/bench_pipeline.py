@@ -0,0 +1,206 @@
+# wall time, peak memory and output size of the page pipeline stages
+# (graph.prepare_data, graph.prepare_data_authors and http_request.draw_plot)
+# against a stub of the academic api running in its own process
+#
+#   python benchmarks/bench_pipeline.py [--sizes 10,100,1000,10000]
+#       [--fixture name ...] [--repeat 3] [--out results.json]
+#       [--compare old.json]
+#
+# synthetic payloads search for --sizes papers (the author node budget is
+# lifted so the size is what gets fetched), --fixture replays a recording
+# made with record.py. seconds is the best of --repeat runs, peak the
+# tracemalloc peak of one more run (tracing slows it down), each run starts
+# from empty api and layout caches and an empty entity store. the results
+# are written as json, --compare prints the ratios to an earlier file
+import argparse, datetime, json, os, platform, shutil, subprocess, sys
+import tempfile, time, tracemalloc
+
+from fixtures import load_recording
+
+from shared_code import graph, layout, mag, metrics, store
+from shared_code.cache import LRUCache, TieredCache
+from shared_code.data import reduced
+from http_request import draw_plot
+
+from stub import point_at
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_stub(fixture=None):
+    # (process, url) of stub.py, in its own process so its allocations and
+    # its share of the interpreter stay out of the measurements
+    command = [sys.executable, os.path.join(HERE, 'stub.py')]
+    if fixture:
+        command += ['--replay', fixture]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    return process, process.stdout.readline().decode().strip()
+
+
+class Fresh:
+    # empty caches and entity store for every run
+    def __init__(self):
+        self.directory = tempfile.mkdtemp()
+        self.runs = 0
+
+    def __call__(self):
+        self.runs += 1
+        mag.cache = TieredCache(LRUCache())
+        layout.cache = TieredCache(LRUCache(maxsize=64))
+        store.set_store(store.EntityStore(os.path.join(
+            self.directory, 'store{0}.sqlite'.format(self.runs))))
+
+    def close(self):
+        shutil.rmtree(self.directory)
+
+
+def measure(func, repeat, fresh):
+    # (best seconds, peak MiB, upstream bytes, result)
+    best = float('inf')
+    for _ in range(repeat):
+        fresh()
+        upstream = metrics.registry.counters.get('upstream_bytes', 0)
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+        upstream = metrics.registry.counters.get('upstream_bytes', 0) - upstream
+    fresh()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak / 2**20, upstream, result
+
+
+def run(payload, papers, query, n, modes, repeat, fresh):
+    # result rows of the stages for one search
+    rows = []
+
+    def row(stage, seconds, peak, **size):
+        rows.append(dict(payload=payload, papers=papers, stage=stage,
+                         seconds=seconds, peak_mib=peak, **size))
+        print(format_row(rows[-1]), flush=True)
+
+    api = mag.AcademicApi()
+    for mode in modes:
+        if mode == 'authors':
+            name, plot = 'prepare_data_authors', 'draw_plot_authors'
+            seconds, peak, upstream, (G, expr) = measure(
+                lambda: graph.prepare_data_authors(query, backend=api),
+                repeat, fresh)
+            G_plot = reduced(G, 'A')
+        else:
+            name, plot = 'prepare_data', 'draw_plot'
+            seconds, peak, upstream, (G, expr) = measure(
+                lambda: graph.prepare_data(query, n, backend=api),
+                repeat, fresh)
+            G_plot = reduced(G, n)
+        row(name, seconds, peak, nodes=len(G),
+            edges=G.number_of_edges(), bytes=upstream)
+        seconds, peak, _, (script, div) = measure(
+            lambda: draw_plot(G_plot, query, expr, type=mode),
+            repeat, fresh)
+        row(plot, seconds, peak, nodes=len(G_plot),
+            edges=G_plot.number_of_edges(), bytes=len(script) + len(div))
+    return rows
+
+
+def warm_up(fresh):
+    # the first calls import bokeh and the lazily loaded modules
+    fresh()
+    G, expr = graph.prepare_data('warm up', 10, backend=mag.AcademicApi())
+    draw_plot(reduced(G, 10), 'warm up', expr)
+
+
+HEADER = '{0:>12} {1:>6} {2:>20} {3:>8} {4:>8} {5:>6} {6:>7} {7:>10}'.format(
+    'payload', 'papers', 'stage', 'seconds', 'peak MiB', 'nodes', 'edges',
+    'bytes')
+
+
+def format_row(r, old=None):
+    line = '{0:>12} {1:>6} {2:>20} {3:>8.3f} {4:>8.1f} {5:>6} {6:>7} ' \
+        '{7:>10}'.format(r['payload'], r['papers'], r['stage'], r['seconds'],
+                         r['peak_mib'], r['nodes'], r['edges'], r['bytes'])
+    if old:
+        line += ' {0:>7.2f}x {1:>7.2f}x'.format(
+            r['seconds'] / old['seconds'], r['peak_mib'] / old['peak_mib'])
+    return line
+
+
+def revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, path):
+    # ratios of this run to the same rows of an earlier one
+    with open(path) as f:
+        old = dict(((r['payload'], r['papers'], r['stage']), r)
+                   for r in json.load(f)['results'])
+    print('\ncompared to {0} (new / old seconds, peak)'.format(path))
+    print(HEADER + ' {0:>8} {1:>8}'.format('seconds', 'peak'))
+    for r in results:
+        key = (r['payload'], r['papers'], r['stage'])
+        if key in old:
+            print(format_row(r, old[key]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10,100,1000,10000',
+                        help='synthetic search sizes, empty for none')
+    parser.add_argument('--fixture', action='append', default=[],
+                        help='recording to replay, can be repeated')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', default='bench_pipeline.json')
+    parser.add_argument('--compare', metavar='OLD')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+
+    fresh = Fresh()
+    results = []
+    print(HEADER)
+    try:
+        process, url = start_stub()
+        try:
+            point_at(url)
+            warm_up(fresh)
+            graph.AUTHOR_NODES = sys.maxsize
+            for size in sizes:
+                graph.AUTHOR_PAPERS = size
+                results.extend(run(
+                    'synthetic', size, 'synthetic {0}'.format(size), size,
+                    ('publications', 'authors'), args.repeat, fresh))
+        finally:
+            process.kill()
+        graph.AUTHOR_NODES = int(os.environ.get('GRAPH_AUTHOR_NODES', '5000'))
+        for fixture in args.fixture:
+            recording = load_recording(fixture)
+            graph.AUTHOR_PAPERS = recording['n']
+            process, url = start_stub(fixture)
+            try:
+                point_at(url)
+                results.extend(run(
+                    fixture, recording['n'], recording['query'],
+                    recording['n'], (recording['mode'],), args.repeat, fresh))
+            finally:
+                process.kill()
+    finally:
+        fresh.close()
+
+    with open(args.out, 'w') as f:
+        json.dump({
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'revision': revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+            'results': results}, f, indent=1)
+    print('\nwritten to {0}'.format(args.out))
+    if args.compare:
+        compare(results, args.compare)
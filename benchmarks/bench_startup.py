@@ -0,0 +1,111 @@
+# cold start cost of the entry points, each run in a fresh interpreter
+#
+#   python benchmarks/bench_startup.py [--repeat 5] [--profile 15]
+#
+# wall time of the import and of the first default request (against a local
+# stub of the academic api), once with empty caches and once with the disk
+# caches the cold run left behind, plus the heavy modules loaded after the
+# import and after the first request. --profile lists the most expensive
+# imports of each entry point (python -X importtime, cumulative)
+import argparse, json, os, shutil, statistics, subprocess, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('bokeh', 'networkx', 'numpy', 'scipy', 'jinja2')
+CACHES = ('MAG_CACHE_DIR', 'LAYOUT_CACHE_DIR', 'PAGE_CACHE_DIR',
+          'DATA_CACHE_DIR')
+
+# name: (directory, import statement, first request)
+TARGETS = {
+    'webapp': (
+        'azure_webapp', 'import application',
+        'application.app.test_client().get("/")'),
+    'function': (
+        'azure_function', 'import http_request',
+        'asyncio.run(http_request.main(func.HttpRequest('
+        '"GET", "/api/http_request", params={}, body=b"")))'),
+    'graph_data': (
+        'azure_function', 'import graph_data',
+        'graph_data.main(func.HttpRequest('
+        '"GET", "/api/graph_data", params={}, body=b""))'),
+}
+
+PROBE = '''
+import json, sys, time
+sys.path.insert(0, {benchmarks!r})
+start = time.perf_counter()
+{statement}
+imported = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+from stub import serve
+serve()
+import asyncio
+import azure.functions as func
+start = time.perf_counter()
+{request}
+print(json.dumps({{
+    'import': imported, 'first': time.perf_counter() - start,
+    'heavy': heavy,
+    'heavy_first': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def probe(directory, statement, request, cache_dir):
+    code = PROBE.format(
+        benchmarks=os.path.join(ROOT, 'benchmarks'), statement=statement,
+        request=request, heavy=HEAVY)
+    env = dict(os.environ, WEBAPP_WARM='0', MAG_STORE=os.path.join(
+        cache_dir, 'store.sqlite'))
+    env.update((name, cache_dir) for name in CACHES)
+    out = subprocess.run(
+        [sys.executable, '-c', code], cwd=os.path.join(ROOT, directory),
+        env=env, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def profile(directory, statement, top):
+    # [(cumulative seconds, module)] of the top level imports
+    err = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=os.path.join(ROOT, directory), check=True,
+        stderr=subprocess.PIPE).stderr.decode()
+    times = []
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # nesting shows as two spaces per level
+        if len(name) - len(name.lstrip()) <= 3:
+            times.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(times, reverse=True)[:top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--profile', type=int, default=0, metavar='TOP')
+    args = parser.parse_args()
+    print('{0:>10} {1:>7} {2:>8} {3:>7}  {4:<24} {5}'.format(
+        'target', 'caches', 'import s', 'first s', 'heavy after import',
+        'heavy after first request'))
+    for name, (directory, statement, request) in sorted(TARGETS.items()):
+        runs = {'cold': [], 'cached': []}
+        for _ in range(args.repeat):
+            cache_dir = tempfile.mkdtemp()
+            try:
+                for caches in ('cold', 'cached'):
+                    runs[caches].append(
+                        probe(directory, statement, request, cache_dir))
+            finally:
+                shutil.rmtree(cache_dir)
+        for caches, results in runs.items():
+            print('{0:>10} {1:>7} {2:>8.3f} {3:>7.3f}  {4:<24} {5}'.format(
+                name, caches,
+                statistics.median(r['import'] for r in results),
+                statistics.median(r['first'] for r in results),
+                ', '.join(results[0]['heavy']) or '-',
+                ', '.join(results[0]['heavy_first']) or '-'))
+    for name, (directory, statement, _) in sorted(TARGETS.items()):
+        if args.profile:
+            print('\nslowest imports of {0} (cumulative s)'.format(name))
+            for seconds, module in profile(directory, statement, args.profile):
+                print('{0:>8.3f}  {1}'.format(seconds, module))
@@ -0,0 +1,70 @@
+import json, os, random, sys
+
+# make shared_code importable when running from the repository root
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    '..', 'azure_function'))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def synthetic_paper(id, rng, n_refs, id_space):
+    paper = {
+        'Id': id,
+        'DN': 'synthetic paper {0}'.format(id),
+        'Y': rng.randint(1950, 2020),
+        'CC': int(rng.paretovariate(1.2)),
+        'J': {'JN': 'journal {0}'.format(rng.randint(0, 50))},
+        'AA': [
+            {'AuId': rng.randint(1, 10 * id_space),
+             'DAuN': 'author {0}'.format(k),
+             'DAfN': 'affiliation {0}'.format(k)}
+            for k in range(rng.randint(1, 6))],
+        'RId': [rng.randint(1, id_space) for _ in range(n_refs)]}
+    if rng.random() < 0.8:
+        paper['DOI'] = '10.0000/{0}'.format(id)
+    return paper
+
+
+def synthetic_payloads(n_primaries, n_refs=30, seed=12345):
+    # evaluate answers for n_primaries papers and all of their references,
+    # references are drawn from a pool that grows with the request so
+    # popular papers are shared between primaries like in real data
+    rng = random.Random(seed)
+    id_space = 20 * n_primaries + 100
+    primaries = [
+        synthetic_paper(id_space + 1 + i, rng, n_refs, id_space)
+        for i in range(n_primaries)]
+    rids = sorted(set(rid for p in primaries for rid in p['RId']))
+    references = [synthetic_paper(rid, rng, n_refs, id_space) for rid in rids]
+    return {'entities': primaries}, {'entities': references}
+
+
+def load_payloads(name):
+    # the evaluate answers of a recording made with record.py, split like
+    # synthetic_payloads into the search results and the reference lookups
+    primaries, references = [], []
+    for exchange in load_recording(name)['exchanges']:
+        if exchange['endpoint'] != 'evaluate':
+            continue
+        entities = (exchange['answer'] or {}).get('entities', [])
+        if exchange['params']['expr'].startswith('Or('):
+            references.extend(entities)
+        else:
+            primaries.extend(entities)
+    return {'entities': primaries}, {'entities': references}
+
+
+def save_recording(name, recording):
+    # fixtures/<name>.recording.json, see record.py
+    os.makedirs(FIXTURES, exist_ok=True)
+    path = os.path.join(FIXTURES, name + '.recording.json')
+    with open(path, 'w') as f:
+        json.dump(recording, f)
+    return path
+
+
+def load_recording(name):
+    # {'query', 'n', 'mode', 'exchanges': [{'endpoint', 'params', 'answer'}]}
+    with open(os.path.join(FIXTURES, name + '.recording.json')) as f:
+        return json.load(f)
@@ -0,0 +1,69 @@
+# records the interpret and evaluate answers of one search into a fixture
+# that stub.py replays and bench_pipeline.py and bench_graph.py measure,
+# needs network access and a subscription key (--key or MAG_KEY); --url
+# records from another server, fixtures/stub5 comes from stub.py
+#
+#   python benchmarks/record.py name --query "graphene" [--n 100]
+#   python benchmarks/record.py name --query "a. geim" --mode authors
+#
+# every answer comes from the api: the api cache is memory only and the
+# entity store a temporary file for the run
+import argparse, json, os, tempfile, threading
+
+from fixtures import save_recording
+
+from shared_code import graph, mag, store
+from shared_code.cache import LRUCache, TieredCache
+
+
+class RecordingClient(mag.AcademicClient):
+    # AcademicClient keeping every (endpoint, params, answer) it posted
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.exchanges = []
+        self._lock = threading.Lock()
+
+    def post(self, endpoint, params, timeout=None):
+        data = super().post(endpoint, params, timeout=timeout)
+        with self._lock:
+            self.exchanges.append({
+                'endpoint': endpoint, 'params': dict(params),
+                'answer': json.loads(data)})
+        return data
+
+
+def record(query, n, mode, url=mag.API_URL):
+    client = RecordingClient(url)
+    mag.set_client(client)
+    mag.cache = TieredCache(LRUCache())
+    api = mag.AcademicApi()
+    with tempfile.TemporaryDirectory() as directory:
+        store.set_store(
+            store.EntityStore(os.path.join(directory, 'store.sqlite')))
+        if mode == 'authors':
+            graph.AUTHOR_PAPERS = n
+            G, expr = graph.prepare_data_authors(query, backend=api)
+        else:
+            G, expr = graph.prepare_data(query, n, backend=api)
+    if not G:
+        raise SystemExit('no results for {0!r}'.format(query))
+    return {'query': query, 'n': n, 'mode': mode, 'expr': expr,
+            'nodes': len(G), 'exchanges': client.exchanges}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('name')
+    parser.add_argument('--query', required=True)
+    parser.add_argument('--n', type=int, default=100,
+                        help='primaries, or author papers with --mode authors')
+    parser.add_argument('--mode', choices=('publications', 'authors'),
+                        default='publications')
+    parser.add_argument('--key', default=os.environ.get('MAG_KEY', ''))
+    parser.add_argument('--url', default=mag.API_URL)
+    args = parser.parse_args()
+    mag.headers['Ocp-Apim-Subscription-Key'] = args.key
+    recording = record(args.query, args.n, args.mode, args.url)
+    path = save_recording(args.name, recording)
+    print('{0} exchanges, {1} nodes -> {2}'.format(
+        len(recording['exchanges']), recording['nodes'], path))
@@ -0,0 +1,137 @@
+# local stand-in for the academic api, answers interpret and evaluate with
+# synthetic papers so benchmarks run without network or subscription key,
+# or replays a recording made with record.py
+#
+#   python benchmarks/stub.py [--replay name]
+#
+# prints the url of the stub and serves until it is killed
+import argparse, http.server, json, random, re, threading, urllib.parse
+
+from fixtures import load_recording, synthetic_paper
+
+# papers cite ids below ID_SPACE, search results start above it
+ID_SPACE = 50000
+
+
+def paper(id, n_refs=30):
+    return synthetic_paper(id, random.Random(id), n_refs, ID_SPACE)
+
+
+def chunk_ids(expr):
+    # ids of an Or(Id=...) reference lookup, None for a search expression
+    if not expr.startswith('Or('):
+        return None
+    return [int(id) for id in re.findall(r'Id=(\d+)', expr)]
+
+
+def answer(endpoint, params):
+    if endpoint == 'interpret':
+        return {'interpretations': [{'rules': [{'output': {
+            'type': 'query',
+            'value': "Composite(F.FN=='{0}')".format(params['query'])}}]}]}
+    expr = params['expr']
+    count, offset = int(params['count']), int(params.get('offset', 0))
+    ids = chunk_ids(expr)
+    if ids is None:
+        ids = range(ID_SPACE + offset, ID_SPACE + offset + count)
+    return {'expr': expr, 'entities': [paper(id) for id in ids][:count]}
+
+
+class Replay:
+    # answers from a recording: interpret by query, searches by expression
+    # and offset, reference lookups by id from all recorded entities, so a
+    # replay does not depend on how the ids were chunked when recording
+    def __init__(self, recording):
+        self.interpretations = {}
+        self.results = {}
+        self.entities = {}
+        for exchange in recording['exchanges']:
+            params, data = exchange['params'], exchange['answer'] or {}
+            if exchange['endpoint'] == 'interpret':
+                self.interpretations[params['query']] = data
+                continue
+            entities = data.get('entities', [])
+            self.entities.update((e['Id'], e) for e in entities)
+            if chunk_ids(params['expr']) is None:
+                found = self.results.setdefault(params['expr'], {})
+                offset = int(params.get('offset', 0))
+                found.update(
+                    (offset + i, e) for i, e in enumerate(entities))
+
+    def answer(self, endpoint, params):
+        if endpoint == 'interpret':
+            return self.interpretations.get(
+                params['query'], {'interpretations': []})
+        expr = params['expr']
+        count, offset = int(params['count']), int(params.get('offset', 0))
+        ids = chunk_ids(expr)
+        if ids is None:
+            found = self.results.get(expr, {})
+            entities = [found[i] for i in range(offset, offset + count)
+                        if i in found]
+        else:
+            entities = [self.entities[id] for id in ids if id in self.entities]
+        return {'expr': expr, 'entities': entities[:count]}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def answer(self, endpoint, params):
+        return answer(endpoint, params)
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        params = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode()))
+        body = json.dumps(self.answer(
+            self.path.rstrip('/').rsplit('/', 1)[-1], params)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def replay_handler(name):
+    # Handler answering from fixtures/<name>.recording.json
+    replay = Replay(load_recording(name))
+
+    class ReplayHandler(Handler):
+        def answer(self, endpoint, params):
+            return replay.answer(endpoint, params)
+    return ReplayHandler
+
+
+def start(handler=Handler):
+    # (server, url) of the stub on a free port
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{0}/academic/v1.0'.format(
+        server.server_port)
+
+
+def point_at(url):
+    # the blocking and the async api client of this process use url
+    from shared_code import aio, mag
+    mag.set_client(mag.AcademicClient(url))
+    aio.set_client(aio.AsyncAcademicClient(url))
+
+
+def serve(handler=Handler):
+    # starts the stub on a free port and points the api clients at it
+    server, url = start(handler)
+    point_at(url)
+    return server, url
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replay', metavar='NAME',
+                        help='answer from fixtures/NAME.recording.json')
+    args = parser.parse_args()
+    server, url = start(replay_handler(args.replay) if args.replay else Handler)
+    print(url, flush=True)
+    threading.Event().wait()
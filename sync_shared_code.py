@@ -0,0 +1,54 @@
+# the function app and the webapp are deployed on their own (zip deploy,
+# app service), so each ships a copy of shared_code; azure_function holds
+# the original, run this after changing it:
+#
+#   python sync_shared_code.py          # copy it to azure_webapp
+#   python sync_shared_code.py --check  # exit status 1 if they differ
+import argparse, filecmp, os, shutil, sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(ROOT, 'azure_function', 'shared_code')
+COPIES = [os.path.join(ROOT, 'azure_webapp', 'shared_code')]
+IGNORE = ('__pycache__', '*.pyc')
+
+
+def differences(source, copy):
+    # relative paths that are missing, extra or changed in copy
+    if not os.path.isdir(copy) or os.path.islink(copy):
+        return ['.']
+    found = []
+    compared = filecmp.dircmp(source, copy, ignore=['__pycache__'])
+    found.extend(compared.left_only + compared.right_only)
+    found.extend(compared.diff_files + compared.funny_files)
+    for name in compared.common_dirs:
+        found.extend(os.path.join(name, path) for path in differences(
+            os.path.join(source, name), os.path.join(copy, name)))
+    # dircmp compares size and times first, check the contents too
+    _, mismatch, errors = filecmp.cmpfiles(
+        source, copy, compared.same_files, shallow=False)
+    return sorted(set(found + mismatch + errors))
+
+
+def sync(copy):
+    if os.path.islink(copy) or os.path.isfile(copy):
+        os.remove(copy)
+    elif os.path.isdir(copy):
+        shutil.rmtree(copy)
+    shutil.copytree(SOURCE, copy, ignore=shutil.ignore_patterns(*IGNORE))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--check', action='store_true')
+    args = parser.parse_args()
+    stale = False
+    for copy in COPIES:
+        found = differences(SOURCE, copy)
+        if found and args.check:
+            print('{0} differs from {1}: {2}'.format(
+                os.path.relpath(copy, ROOT), os.path.relpath(SOURCE, ROOT),
+                ', '.join(found)))
+            stale = True
+        elif found:
+            sync(copy)
+    sys.exit(1 if stale else 0)
@@ -0,0 +1,109 @@
+import http.server, json, os, re, sys, threading, urllib.parse
+
+import pytest
+
+# make shared_code and the functions importable like on azure
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    '..', 'azure_function'))
+
+
+def paper(id, refs=(), authors=(), year=2000, cc=1):
+    # an evaluate entity with the attributes of mag.ATTRIBUTES
+    return {
+        'Id': id, 'DN': 'paper {0}'.format(id), 'Y': year, 'CC': cc,
+        'J': {'JN': 'journal'}, 'DOI': '10.0/{0}'.format(id),
+        'AA': [{'AuId': a, 'DAuN': 'author {0}'.format(a), 'DAfN': ''}
+               for a in authors],
+        'RId': list(refs)}
+
+
+class FakeApi:
+    # stands in for mag.AcademicClient: interpret answers with one search
+    # expression, evaluate with the primaries for it and with the known
+    # papers for Or(Id=...) lookups; fail=True refuses every request
+    def __init__(self, primaries, references=()):
+        self.primaries = primaries
+        self.papers = dict((p['Id'], p) for p in list(references) + primaries)
+        self.fail = False
+        self.calls = []
+
+    def answer(self, endpoint, params):
+        if endpoint == 'interpret':
+            return {'interpretations': [{'rules': [{'output': {
+                'type': 'query', 'value': "Composite(F.FN=='x')"}}]}]}
+        count, offset = int(params['count']), int(params.get('offset', 0))
+        if params['expr'].startswith('Or('):
+            ids = [int(id) for id in re.findall(r'Id=(\d+)', params['expr'])]
+            found = [self.papers[id] for id in ids if id in self.papers]
+        else:
+            found = self.primaries[offset:offset + count]
+        return {'expr': params['expr'], 'entities': found}
+
+    def post(self, endpoint, params, timeout=None):
+        self.calls.append((endpoint, dict(params)))
+        if self.fail:
+            raise ConnectionRefusedError(111, 'Connection refused')
+        return json.dumps(self.answer(endpoint, params)).encode()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    # FakeApi with five primaries citing five references, behind empty
+    # api caches and entity store
+    from shared_code import mag, store
+    from shared_code.cache import LRUCache, TieredCache
+
+    monkeypatch.setattr(mag, 'cache', TieredCache(LRUCache()))
+    store.set_store(store.EntityStore(str(tmp_path / 'store.sqlite')))
+    fake = FakeApi(
+        [paper(i, refs=[10 + i, 10 + (i + 1) % 5], authors=[100 + i, 100])
+         for i in range(1, 6)],
+        [paper(10 + i, authors=[200 + i]) for i in range(5)])
+    mag.set_client(fake)
+    yield fake
+    mag.set_client(None)
+    store.set_store(None)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # answers from the FakeApi of the server, a failing one drops the
+    # connection
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        api = self.server.api
+        length = int(self.headers['Content-Length'])
+        params = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode()))
+        endpoint = self.path.rsplit('/', 1)[-1]
+        api.calls.append((endpoint, params))
+        if api.fail:
+            self.close_connection = True
+            return
+        body = json.dumps(api.answer(endpoint, params)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_server(api):
+    # the api of the api fixture over http, the async client points at it
+    from shared_code import aio
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.api = api
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{0}/academic/v1.0'.format(server.server_port)
+    aio.set_client(aio.AsyncAcademicClient(url, retries=0))
+    yield server
+    aio.set_client(None)
+    server.shutdown()
+    server.server_close()
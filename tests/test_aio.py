@@ -0,0 +1,244 @@
+import asyncio, json, threading
+
+import azure.functions as func
+import pytest
+
+import http_request
+from shared_code import aio, mag
+from shared_code.cache import (
+    DiskCache, Inflight, LRUCache, PageCache, TieredCache)
+
+
+class Script:
+    # a server on the test loop answering each request with the next of
+    # responses (raw bytes, None drops the connection instead), counting
+    # connections and requests
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.connections = 0
+        self.requests = []
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = int([
+                line.split(b':')[1] for line in head.split(b'\r\n')
+                if line.lower().startswith(b'content-length')][0])
+            self.requests.append(await reader.readexactly(length))
+            response = self.responses.pop(0)
+            if response is None:
+                writer.close()
+                return
+            writer.write(response)
+            await writer.drain()
+            head = response.split(b'\r\n\r\n')[0].lower()
+            if b'connection: close' in head or not (
+                    b'content-length' in head or b'chunked' in head):
+                writer.close()
+                return
+
+    async def start(self):
+        server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        return server, 'http://127.0.0.1:{0}/academic/v1.0'.format(port)
+
+
+def ok(body, *headers):
+    lines = [b'HTTP/1.1 200 OK',
+             b'Content-Length: ' + str(len(body)).encode()] + list(headers)
+    return b'\r\n'.join(lines) + b'\r\n\r\n' + body
+
+
+def run(responses, requests, **kwargs):
+    # (answers, script) of posting requests one after the other
+    script = Script(responses)
+
+    async def main():
+        server, url = await script.start()
+        client = aio.AsyncAcademicClient(url, **kwargs)
+        try:
+            return [await client.post('evaluate', {'expr': expr})
+                    for expr in requests]
+        finally:
+            client.close()
+            server.close()
+    return asyncio.run(main()), script
+
+
+def test_keep_alive():
+    answers, script = run([ok(b'a'), ok(b'b')], ['1', '2'])
+    assert answers == [b'a', b'b']
+    assert script.connections == 1
+
+
+def test_connection_close_is_honoured():
+    answers, script = run(
+        [ok(b'a', b'Connection: close'), ok(b'b')], ['1', '2'])
+    assert answers == [b'a', b'b']
+    assert script.connections == 2
+
+
+def test_stale_connection_is_reopened_once():
+    # the server drops the kept connection, the request is sent again
+    answers, script = run([ok(b'a'), None, ok(b'b')], ['1', '2'])
+    assert answers == [b'a', b'b']
+    assert script.connections == 2
+
+
+def test_fresh_connection_failing_raises():
+    with pytest.raises(ConnectionError):
+        run([None], ['1'])
+
+
+def test_chunked_body():
+    chunked = (b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+               b'4\r\nabcd\r\n3;ext=1\r\nefg\r\n0\r\nX-Trailer: 1\r\n\r\n')
+    answers, script = run([chunked, ok(b'next')], ['1', '2'])
+    assert answers == [b'abcdefg', b'next']
+    assert script.connections == 1
+
+
+def test_body_until_close():
+    answers, _ = run([b'HTTP/1.1 200 OK\r\n\r\nall of it', ok(b'b')],
+                     ['1', '2'])
+    assert answers == [b'all of it', b'b']
+
+
+def test_retry_after():
+    too_many = b'HTTP/1.1 429 Too Many\r\nRetry-After: 0\r\n' \
+        b'Content-Length: 0\r\n\r\n'
+    answers, script = run([too_many, ok(b'a')], ['1'], retries=1)
+    assert answers == [b'a']
+    assert len(script.requests) == 2
+
+
+def test_fetch_papers_uses_the_store(api_server):
+    api = api_server.api
+    found = asyncio.run(aio.fetch_papers([10, 11, 99], chunk_size=2))
+    assert sorted(e['Id'] for e in found['entities']) == [10, 11]
+    calls = len(api.calls)
+    again = asyncio.run(aio.fetch_papers([10, 11, 99]))
+    assert again == found
+    assert len(api.calls) == calls
+
+
+def test_evaluate_pages(api_server):
+    async def pages(n):
+        return [[e['Id'] for e in page]
+                async for page in aio.evaluate_pages('x', n, page_size=2)]
+    assert asyncio.run(pages(5)) == [[1, 2], [3, 4], [5]]
+    # a short page is the last one
+    assert asyncio.run(pages(8)) == [[1, 2], [3, 4], [5]]
+
+
+def test_failed_search_raises(api_server):
+    api_server.api.fail = True
+    with pytest.raises(mag.UpstreamError):
+        asyncio.run(aio.AsyncAcademicApi().search('x', 5))
+
+
+def test_disk_cache_is_read_on_a_thread(api_server, monkeypatch, tmp_path):
+    cache = TieredCache(LRUCache(), DiskCache(str(tmp_path / 'mag.sqlite')))
+    monkeypatch.setattr(mag, 'cache', cache)
+    threads = []
+    get = cache.get
+
+    def recorded(key):
+        threads.append(threading.current_thread())
+        return get(key)
+    monkeypatch.setattr(cache, 'get', recorded)
+    answer = asyncio.run(aio.interpret('x'))
+    assert answer == json.loads(json.dumps(api_server.api.answer(
+        'interpret', {})))
+    assert threads and threading.main_thread() not in threads
+    assert cache.disk.get(json.dumps(['interpret', 'x'])) == answer
+
+
+def test_inflight_shares_one_task():
+    inflight = Inflight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def main():
+        first = await asyncio.gather(
+            inflight.run('k', compute), inflight.run('k', compute))
+        # finished tasks are forgotten
+        return first, await inflight.run('k', compute), inflight._tasks
+    assert asyncio.run(main()) == ([1, 1], 2, {})
+
+
+def test_inflight_timeout_leaves_the_task_running():
+    inflight = Inflight()
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return 'done'
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await inflight.run('k', compute, timeout=0.01)
+        return await inflight.run('k', compute)
+    assert asyncio.run(main()) == 'done'
+
+
+def test_concurrent_pages_share_their_fetches(api_server, monkeypatch):
+    monkeypatch.setattr(http_request, 'pages', PageCache())
+    monkeypatch.setattr(http_request, 'inflight', Inflight())
+
+    async def main():
+        return await asyncio.gather(*[http_request.main(func.HttpRequest(
+            'GET', '/api/http_request', params={'query': 'x', 'n': 'A'},
+            body=b'')) for _ in range(3)])
+    bodies = set(r.get_body() for r in asyncio.run(main()))
+    assert len(bodies) == 1
+    assert [endpoint for endpoint, _ in api_server.api.calls].count(
+        'interpret') == 1
+
+
+def test_connect_times_out(monkeypatch):
+    async def never(*args, **kwargs):
+        await asyncio.sleep(10)
+    monkeypatch.setattr(asyncio, 'open_connection', never)
+
+    async def main():
+        client = aio.AsyncAcademicClient(
+            'http://127.0.0.1:9/academic/v1.0', timeout=0.05, retries=0)
+        with pytest.raises(asyncio.TimeoutError):
+            await client.post('evaluate', {})
+    asyncio.run(asyncio.wait_for(main(), 5))
+
+
+def test_page_cache_and_normalize_run_off_the_loop(
+        api_server, monkeypatch, tmp_path):
+    from shared_code import papers
+    pages = PageCache(disk=DiskCache(str(tmp_path / 'pages.sqlite')))
+    monkeypatch.setattr(http_request, 'pages', pages)
+    monkeypatch.setattr(http_request, 'inflight', Inflight())
+    threads = []
+
+    def recorded(func):
+        def wrapper(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return func(*args, **kwargs)
+        return wrapper
+    for name in ('get', 'get_or_refresh', 'put'):
+        monkeypatch.setattr(pages, name, recorded(getattr(pages, name)))
+    monkeypatch.setattr(aio, 'normalize', recorded(papers.normalize))
+
+    async def main():
+        response = await http_request.main(func.HttpRequest(
+            'GET', '/api/http_request', params={'query': 'x', 'n': '5'},
+            body=b''))
+        # the references normalize their papers
+        await asyncio.gather(*http_request.inflight._tasks.values())
+        return response
+    assert asyncio.run(main()).status_code == 200
+    # get, get_or_refresh and put of the primaries, the references
+    # normalized and their full page put
+    assert len(threads) == 5
+    assert threading.main_thread() not in threads
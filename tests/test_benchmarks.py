@@ -0,0 +1,52 @@
+import json, os, sys
+
+import pytest
+
+from shared_code import graph, mag
+
+# the benchmark helpers import like in benchmarks/
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+import fixtures, stub
+
+
+class ReplayClient:
+    # mag.AcademicClient answering from a stub.Replay
+    def __init__(self, replay):
+        self.replay = replay
+
+    def post(self, endpoint, params, timeout=None):
+        return json.dumps(self.replay.answer(endpoint, params)).encode()
+
+    def close(self):
+        pass
+
+
+def test_recorded_payloads():
+    primaries, references = fixtures.load_payloads('stub5')
+    recording = fixtures.load_recording('stub5')
+    assert len(primaries['entities']) == recording['n']
+    rids = set(rid for p in primaries['entities'] for rid in p['RId'])
+    assert set(e['Id'] for e in references['entities']) <= rids
+
+
+def test_replay_rebuilds_the_recorded_graph(api):
+    recording = fixtures.load_recording('stub5')
+    mag.set_client(ReplayClient(stub.Replay(recording)))
+    G, expr = graph.prepare_data(
+        recording['query'], recording['n'], backend=mag.AcademicApi())
+    assert expr == recording['expr']
+    assert len(G) == recording['nodes']
+
+
+def test_replay_of_unknown_query_finds_nothing(api):
+    mag.set_client(ReplayClient(stub.Replay(
+        fixtures.load_recording('stub5'))))
+    assert graph.prepare_data('other', 5, backend=mag.AcademicApi()) == (0, 0)
+
+
+@pytest.mark.parametrize('n', [10, 300])
+def test_synthetic_payload_size(n):
+    primaries, references = fixtures.synthetic_payloads(n)
+    assert len(primaries['entities']) == n
+    assert references['entities']
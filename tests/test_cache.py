@@ -0,0 +1,198 @@
+import threading, time
+
+from shared_code import cache, mag
+from shared_code.cache import (
+    MISSING, DiskCache, Jobs, LRUCache, PageCache, TieredCache)
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(maxsize=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.get('a') == 1
+    lru.set('c', 3)
+    assert lru.get('b') is MISSING
+    assert (lru.get('a'), lru.get('c')) == (1, 3)
+    assert (lru.hits, lru.misses) == (3, 1)
+
+
+def test_lru_limits_bytes():
+    lru = LRUCache(max_bytes=10)
+    lru.set('a', 'a', size=6)
+    lru.set('b', 'b', size=6)
+    assert lru.get('a') is MISSING
+    assert lru.nbytes == 6
+    # too large to keep at all
+    lru.set('c', 'c', size=11)
+    assert lru.get('c') is MISSING
+    assert lru.get('b') == 'b'
+
+
+def test_lru_expires():
+    lru = LRUCache(ttl=0.05)
+    lru.set('a', None)
+    lru.set('b', 2, ttl=10)
+    assert lru.get('a') is None
+    time.sleep(0.1)
+    assert lru.get('a') is MISSING
+    assert lru.get('b') == 2
+    assert len(lru) == 1
+
+
+def test_disk_cache(tmp_path):
+    disk = DiskCache(str(tmp_path / 'c.sqlite'))
+    disk.set('a', {'x': [1, 2]})
+    disk.set('old', 1, ttl=-1)
+    assert DiskCache(str(tmp_path / 'c.sqlite')).get('a') == {'x': [1, 2]}
+    assert disk.get('old') is MISSING
+    disk.prune()
+    assert disk._db.execute('SELECT count(*) FROM cache').fetchone() == (1,)
+
+
+
+def test_disk_cache_prunes_on_open_and_every_n_writes(tmp_path):
+    def count(disk):
+        return disk._db.execute('SELECT count(*) FROM cache').fetchone()[0]
+
+    disk = DiskCache(str(tmp_path / 'c.sqlite'), prune_every=2)
+    disk.set('old', 1, ttl=-1)
+    assert count(DiskCache(str(tmp_path / 'c.sqlite'))) == 0
+    disk.set('a', 1)
+    disk.set('old', 1, ttl=-1)
+    assert count(disk) == 2
+    disk.set('b', 1)
+    assert count(disk) == 2
+
+def test_tiered_cache_promotes_disk_hits(tmp_path):
+    disk = DiskCache(str(tmp_path / 'c.sqlite'))
+    TieredCache(LRUCache(), disk).set('a', [1])
+    tiered = TieredCache(LRUCache(), disk)
+    assert tiered.get('a') == [1]
+    assert tiered.get('a') == [1]
+    assert tiered.stats()['disk_hits'] == 1
+    assert tiered.stats()['memory_hits'] == 1
+
+
+def test_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv('TEST_CACHE_SIZE', '3')
+    monkeypatch.setenv('TEST_CACHE_TTL', '5')
+    monkeypatch.setenv('TEST_CACHE_DIR', str(tmp_path / 'dir'))
+    tiered = cache.from_env('TEST_CACHE')
+    assert (tiered.memory.maxsize, tiered.memory.ttl) == (3, 5)
+    assert tiered.disk.path == str(tmp_path / 'dir' / 'test_cache.sqlite')
+
+
+def test_api_answers_are_cached_by_normalized_query(api):
+    assert mag.interpret('Some  Query') == mag.interpret(' some query ')
+    assert len(api.calls) == 1
+    assert mag.evaluate('expr', n=5) == mag.evaluate('expr', n=5)
+    assert len(api.calls) == 2
+
+
+def test_failed_api_answers_are_not_cached(api):
+    api.fail = True
+    assert mag.interpret('x') is None
+    api.fail = False
+    assert mag.interpret('x') is not None
+    assert len(api.calls) == 2
+
+
+def test_page_cache_renders_once(tmp_path):
+    pages = PageCache(disk=DiskCache(str(tmp_path / 'pages.sqlite')))
+    calls = []
+
+    def render():
+        calls.append(1)
+        return 'body'
+    body, etag = pages.get_or_render('k', render)
+    assert (body, len(calls)) == ('body', 1)
+    assert pages.get_or_render('k', render) == (body, etag)
+    assert len(calls) == 1
+    # another process reads the disk tier
+    other = PageCache(disk=DiskCache(str(tmp_path / 'pages.sqlite')))
+    assert other.get('k') == (body, etag)
+
+
+def test_binary_bodies(tmp_path):
+    pages = PageCache(disk=DiskCache(str(tmp_path / 'pages.sqlite')))
+    pages.put('k', b'\x00\x01')
+    other = PageCache(disk=DiskCache(str(tmp_path / 'pages.sqlite')))
+    assert other.get('k')[0] == b'\x00\x01'
+
+
+def test_etag_follows_the_body():
+    pages = PageCache()
+    _, first = pages.put('a', 'one')
+    assert pages.put('b', 'one')[1] == first
+    assert pages.put('a', 'two')[1] != first
+
+
+def test_stale_entry_is_served_while_refreshing():
+    pages = PageCache(ttl=0.05)
+    pages.put('k', 'old')
+    time.sleep(0.1)
+    started, release = threading.Event(), threading.Event()
+
+    def render():
+        started.set()
+        release.wait(5)
+        return 'new'
+    assert pages.get_or_render('k', render)[0] == 'old'
+    assert started.wait(5)
+    # one refresh at a time
+    assert pages.get_or_render('k', render)[0] == 'old'
+    release.set()
+    for _ in range(100):
+        if pages.refreshes:
+            break
+        time.sleep(0.01)
+    assert pages.refreshes == 1
+    assert pages.get('k')[0] == 'new'
+
+
+def test_lookups_count_once():
+    pages = PageCache()
+    assert pages.get('k') is MISSING
+    assert pages.get_or_refresh('k', lambda: 'body') is MISSING
+    pages.put('k', 'body')
+    assert pages.get('k')[0] == 'body'
+    assert pages.get_or_render('k', lambda: 'body')[0] == 'body'
+    stats = pages.stats()
+    assert (stats['page_hits'], stats['page_misses']) == (1, 1)
+
+
+def test_jobs_run_once_per_key():
+    jobs = Jobs()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return 'done'
+    first = jobs.submit('k', compute)
+    assert jobs.submit('k', compute) is first
+    assert jobs.result('k', timeout=0.01) is MISSING
+    release.set()
+    assert jobs.result('k', timeout=5) == 'done'
+    # the result is kept, nothing is started again
+    assert jobs.submit('k', compute) is None
+    assert jobs.result('k', compute) == 'done'
+    assert len(calls) == 1
+
+
+def test_jobs_start_on_result():
+    jobs = Jobs()
+    assert jobs.result('k') is MISSING
+    assert jobs.result('k', lambda: 'value', timeout=5) == 'value'
+
+
+def test_failed_jobs_are_not_kept():
+    jobs = Jobs()
+
+    def fail():
+        raise ValueError('failed')
+    future = jobs.submit('k', fail)
+    assert isinstance(future.exception(timeout=5), ValueError)
+    assert jobs.result('k') is MISSING
+    assert jobs.submit('k', lambda: 'value').result(timeout=5) == 'value'
@@ -0,0 +1,71 @@
+import numpy as np
+
+from conftest import paper
+from shared_code import coauthors, graph
+from shared_code.papers import normalize
+
+
+def papers():
+    # author 7 on every paper, 8 twice (once listed twice), 9 once
+    entities = [paper(1, authors=[7, 8]), paper(2, authors=[9, 7]),
+                paper(3, authors=[7, 8, 8])]
+    return normalize(entities)
+
+
+def test_incidence():
+    matrix, auids, authors = coauthors.incidence(papers())
+    assert auids.tolist() == [7, 8, 9]
+    assert matrix.toarray().tolist() == [[1, 1, 0], [1, 0, 1], [1, 2, 0]]
+    assert [a[1] for a in authors] == ['author 7', 'author 8', 'author 9']
+    assert coauthors.paper_counts(matrix).tolist() == [3, 3, 1]
+
+
+def test_second_max_and_buckets():
+    assert coauthors.second_max(np.array([5, 9, 2])) == 5
+    assert coauthors.second_max(np.array([9, 9, 2])) == 9
+    assert coauthors.second_max(np.array([4])) == 4
+    assert coauthors.buckets(np.array([0, 5, 10, 20]), 10).tolist() == [
+        8, 4, 0, 0]
+
+
+def test_collaboration():
+    matrix, _, _ = coauthors.incidence(papers())
+    weights = coauthors.collaboration(matrix)
+    # papers written together, a double listing counts once
+    assert weights.toarray().tolist() == [[0, 2, 1], [2, 0, 0], [1, 0, 0]]
+
+
+def test_top_collaborators_and_pairs():
+    matrix, _, _ = coauthors.incidence(papers())
+    top = coauthors.top_collaborators(coauthors.collaboration(matrix), 1)
+    assert top.toarray().tolist() == [[0, 2, 0], [2, 0, 0], [1, 0, 0]]
+    # 9 keeps its only edge, kept once although only one end ranks it
+    edges, weights = coauthors.pairs(top)
+    assert edges.tolist() == [[0, 1], [0, 2]]
+    assert weights.tolist() == [2, 1]
+
+
+def test_authors_graph():
+    built = graph.authors_graph(papers())
+    assert built.ids.tolist() == [1, 2, 3, 7, 8, 9]
+    assert built.columns['type'] == ['Publication'] * 3 + ['Author'] * 3
+    assert built.columns['size'].tolist() == [15, 15, 15, 20, 20, 10]
+    assert built.degree().tolist() == [2, 2, 2, 3, 2, 1]
+
+
+def test_collaboration_graph():
+    built = graph.collaboration_graph(papers(), min_weight=1, top_k=10)
+    assert built.ids.tolist() == [7, 8, 9]
+    assert built.columns['type'] == ['Author'] * 3
+    assert built.edges.tolist() == [[0, 1], [0, 2]]
+    assert built.weights.tolist() == [2, 1]
+    assert built.columns['weight'].tolist() == [3, 3, 1]
+
+
+def test_collaboration_thresholds():
+    # 9 wrote one paper with 7 only, the most listed authors stay unlinked
+    built = graph.collaboration_graph(papers(), min_weight=2)
+    assert built.ids.tolist() == [7, 8]
+    built = graph.collaboration_graph(papers(), min_weight=3)
+    assert built.ids.tolist() == [7, 8]
+    assert built.number_of_edges() == 0
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from shared_code.csr import CSRGraph, GraphBuilder
+
+
+def graph(edges, weights=None, n=4):
+    return CSRGraph(
+        [10 * (i + 1) for i in range(n)],
+        {'type': list('abcd'[:n]), 'weight': np.arange(n)}, edges, weights)
+
+
+def test_edges_are_undirected_and_unique():
+    g = graph([(1, 0), (0, 1), (2, 2), (2, 3)], weights=[1, 2, 5, 3])
+    assert g.edges.tolist() == [[0, 1], [2, 3]]
+    # duplicates add up, self loops go
+    assert g.weights.tolist() == [3, 3]
+    assert g.degree().tolist() == [1, 1, 1, 1]
+    assert g.neighbors(0).tolist() == [1]
+    assert (len(g), g.number_of_edges()) == (4, 2)
+
+
+def test_subgraph():
+    g = graph([(0, 1), (1, 2), (2, 3)], weights=[1, 2, 3])
+    sub = g.subgraph([1, 2, 3])
+    assert sub.ids.tolist() == [20, 30, 40]
+    assert sub.columns['type'] == ['b', 'c', 'd']
+    assert sub.columns['weight'].tolist() == [1, 2, 3]
+    assert sub.edges.tolist() == [[0, 1], [1, 2]]
+    assert sub.weights.tolist() == [2, 3]
+    assert g.subgraph(np.array([True, True, False, False])).edges.tolist() \
+        == [[0, 1]]
+
+
+def test_edge_subgraph():
+    g = graph([(0, 1), (1, 2)])
+    sub = g.edge_subgraph(np.array([False, True]))
+    assert sub.ids.tolist() == g.ids.tolist()
+    assert sub.degree().tolist() == [0, 1, 1, 0]
+
+
+def test_fingerprint_ignores_order():
+    a = CSRGraph([1, 2, 3], {}, [(0, 1), (1, 2)])
+    b = CSRGraph([3, 2, 1], {}, [(1, 2), (0, 1)])
+    assert a.fingerprint() == b.fingerprint()
+    assert a.fingerprint() != a.fingerprint('seed')
+    assert a.fingerprint() != CSRGraph([1, 2, 3], {}, [(0, 2)]).fingerprint()
+
+
+def test_builder_skips_unknown_ends():
+    builder = GraphBuilder()
+    for id in (5, 6, 5):
+        builder.add_node(
+            id, type='t', color='', title=str(id), authors='', journal='',
+            year=2000, DOI='', size=id, weight=1)
+    builder.add_edges_from([(5, 6), (6, 7)])
+    g = builder.build()
+    assert g.ids.tolist() == [5, 6]
+    assert g.columns['size'].dtype == np.int64
+    assert g.edges.tolist() == [[0, 1]]
+
+
+def test_to_networkx():
+    nx = pytest.importorskip('networkx')
+    G = graph([(0, 1)], weights=[2]).to_networkx()
+    assert isinstance(G, nx.Graph)
+    assert G.nodes[20] == {'type': 'b', 'weight': 1}
+    assert G.edges[10, 20]['weight'] == 2
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from shared_code import data
+from shared_code.params import mode, parse_params
+
+
+@pytest.mark.parametrize('params, expected', [
+    ({}, ('metasurface', 20)),
+    ({'n': '500', 'query': ' a  b '}, ('a b', 100)),
+    ({'n': '0'}, ('metasurface', 1)),
+    ({'n': 'A'}, ('federico capasso', 'A')),
+    ({'n': 'C', 'query': 'x'}, ('x', 'C')),
+    ({'n': 'other'}, ('federico capasso', 'A'))])
+def test_parse_params(params, expected):
+    assert parse_params(params) == expected
+
+
+def test_modes():
+    assert [mode(n) for n in (5, 'A', 'C')] == [
+        'publications', 'authors', 'collaboration']
+
+
+def ids(graph):
+    return sorted(graph.ids.tolist())
+
+
+@pytest.mark.parametrize('n', [5, 'A', 'C'])
+def test_load_graph_async_matches_load_graph(api_server, n):
+    graph, expr = data.load_graph('x', n)
+    assert expr
+    assert ids(asyncio.run(data.load_graph_async('x', n))[0]) == ids(graph)
+
+
+def test_load_graph_modes(api):
+    assert ids(data.load_graph('x', 5)[0]) == list(range(1, 6)) + list(
+        range(10, 15))
+    authors = ids(data.load_graph('x', 'A')[0])
+    assert authors == list(range(1, 6)) + list(range(100, 106))
+    assert ids(data.load_graph('x', 'C')[0]) == list(range(100, 106))
+
+
+def test_nothing_found(api):
+    api.primaries = []
+    for n in (5, 'A', 'C'):
+        assert data.load_graph('x', n)[0] is None
+
+
+def test_collaboration_without_authors(api_server):
+    # papers listing no authors leave an empty collaboration graph
+    for p in api_server.api.primaries:
+        p['AA'] = []
+    assert data.load_graph('x', 'C')[0] is None
+    assert asyncio.run(data.load_graph_async('x', 'C'))[0] is None
@@ -0,0 +1,85 @@
+from conftest import paper
+from shared_code import graph
+from shared_code.papers import normalize
+
+
+def test_citation_edges():
+    # primaries 1, 2 cite each other and references 10, 11; reference 10
+    # cites 11 and a primary, which is not drawn from a reference
+    papers = normalize([paper(1, refs=[2, 10, 99]), paper(2, refs=[11])])
+    refs = normalize([paper(10, refs=[11, 1]), paper(11)])
+    assert sorted(graph.citation_edges(papers, refs)) == [
+        (1, 2), (1, 10), (2, 11), (10, 11)]
+
+
+def test_build_graph():
+    papers = normalize([paper(1, refs=[10], cc=4), paper(2, refs=[10])])
+    refs = normalize([paper(10)])
+    built = graph.build_graph(papers, refs)
+    assert built.ids.tolist() == [1, 2, 10]
+    assert built.columns['type'] == [graph.PRIMARY] * 2 + ['Reference']
+    assert built.columns['weight'].tolist() == [4, 1, 1]
+    assert built.edges.tolist() == [[0, 2], [1, 2]]
+
+
+class Backend:
+    # fetch() of known papers, recording the requested ids
+    def __init__(self, entities):
+        self.papers = dict((e['Id'], e) for e in entities)
+        self.requests = []
+
+    def fetch(self, ids):
+        self.requests.append(sorted(ids))
+        return [self.papers[id] for id in ids if id in self.papers]
+
+
+def test_hops_request_each_id_once():
+    # 1 cites 10 and 11, both cite 20 and 1, 20 cites 30
+    backend = Backend([
+        paper(10, refs=[20, 1]), paper(11, refs=[20, 10]),
+        paper(20, refs=[30]), paper(30)])
+    levels = graph.expand(backend, normalize([paper(1, refs=[10, 11])]),
+                          depth=3)
+    assert backend.requests == [[10, 11], [20], [30]]
+    assert [[p.Id for p in level] for level in levels] == [
+        [10, 11], [20], [30]]
+    built = graph.build_graph(normalize([paper(1, refs=[10, 11])]), *levels)
+    assert built.columns['type'][-1] == 'Reference, 3 hops'
+
+
+def test_hop_budget_keeps_the_most_cited_ids():
+    # 20 is cited by both 10 and 11, the others once
+    papers = normalize([paper(1, refs=[10, 11])])
+    backend = Backend([
+        paper(10, refs=[20, 21], cc=1), paper(11, refs=[20, 22], cc=9)])
+    graph.expand(backend, papers, depth=2, max_nodes=1)
+    assert backend.requests == [[10], [20]]
+    backend.requests = []
+    graph.expand(backend, papers, depth=2, max_nodes=3)
+    assert backend.requests == [[10, 11], [20, 21, 22]]
+
+
+def test_only_the_most_cited_papers_are_followed():
+    papers = normalize([paper(1, refs=[10, 11])])
+    backend = Backend([
+        paper(10, refs=[20], cc=1), paper(11, refs=[21], cc=9)])
+    graph.expand(backend, papers, depth=2, width=1)
+    assert backend.requests == [[10, 11], [21]]
+
+
+def test_node_budget_stops_the_pages():
+    pages_read = []
+
+    def pages():
+        for page in ([paper(1, authors=[7, 8])], [paper(2, authors=[8])],
+                     [paper(3, authors=[9])]):
+            pages_read.append(page)
+            yield page
+    budget = graph.NodeBudget(5, graph.author_nodes)
+    # papers 1, 2 and authors 7, 8 fill 4 of 5, paper 3 and author 9 more
+    found = list(graph.within_budget(pages(), budget))
+    assert [e['Id'] for e in found] == [1, 2, 3]
+    budget = graph.NodeBudget(3, graph.author_nodes)
+    pages_read.clear()
+    assert [e['Id'] for e in graph.within_budget(pages(), budget)] == [1]
+    assert len(pages_read) == 1
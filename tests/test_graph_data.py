@@ -0,0 +1,72 @@
+import gzip, io, json
+
+import azure.functions as func
+import numpy as np
+
+import graph_data
+from shared_code import mag
+from shared_code.cache import MISSING, DiskCache, PageCache
+
+
+def get(query, headers=None, **params):
+    return graph_data.main(func.HttpRequest(
+        'GET', '/api/graph_data', params=dict(params, query=query),
+        headers=headers or {}, body=b''))
+
+
+def test_graph_json(api, monkeypatch):
+    monkeypatch.setattr(graph_data, 'graphs', PageCache())
+    response = get('x', n='5', full='1')
+    assert response.status_code == 200
+    data = json.loads(response.get_body())
+    assert sorted(data['nodes']['id']) == list(range(1, 6)) + list(
+        range(10, 15))
+
+
+def test_failed_api_is_not_cached(api, monkeypatch, tmp_path):
+    graphs = PageCache(disk=DiskCache(str(tmp_path / 'data.sqlite')))
+    monkeypatch.setattr(graph_data, 'graphs', graphs)
+    api.fail = True
+    assert get('x', n='5').status_code == 503
+    assert graphs.get(('x', 5, False, 'json')) is MISSING
+    assert graphs.disk.get(json.dumps(['x', 5, False, 'json'])) is MISSING
+    api.fail = False
+    assert get('x', n='5').status_code == 200
+
+
+def test_nothing_found_is_kept_briefly(api, monkeypatch, tmp_path):
+    graphs = PageCache(
+        disk=DiskCache(str(tmp_path / 'data.sqlite')), empty_ttl=0)
+    monkeypatch.setattr(graph_data, 'graphs', graphs)
+    primaries, api.primaries = api.primaries, []
+    assert get('x', n='5').status_code == 404
+    assert graphs.disk.get(json.dumps(['x', 5, False, 'json'])) is MISSING
+    api.primaries = primaries
+    mag.cache.clear()
+    assert get('x', n='5').status_code == 200
+
+
+def test_npz(api, monkeypatch):
+    monkeypatch.setattr(graph_data, 'graphs', PageCache())
+    response = get('x', n='5', format='npz')
+    assert response.headers['content-type'] == 'application/octet-stream'
+    arrays = np.load(io.BytesIO(response.get_body()))
+    assert len(arrays['id']) == len(arrays['x']) == len(arrays['type'])
+    assert str(arrays['expr']) == "Composite(F.FN=='x')"
+
+
+def test_unknown_format(api):
+    assert get('x', format='xml').status_code == 400
+
+
+def test_gzip_and_etag(api, monkeypatch):
+    monkeypatch.setattr(graph_data, 'graphs', PageCache())
+    plain = get('x', n='5')
+    response = get('x', n='5', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.get_body()) == plain.get_body()
+    etag = response.headers['ETag']
+    assert etag != plain.headers['ETag']
+    response = get('x', n='5', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
@@ -0,0 +1,137 @@
+import asyncio, contextlib, json, threading
+
+import azure.functions as func
+import pytest
+
+import http_request
+from shared_code import metrics
+from shared_code.cache import Inflight, Jobs, PageCache
+
+
+def request(**params):
+    return func.HttpRequest(
+        'GET', '/api/http_request', params=params, body=b'')
+
+
+@pytest.fixture
+def fresh(monkeypatch):
+    # empty page and references caches, the timings of every request
+    monkeypatch.setattr(http_request, 'pages', PageCache())
+    monkeypatch.setattr(http_request, 'references', Jobs())
+    monkeypatch.setattr(http_request, 'inflight', Inflight())
+    seen = []
+    request = metrics.request
+
+    @contextlib.contextmanager
+    def recorded(name, **fields):
+        with request(name, **fields) as timings:
+            seen.append(timings)
+            yield timings
+    monkeypatch.setattr(metrics, 'request', recorded)
+    return seen
+
+
+def test_references_are_timed_apart_from_the_page(api_server, fresh):
+    async def run():
+        response = await http_request.main(
+            request(query='x', n='5', timing='1'))
+        await asyncio.gather(*http_request.inflight._tasks.values())
+        return response
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    assert 'references' not in response.headers['Server-Timing']
+    page, references = fresh
+    assert page.name == 'http_request' and references.name == 'references'
+    assert 'references' not in page.stages
+    assert 'references' in references.stages and 'plot' in references.stages
+
+
+def test_sync_references_are_timed_on_their_own(api, fresh):
+    response = http_request.main_sync(request(query='x', n='5'))
+    assert response.status_code == 200
+    body = http_request.references.result(('x', 5), timeout=30)
+    assert body.startswith('{')
+    assert [t.name for t in fresh] == ['http_request', 'references']
+    assert 'references' in fresh[1].stages
+
+
+def test_failed_api_answers_503(api_server, fresh):
+    api_server.api.fail = True
+    response = asyncio.run(http_request.main(request(query='x', n='A')))
+    assert response.status_code == 503
+    api_server.api.fail = False
+    response = asyncio.run(http_request.main(request(query='x', n='A')))
+    assert response.status_code == 200
+
+
+def test_a_request_counts_one_page_lookup(api_server, fresh):
+    for _ in range(2):
+        asyncio.run(http_request.main(request(query='x', n='A')))
+    http_request.main_sync(request(query='x', n='A'))
+    assert [timings.counts.get('page_cache_misses', 0) for timings in fresh] \
+        == [1, 0, 0]
+    assert [timings.counts.get('page_cache_hits', 0) for timings in fresh] \
+        == [0, 1, 1]
+    stats = http_request.pages.stats()
+    assert (stats['page_hits'], stats['page_misses']) == (2, 1)
+
+
+def test_progressive_page(api, fresh):
+    response = http_request.main_sync(request(query='x', n='5'))
+    primaries = response.get_body().decode()
+    assert 'part=references' in primaries
+    response = http_request.main_sync(
+        request(query='x', n='5', part='references'))
+    assert response.status_code == 200
+    assert json.loads(response.get_body())['nodes']
+    # once the references are in, the full page is served
+    response = http_request.main_sync(request(query='x', n='5'))
+    assert 'part=references' not in response.get_body().decode()
+
+
+def test_pending_references(api, fresh, monkeypatch):
+    release = threading.Event()
+    compute = http_request.compute_references
+    monkeypatch.setattr(http_request, 'POLL_WAIT', 0.01)
+    monkeypatch.setattr(
+        http_request, 'compute_references',
+        lambda query, n: release.wait(5) and compute(query, n))
+    response = http_request.main_sync(
+        request(query='x', n='5', part='references'))
+    assert response.status_code == 202
+    assert response.headers['Retry-After'] == '1'
+    release.set()
+    assert http_request.references.result(('x', 5), timeout=30)
+
+
+def test_progressive_page_nothing_found(api, fresh, caplog):
+    api.primaries = []
+    response = http_request.main_sync(request(query='x', n='5'))
+    assert response.status_code == 404
+    assert not http_request.references._running
+    response = http_request.main_sync(
+        request(query='x', n='5', part='references'))
+    assert response.status_code == 404
+    # kept briefly, the next poll does not search again
+    calls = len(api.calls)
+    response = http_request.main_sync(
+        request(query='x', n='5', part='references'))
+    assert response.status_code == 404
+    assert len(api.calls) == calls
+    assert not [r for r in caplog.records if r.levelname == 'ERROR']
+
+
+def test_progressive_page_nothing_found_async(api_server, fresh, caplog):
+    api_server.api.primaries = []
+
+    async def run():
+        page = await http_request.main(request(query='x', n='5'))
+        started = dict(http_request.inflight._tasks)
+        part = await http_request.main(
+            request(query='x', n='5', part='references'))
+        return page, started, part
+    page, started, part = asyncio.run(run())
+    assert page.status_code == 404
+    assert started == {}
+    assert part.status_code == 404
+    assert not [r for r in caplog.records if r.levelname == 'ERROR']
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from shared_code import layout
+from shared_code.cache import LRUCache, TieredCache
+from shared_code.csr import CSRGraph
+
+
+def ring(n, offset=0):
+    ids = np.arange(n) + offset
+    edges = np.stack([np.arange(n), (np.arange(n) + 1) % n], axis=1)
+    return CSRGraph(ids, {}, edges)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = TieredCache(LRUCache())
+    monkeypatch.setattr(layout, 'cache', cache)
+    return cache
+
+
+def test_force_positions_are_deterministic():
+    graph = ring(300)
+    first = layout.force_positions(len(graph), graph.edges)
+    assert np.array_equal(first, layout.force_positions(
+        len(graph), graph.edges))
+    assert first.shape == (300, 2) and np.isfinite(first).all()
+
+
+def test_time_budget_sets_the_iteration_count():
+    # a budget used up by the first iteration leaves just that one
+    graph = ring(300)
+    assert np.array_equal(
+        layout.force_positions(len(graph), graph.edges, time_budget=1e-9),
+        layout.force_positions(len(graph), graph.edges, iterations=1))
+
+
+def test_force_layout_is_centred_and_scaled():
+    pos = layout.force_layout(ring(50))
+    assert np.allclose(pos.mean(axis=0), 0)
+    assert np.isclose(np.abs(pos).max(), 1)
+
+
+def test_layout_is_cached_by_fingerprint(cache):
+    graph = ring(40)
+    pos = layout.layout(graph, scale=2, center=(1, 1))
+    assert len(cache.memory) == 1
+    assert np.allclose(layout.layout(graph, scale=2, center=(1, 1)), pos)
+    assert cache.memory.hits == 1
+
+
+def test_overlapping_graph_is_warm_started(cache):
+    layout.layout(ring(100))
+    grown = ring(110)
+    pos, overlap = layout.warm_start(grown)
+    assert overlap == pytest.approx(100 / 110)
+    assert pos.shape == (110, 2)
+    assert layout.warm_start(ring(100, offset=1000)) == (None, 0)
+
+
+
+def test_grown_graph_is_warm_started_from_the_smaller_one(cache):
+    layout.layout(ring(20))
+    pos, overlap = layout.warm_start(ring(50))
+    assert overlap == pytest.approx(20 / 50)
+    assert pos.shape == (50, 2)
+    layout.layout(ring(50))
+    assert layout.warm_start(ring(40))[1] == 1
+
+def test_empty_graph():
+    empty = CSRGraph([], {}, np.zeros((0, 2), dtype=np.int64))
+    assert layout.layout(empty).shape == (0, 2)
+    assert layout.rescale(np.zeros((0, 2))).shape == (0, 2)
@@ -0,0 +1,220 @@
+import socketserver, threading, time
+
+import pytest
+
+from shared_code import mag
+
+
+class Script(socketserver.ThreadingTCPServer):
+    # answers each request with the next of responses (raw bytes, None
+    # drops the connection instead), counting connections and requests
+    daemon_threads = True
+
+    def __init__(self, responses):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.responses = list(responses)
+        self.connections = 0
+        self.requests = []
+        threading.Thread(
+            target=self.serve_forever, args=(0.05,), daemon=True).start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/academic/v1.0'.format(
+            self.server_address[1])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        while True:
+            head = b''
+            while not head.endswith(b'\r\n\r\n'):
+                line = self.rfile.readline()
+                if not line:
+                    return
+                head += line
+            length = int([
+                line.split(b':')[1] for line in head.split(b'\r\n')
+                if line.lower().startswith(b'content-length')][0])
+            server.requests.append(self.rfile.read(length))
+            response = server.responses.pop(0)
+            if response is None:
+                return
+            self.wfile.write(response)
+            if b'connection: close' in response.lower():
+                return
+
+
+def ok(body, *headers):
+    lines = [b'HTTP/1.1 200 OK',
+             b'Content-Length: ' + str(len(body)).encode()] + list(headers)
+    return b'\r\n'.join(lines) + b'\r\n\r\n' + body
+
+
+def busy(retry_after):
+    return (b'HTTP/1.1 429 Too Many Requests\r\nContent-Length: 0\r\n'
+            b'Retry-After: ' + retry_after + b'\r\n\r\n')
+
+
+@pytest.fixture
+def script():
+    servers = []
+
+    def start(responses):
+        servers.append(Script(responses))
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def test_keep_alive(script):
+    server = script([ok(b'1'), ok(b'2'), ok(b'3')])
+    client = mag.AcademicClient(server.url, pool_size=1)
+    assert [client.post('evaluate', {'expr': str(i)}) for i in range(3)] \
+        == [b'1', b'2', b'3']
+    assert server.connections == 1
+    assert server.requests[1] == b'expr=1'
+
+
+def test_connection_close_is_honoured(script):
+    server = script([ok(b'1', b'Connection: close'), ok(b'2')])
+    client = mag.AcademicClient(server.url)
+    assert client.post('evaluate', {}) == b'1'
+    assert client.post('evaluate', {}) == b'2'
+    assert server.connections == 2
+
+
+def test_stale_connection_is_reopened_once(script):
+    server = script([ok(b'1'), None, ok(b'2')])
+    client = mag.AcademicClient(server.url, pool_size=1)
+    assert client.post('evaluate', {}) == b'1'
+    assert client.post('evaluate', {}) == b'2'
+    assert server.connections == 2
+
+
+def test_fresh_connection_failing_raises(script):
+    server = script([None])
+    client = mag.AcademicClient(server.url)
+    with pytest.raises(mag.STALE_ERRORS):
+        client.post('evaluate', {})
+    # the slot of the failed request is free again
+    assert client._slots.acquire(blocking=False)
+
+
+def test_retry_after(script):
+    server = script([busy(b'0'), busy(b'0'), ok(b'done')])
+    client = mag.AcademicClient(server.url, retries=2)
+    assert client.post('evaluate', {}) == b'done'
+    assert len(server.requests) == 3
+
+
+def test_retries_run_out(script):
+    server = script([busy(b'0'), busy(b'0')])
+    client = mag.AcademicClient(server.url, retries=1)
+    assert client.post('evaluate', {}) == b''
+    assert len(server.requests) == 2
+
+
+def test_retry_after_value():
+    assert mag._retry_after('1.5', 0) == 1.5
+    assert mag._retry_after('-1', 0) == 0
+    assert mag._retry_after(None, 3) == 8
+    assert mag._retry_after('Wed, 21 Oct 2015 07:28:00 GMT', 1) == 2
+
+
+def test_throttle_spaces_calls():
+    throttle = mag.Throttle(rate=10)
+    delays = [throttle.reserve() for _ in range(3)]
+    assert delays[0] == 0
+    assert delays[1] == pytest.approx(0.1, abs=0.01)
+    assert delays[2] == pytest.approx(0.2, abs=0.01)
+
+
+def test_throttle_pause():
+    throttle = mag.Throttle()
+    assert throttle.reserve() == 0
+    throttle.pause(0.05)
+    started = time.monotonic()
+    throttle.wait()
+    assert time.monotonic() - started >= 0.04
+
+
+def requested_ids(api):
+    return [sorted(int(id) for id in params['expr'][3:-1].replace(
+        'Id=', '').split(',')) for endpoint, params in api.calls
+        if params.get('expr', '').startswith('Or(')]
+
+
+def test_fetch_papers_requests_missing_ids_only(api):
+    found = mag.fetch_papers([10, 11, 99])
+    assert [e['Id'] for e in found['entities']] == [10, 11]
+    found = mag.fetch_papers([11, 12, 99, 11])
+    assert [e['Id'] for e in found['entities']] == [11, 12]
+    # 99 does not exist, the store remembers that too
+    assert requested_ids(api) == [[10, 11, 99], [12]]
+
+
+def test_fetch_papers_refreshes_stale_papers(api):
+    from shared_code import store
+    store.get_store().max_age = -1
+    mag.fetch_papers([10])
+    mag.cache.clear()
+    mag.fetch_papers([10])
+    assert requested_ids(api) == [[10], [10]]
+
+
+def test_fetch_papers_in_concurrent_chunks(api, monkeypatch):
+    # the three chunks are requested at the same time
+    barrier = threading.Barrier(3, timeout=5)
+    post = api.post
+
+    def recorded(endpoint, params, timeout=None):
+        if not barrier.broken:
+            barrier.wait()
+        # the chunk with 12 fails, its papers are left out
+        if 'Id=12' in params['expr']:
+            raise ConnectionResetError(104, 'Connection reset')
+        return post(endpoint, params, timeout)
+    monkeypatch.setattr(api, 'post', recorded)
+    found = mag.fetch_papers(range(10, 15), chunk_size=2, concurrency=3)
+    assert [e['Id'] for e in found['entities']] == [10, 11, 14]
+    assert sorted(requested_ids(api)) == [[10, 11], [14]]
+    # the failed chunk is not remembered as unknown, it is asked again
+    barrier.abort()
+    found = mag.fetch_papers([12, 13], chunk_size=1)
+    assert [e['Id'] for e in found['entities']] == [13]
+    assert requested_ids(api)[-1] == [13]
+
+
+def test_pages():
+    assert mag.pages(5, page_size=2) == [(0, 2), (2, 2), (4, 1)]
+    assert mag.pages(0) == []
+
+
+def evaluated(api):
+    return [(int(params['offset']), int(params['count']))
+            for endpoint, params in api.calls if endpoint == 'evaluate']
+
+
+def test_evaluate_pages_are_requested_on_demand(api):
+    walk = mag.evaluate_pages('expr', 5, page_size=2)
+    assert [e['Id'] for e in next(walk)] == [1, 2]
+    assert evaluated(api) == [(0, 2)]
+    assert [[e['Id'] for e in page] for page in walk] == [[3, 4], [5]]
+    # a short page is the last one
+    api.calls = []
+    assert len(list(mag.evaluate_pages('expr', 10, page_size=4))) == 2
+    assert evaluated(api) == [(0, 4), (4, 4)]
+
+
+def test_failed_first_page_raises(api):
+    api.fail = True
+    with pytest.raises(mag.UpstreamError):
+        list(mag.evaluate_pages('expr', 5, page_size=2))
@@ -0,0 +1,89 @@
+import concurrent.futures, json, logging
+
+import azure.functions as func
+
+from shared_code import metrics
+
+
+def test_request_collects_stages_and_counts(caplog):
+    caplog.set_level(logging.INFO)
+    with metrics.request('page', query='x') as timings:
+        with metrics.stage('fetch'):
+            metrics.count('bytes', 10)
+        with metrics.stage('fetch'):
+            metrics.count('bytes', 5)
+    # outside of a request only the totals count
+    metrics.count('bytes', 1)
+    assert set(timings.stages) == {'fetch'}
+    assert timings.counts == {'bytes': 15}
+    record = json.loads(caplog.records[-1].getMessage().split(' ', 1)[1])
+    assert record['function'] == 'page' and record['query'] == 'x'
+    assert record['counts'] == {'bytes': 15}
+
+
+def test_timed():
+    @metrics.timed('work')
+    def work(value):
+        return value * 2
+    with metrics.request('page') as timings:
+        assert work(2) == 4
+    assert 'work' in timings.stages
+
+
+def test_threads_report_with_in_context():
+    with metrics.request('page') as timings:
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            executor.submit(metrics.in_context(
+                lambda: metrics.count('chunks'))).result()
+            # a plain submit has no request
+            executor.submit(lambda: metrics.count('lost')).result()
+    assert timings.counts == {'chunks': 1}
+
+
+def test_registry_openmetrics():
+    registry = metrics.Registry()
+    registry.add('fetch', 0.5)
+    registry.add('fetch', 0.25)
+    registry.count('hits', 3)
+    text = registry.openmetrics()
+    assert 'sciencegraph_stage_seconds_sum{stage="fetch"} 0.75' in text
+    assert 'sciencegraph_stage_seconds_count{stage="fetch"} 2' in text
+    assert 'sciencegraph_hits_total 3' in text
+    assert text.endswith('# EOF\n')
+
+
+def test_annotate_adds_server_timing():
+    req = func.HttpRequest(
+        'GET', '/api/x', params={'timing': '1'}, body=b'')
+    with metrics.request('page') as timings:
+        timings.add('fetch', 0.012)
+        response = metrics.annotate(req, func.HttpResponse('ok'), timings)
+    assert response.headers['Server-Timing'].startswith('fetch;dur=12.0, ')
+    assert timings.fields['status'] == 200
+
+
+def test_metrics_endpoint(monkeypatch):
+    import importlib
+    endpoint = importlib.import_module('metrics')
+    req = func.HttpRequest('GET', '/api/metrics', body=b'')
+    assert endpoint.main(req).status_code == 404
+    monkeypatch.setattr(endpoint, 'ENABLED', True)
+    response = endpoint.main(req)
+    assert response.headers['content-type'] == endpoint.CONTENT_TYPE
+    assert response.get_body().endswith(b'# EOF\n')
+
+
+def test_graph_data_logs_nodes_and_edges(api, monkeypatch, caplog):
+    import graph_data
+    from shared_code.cache import PageCache
+    monkeypatch.setattr(graph_data, 'graphs', PageCache())
+    caplog.set_level(logging.INFO)
+    response = graph_data.main(func.HttpRequest(
+        'GET', '/api/graph_data', params={'query': 'x', 'n': '5'},
+        body=b''))
+    assert response.status_code == 200
+    record = json.loads(caplog.records[-1].getMessage().split(' ', 1)[1])
+    assert record['function'] == 'graph_data'
+    nodes = json.loads(response.get_body())['nodes']['id']
+    assert record['counts']['nodes'] == len(nodes)
+    assert record['counts']['edges'] > 0
@@ -0,0 +1,37 @@
+from conftest import paper
+from shared_code.papers import normalize, normalize_entity
+
+
+def test_normalize_entity():
+    p = normalize_entity(paper(1, refs=[2, 3], authors=[7, 8], cc='5'))
+    assert (p.Id, p.title, p.journal, p.year, p.citations, p.DOI) == (
+        1, 'paper 1', 'journal', 2000, 5, '10.0/1')
+    assert p.authors == ((7, 'author 7', ''), (8, 'author 8', ''))
+    assert p.author_names == 'author 7, author 8'
+    assert p.rids == (2, 3)
+
+
+def test_incomplete_entities_are_dropped():
+    missing_journal = dict(paper(1), J={})
+    missing_authors = paper(2)
+    del missing_authors['AA']
+    bad_count = dict(paper(3), CC='many')
+    assert [normalize_entity(e) for e in (
+        missing_journal, missing_authors, bad_count)] == [None] * 3
+
+
+def test_defaults():
+    e = paper(1)
+    del e['DOI'], e['RId']
+    p = normalize_entity(e)
+    assert (p.DOI, p.rids) == ('unknown', ())
+
+
+def test_normalize_collects_references():
+    papers = normalize([
+        paper(1, refs=[3, 2, 4], cc=2), paper(2, refs=[4, 5], cc=7),
+        dict(paper(9, refs=[6]), J=None)])
+    assert [p.Id for p in papers] == [1, 2]
+    assert papers.max_cit == 7
+    # first seen order, without duplicates or the papers themselves
+    assert papers.rids == [3, 4, 5]
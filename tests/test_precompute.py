@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+import graph_data
+import http_request
+from shared_code import precompute
+from shared_code.cache import MISSING, DiskCache, PageCache
+
+
+@pytest.fixture
+def caches(monkeypatch, tmp_path):
+    # page and data caches with disk tiers, like the server's
+    pages = PageCache(disk=DiskCache(str(tmp_path / 'page.sqlite')))
+    graphs = PageCache(disk=DiskCache(str(tmp_path / 'data.sqlite')))
+    monkeypatch.setattr(http_request, 'pages', pages)
+    monkeypatch.setattr(graph_data, 'graphs', graphs)
+    return pages, graphs
+
+
+def test_read_queries(tmp_path):
+    path = tmp_path / 'queries.tsv'
+    path.write_text(
+        '# popular\nmeta  surface\t500\n\nsomeone\t\tauthors\n'
+        'someone\t5\tcollaboration\nmeta surface\t500\n')
+    assert precompute.read_queries(str(path)) == [
+        ('meta surface', 100, 'publications'), ('someone', 'A', 'authors'),
+        ('someone', 'C', 'collaboration')]
+    path.write_text('x\t5\tcitations\n')
+    with pytest.raises(ValueError):
+        precompute.read_queries(str(path))
+
+
+def test_read_progress(tmp_path):
+    path = tmp_path / 'queries.tsv.progress'
+    path.write_text(''.join(json.dumps(dict(
+        query=q, n=5, mode='publications', status=status)) + '\n'
+        for q, status in [('a', 'ok'), ('b', 'error'), ('c', 'empty')]))
+    assert precompute.read_progress(str(path)) == {('a', 5, 'publications')}
+
+
+def test_warm_writes_the_disk_tiers(api, caches):
+    pages, graphs = caches
+    result = precompute.warm('x', 5, 'publications')
+    assert result['status'] == 'ok'
+    assert pages.disk.get(json.dumps(['x', 5])) is not MISSING
+    assert graphs.disk.get(json.dumps(['x', 5, False, 'json'])) is not MISSING
+
+
+def test_warm_renders_fresh_entries_again(api, caches):
+    pages, _ = caches
+    precompute.warm('x', 5, 'publications')
+    created = pages.disk.get(json.dumps(['x', 5]))['created']
+    precompute.warm('x', 5, 'publications')
+    assert pages.disk.get(json.dumps(['x', 5]))['created'] > created
+
+
+def test_warm_without_results(api, caches):
+    api.primaries = []
+    assert precompute.warm('x', 5, 'publications')['status'] == 'empty'
+    assert caches[0].disk.get(json.dumps(['x', 5])) is MISSING
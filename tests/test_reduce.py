@@ -0,0 +1,73 @@
+import numpy as np
+
+from shared_code.csr import GraphBuilder
+from shared_code.reduce import cap_edges, label_propagation, reduce_graph
+
+
+def build(n, pairs, primary=()):
+    builder = GraphBuilder()
+    for id in range(n):
+        builder.add_node(
+            id, type='Primary' if id in primary else 'Reference',
+            color='', title=str(id), authors='', journal='', year=2000,
+            DOI='', size=8, weight=1)
+    builder.add_edges_from(pairs)
+    return builder.build()
+
+
+def test_cap_edges_keeps_the_best_of_either_end():
+    # a star with one more edge between two leaves: the leaves rank the
+    # hub first, so the hub keeps all its edges with k=1 and the extra
+    # edge, second for both its ends, goes
+    star = build(6, [(0, i) for i in range(1, 6)] + [(1, 2)])
+    keep = cap_edges(star, star.degree().astype(float), 1)
+    assert star.edges[keep].tolist() == [[0, i] for i in range(1, 6)]
+
+
+def test_cap_edges_bounds_the_edges():
+    rng = np.random.default_rng(0)
+    pairs = rng.integers(0, 100, size=(2000, 2))
+    graph = build(100, pairs.tolist())
+    keep = cap_edges(graph, graph.degree().astype(float), 3)
+    assert keep.sum() <= 3 * len(graph)
+    # every node keeps an edge
+    assert set(graph.edges[keep].ravel()) == set(range(100))
+
+
+def test_label_propagation_finds_cliques():
+    cliques = [(a, b) for c in (0, 5) for a in range(c, c + 5)
+               for b in range(a + 1, c + 5)]
+    labels = label_propagation(build(10, cliques + [(4, 5)]))
+    assert len(set(labels[:5])) == 1 and len(set(labels[5:])) == 1
+    assert labels[0] != labels[9]
+
+
+def test_small_graph_is_kept():
+    graph = build(5, [(0, i) for i in range(1, 5)])
+    reduced = reduce_graph(graph)
+    assert reduced.ids.tolist() == graph.ids.tolist()
+    assert reduced.number_of_edges() == 4
+
+
+def test_collapsed_nodes_form_clusters():
+    # two stars of primaries 0 and 1 with 20 references each
+    pairs = [(hub, 2 + 20 * hub + i) for hub in (0, 1) for i in range(20)]
+    graph = build(42, pairs, primary=(0, 1))
+    reduced = reduce_graph(
+        graph, primary='Primary', max_nodes=20, max_clusters=2,
+        noun='papers')
+    assert len(reduced) == 20
+    assert {0, 1} <= set(reduced.ids.tolist())
+    types = reduced.columns['type']
+    clusters = [i for i, t in enumerate(types) if t == 'Cluster']
+    assert len(clusters) == 2
+    assert all(reduced.ids[i] < 0 for i in clusters)
+    titles = [reduced.columns['title'][i] for i in clusters]
+    assert all(title.endswith(' collapsed papers') for title in titles)
+    assert sum(int(title.split()[0]) for title in titles) == 42 - 18
+
+
+def test_cluster_titles_name_the_nodes():
+    graph = build(30, [(0, i) for i in range(1, 30)])
+    reduced = reduce_graph(graph, max_nodes=10, max_clusters=1)
+    assert reduced.columns['title'][-1] == '21 collapsed nodes'
@@ -0,0 +1,61 @@
+import io, json
+
+import numpy as np
+
+from shared_code import data, render
+from shared_code.csr import CSRGraph
+
+
+def graph():
+    return CSRGraph(
+        [100, 200, 300],
+        {'type': ['a', 'b', 'a'], 'title': ['x', 'y', 'z'],
+         'weight': np.array([1, 70000, 3])},
+        [(0, 1), (1, 2)], np.array([1, 4]))
+
+
+def test_compact():
+    assert render.compact([0, 255]).dtype == np.uint8
+    assert render.compact([-1, 127]).dtype == np.int8
+    assert render.compact([0, 70000]).dtype == np.uint32
+    # bokeh has no 64 bit buffers
+    assert render.compact([0, 2**40]).dtype == np.float64
+    assert render.compact([]).dtype == np.uint8
+
+
+def test_node_data_codes_categories():
+    nodes, categories = render.node_data(graph(), categorical=('type',))
+    assert categories == {'type': ['a', 'b']}
+    assert nodes['type'].tolist() == [0, 1, 0]
+    assert nodes['title'] == ['x', 'y', 'z']
+    assert nodes['weight'].dtype == np.uint32
+    assert nodes['index'].tolist() == [0, 1, 2]
+
+
+def test_edge_data_widths():
+    edges = render.edge_data(graph())
+    assert (edges['start'].tolist(), edges['end'].tolist()) == (
+        [0, 1], [1, 2])
+    assert edges['width'].tolist() == [1, 3]
+
+
+def test_graph_data_is_json():
+    payload = render.graph_data(graph(), categorical=('type',))
+    decoded = json.loads(json.dumps(payload))
+    assert decoded['nodes']['type'] == [0, 1, 0]
+    assert sorted(decoded['layout']) == ['0', '1', '2']
+
+
+def test_categorical_only_when_values_repeat():
+    assert data.categorical(['a', 'a', 'a', 'b']) == {
+        'categories': ['a', 'b'], 'codes': [0, 0, 0, 1]}
+    assert data.categorical(['a', 'b', 'c']) == ['a', 'b', 'c']
+
+
+def test_json_and_npz_agree():
+    g = graph()
+    columns = json.loads(data.to_json(g, 'expr'))
+    arrays = np.load(io.BytesIO(data.to_npz(g, 'expr')))
+    assert columns['nodes']['id'] == arrays['id'].tolist()
+    assert np.allclose(columns['nodes']['x'], arrays['x'], atol=1e-4)
+    assert columns['edges']['weight'] == arrays['edge_weight'].tolist()
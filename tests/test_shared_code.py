@@ -0,0 +1,26 @@
+import os, shutil, sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import sync_shared_code  # noqa: E402
+
+
+def test_webapp_copy_is_in_sync():
+    # run python sync_shared_code.py after changing shared_code
+    for copy in sync_shared_code.COPIES:
+        assert sync_shared_code.differences(
+            sync_shared_code.SOURCE, copy) == []
+
+
+def test_differences(tmp_path):
+    copy = str(tmp_path / 'shared_code')
+    shutil.copytree(
+        sync_shared_code.SOURCE, copy,
+        ignore=shutil.ignore_patterns(*sync_shared_code.IGNORE))
+    assert sync_shared_code.differences(sync_shared_code.SOURCE, copy) == []
+    with open(os.path.join(copy, 'mag.py'), 'a') as f:
+        f.write('# changed\n')
+    os.remove(os.path.join(copy, 'params.py'))
+    assert sync_shared_code.differences(sync_shared_code.SOURCE, copy) == [
+        'mag.py', 'params.py']
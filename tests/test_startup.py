@@ -0,0 +1,58 @@
+import json, os, subprocess, sys
+
+from shared_code.cache import DiskCache, PageCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('bokeh', 'networkx', 'numpy', 'scipy', 'jinja2')
+
+
+def loaded(directory, code, **env):
+    # the heavy modules loaded after running code in a fresh interpreter
+    probe = code + '\nimport json, sys\nprint(json.dumps([m for m in {0!r} ' \
+        'if m in sys.modules]))'.format(HEAVY)
+    out = subprocess.run(
+        [sys.executable, '-c', probe], cwd=os.path.join(ROOT, directory),
+        env=dict(os.environ, **env), capture_output=True, text=True,
+        check=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def cached_pages(tmp_path, key, body):
+    # a PAGE_CACHE_DIR holding one page
+    directory = str(tmp_path / 'pages')
+    os.makedirs(directory)
+    PageCache(disk=DiskCache(
+        os.path.join(directory, 'page_cache.sqlite'))).put(key, body)
+    return directory
+
+
+def test_webapp_starts_without_the_plotting_stack():
+    # flask brings jinja2
+    assert loaded(
+        'azure_webapp', 'import application', WEBAPP_WARM='0') == ['jinja2']
+
+
+def test_webapp_serves_a_cached_page_without_plotting(tmp_path):
+    directory = cached_pages(tmp_path, ('metasurface', 20), 'cached page')
+    assert loaded(
+        'azure_webapp', 'import application\n'
+        'body = application.app.test_client().get("/").data\n'
+        'assert body == b"cached page", body',
+        WEBAPP_WARM='0', PAGE_CACHE_DIR=directory,
+        MAG_API_URL='http://127.0.0.1:9') == ['jinja2']
+
+
+def test_function_imports_are_light():
+    assert loaded('azure_function', 'import http_request, graph_data') == []
+
+
+def test_function_serves_a_cached_page_without_plotting(tmp_path):
+    directory = cached_pages(tmp_path, ('metasurface', 20), 'cached page')
+    assert loaded(
+        'azure_function', 'import asyncio\n'
+        'import azure.functions as func\n'
+        'import http_request\n'
+        'response = asyncio.run(http_request.main(func.HttpRequest(\n'
+        '    "GET", "/api/http_request", params={}, body=b"")))\n'
+        'assert response.get_body() == b"cached page"',
+        PAGE_CACHE_DIR=directory, MAG_API_URL='http://127.0.0.1:9') == []
@@ -0,0 +1,105 @@
+import importlib, os
+
+from conftest import paper
+from shared_code import ingest
+from shared_code.store import EntityStore, GraphStore
+
+
+def graph_store(tmp_path, entities=()):
+    store = GraphStore(str(tmp_path / 'graph.sqlite'))
+    store.add_entities(entities)
+    store.create_indexes()
+    return store
+
+
+def test_entity_store_remembers_unknown_ids(tmp_path):
+    store = EntityStore(str(tmp_path / 'store.sqlite'))
+    store.put_many([paper(1)], unknown=[2])
+    assert store.get_many([1, 2, 3]) == {1: paper(1), 2: None}
+
+
+
+def rows(store):
+    return store._db.execute('SELECT Id FROM papers ORDER BY Id').fetchall()
+
+
+def test_entity_store_prunes_on_open_and_every_n_writes(tmp_path):
+    path = str(tmp_path / 'store.sqlite')
+    store = EntityStore(path, prune_every=2)
+    store.put_many([paper(1), paper(2)])
+    with store._db:
+        store._db.execute('UPDATE papers SET fetched = 0 WHERE Id = 1')
+    assert EntityStore(path).get_many([1, 2]) == {2: paper(2)}
+    assert rows(EntityStore(path)) == [(2,)]
+    with store._db:
+        store._db.execute('UPDATE papers SET fetched = 0')
+    store.put_many([paper(3)])
+    assert rows(store) == [(3,)]
+
+
+def test_entity_store_defaults_to_home(tmp_path, monkeypatch):
+    monkeypatch.delenv('MAG_STORE', raising=False)
+    monkeypatch.setenv('HOME', str(tmp_path))
+    from shared_code import store
+    importlib.reload(store)
+    try:
+        assert store.STORE_PATH.startswith(str(tmp_path))
+        store.EntityStore().put_many([paper(1)])
+        assert os.path.exists(store.STORE_PATH)
+    finally:
+        monkeypatch.undo()
+        importlib.reload(store)
+
+def test_graph_store_answers_entities(tmp_path):
+    store = graph_store(tmp_path, [
+        paper(1, refs=[2, 3], authors=[7, 8]), paper(2, authors=[8])])
+    first, second = store.fetch([1, 2, 4])
+    assert first['RId'] == [2, 3]
+    assert [a['AuId'] for a in first['AA']] == [7, 8]
+    assert second['RId'] == []
+
+
+def test_partial_dump(tmp_path):
+    # references and authorships of papers missing from the papers table
+    store = graph_store(tmp_path, [paper(1, refs=[2])])
+    store.add_references([(2, 3)])
+    store.add_authorships([(2, 9, 0, 'author 9', '')])
+    assert store.fetch([2]) == []
+    assert [e['Id'] for e in store.fetch([1, 2])] == [1]
+
+
+def test_ingest_twice(tmp_path):
+    entities = [paper(1, refs=[2], authors=[7]), paper(2, authors=[7])]
+    store = graph_store(tmp_path, entities)
+    store.add_entities(entities)
+    store.add_authorships([(1, 7, 1, 'author 7', 'second affiliation')])
+    e = store.fetch([1])[0]
+    assert e['RId'] == [2]
+    assert e['AA'] == [{'AuId': 7, 'DAuN': 'author 7', 'DAfN': ''}]
+    expr, found = store.search('paper', 10)
+    assert sorted(e['Id'] for e in found) == [1, 2]
+
+
+def test_authorships_without_auid_are_dropped(tmp_path):
+    store = graph_store(tmp_path, [paper(1)])
+    store.add_entities([dict(paper(2), AA=[{'DAuN': 'nobody'}])])
+    store.add_authorships([(1, None, 0, 'nobody', '')])
+    assert [e['AA'] for e in store.fetch([1, 2])] == [[], []]
+
+
+def test_ingest_mag_tables(tmp_path):
+    papers = tmp_path / 'Papers.txt'
+    row = [''] * 22
+    row[0], row[5], row[7], row[19], row[21] = '1', 'a title', '2001', '5', 'J'
+    papers.write_text('\t'.join(row) + '\n')
+    references = tmp_path / 'PaperReferences.txt'
+    references.write_text('1\t2\n1\t2\n2\t3\n')
+    authors = tmp_path / 'PaperAuthorAffiliations.txt'
+    authors.write_text('1\t7\t\t0\tsomeone\t\n1\t\t\t1\tnobody\t\n')
+    store = GraphStore(str(tmp_path / 'graph.sqlite'))
+    ingest.ingest(store, papers=[str(papers)], references=[str(references)],
+                  authors=[str(authors)])
+    e, = store.fetch([1, 2])
+    assert e['RId'] == [2]
+    assert [a['AuId'] for a in e['AA']] == [7]
+    assert store.search('someone', 10, mode='authors')[1] == [e]